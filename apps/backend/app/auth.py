@@ -1,12 +1,16 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import time
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Dict
 
 import httpx
 from fastapi import Depends, HTTPException, Request
-from jose import jwt
+from jose import jwk, jwt
+from jose.backends.base import Key
 
 from .settings import settings
 
@@ -18,50 +22,180 @@ class AuthUser:
     raw: dict[str, Any]
 
 
-_jwks_cache: dict[str, Any] | None = None
-_jwks_cache_exp: float = 0.0
-
+# =====================================================
+# CLAVES JWKS
+# =====================================================
+
+class JWKSCache:
+    """
+    Claves públicas de Supabase indexadas por `kid`, ya construidas para verificar.
+
+    - Un único cliente HTTP keep-alive por proceso.
+    - Single-flight: aunque lleguen muchas peticiones a la vez, solo hay una descarga en curso.
+    - Al caducar se siguen usando las claves actuales y se refrescan en segundo plano.
+    """
+
+    def __init__(self, url: str, ttl_seconds: float, min_refresh_seconds: float, timeout: float):
+        self.url = url
+        self.ttl_seconds = ttl_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self.timeout = timeout
+        self._keys: Dict[str, Key] = {}
+        self._fetched_at = 0.0
+        self._attempted_at = 0.0
+        self._refresh: asyncio.Task | None = None
+        self._http: httpx.AsyncClient | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @classmethod
+    def from_settings(cls) -> "JWKSCache":
+        return cls(
+            url=settings.supabase_jwks_url,
+            ttl_seconds=settings.auth_jwks_ttl_seconds,
+            min_refresh_seconds=settings.auth_jwks_min_refresh_seconds,
+            timeout=settings.auth_jwks_timeout_seconds,
+        )
 
-async def _get_jwks() -> dict[str, Any]:
-    global _jwks_cache, _jwks_cache_exp
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        # El pool httpx y la tarea de refresco quedan ligados al loop donde se crearon
+        if self._http is None or self._loop is not loop:
+            self._http = httpx.AsyncClient(timeout=self.timeout)
+            self._loop = loop
+            self._refresh = None
+        return self._http
+
+    async def _fetch(self) -> None:
+        resp = await self._client().get(self.url)
+        resp.raise_for_status()
+        keys: Dict[str, Key] = {}
+        for data in resp.json().get("keys", []):
+            kid = data.get("kid")
+            if not kid:
+                continue
+            try:
+                keys[kid] = jwk.construct(data, data.get("alg") or "RS256")
+            except Exception:
+                # Claves de algoritmos que no usamos
+                continue
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+
+    def refresh(self) -> asyncio.Task:
+        """Lanza la descarga si no hay una en curso y devuelve la tarea compartida"""
+        self._client()
+        if self._refresh is None or self._refresh.done():
+            self._attempted_at = time.monotonic()
+            self._refresh = asyncio.create_task(self._fetch())
+            # Evita el aviso "exception was never retrieved" en refrescos en segundo plano
+            self._refresh.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._refresh
+
+    async def get_key(self, kid: str) -> Key | None:
+        if not self.url:
+            raise HTTPException(status_code=500, detail="Server misconfigured: SUPABASE_JWKS_URL is missing")
+
+        now = time.monotonic()
+        # Tras un fallo se reintenta como mucho una vez cada min_refresh_seconds
+        can_refresh = now - self._attempted_at >= self.min_refresh_seconds
+        if self._keys and now - self._fetched_at >= self.ttl_seconds and can_refresh:
+            self.refresh()
+
+        key = self._keys.get(kid)
+        if key is not None:
+            return key
+
+        # Sin claves todavía, o `kid` desconocido (rotación): esperar a la descarga compartida.
+        # El límite de frecuencia evita que tokens con `kid` inventado disparen descargas
+        in_flight = self._refresh is not None and not self._refresh.done()
+        if not self._keys or can_refresh or in_flight:
+            await asyncio.shield(self.refresh())
+        return self._keys.get(kid)
+
+    async def aclose(self) -> None:
+        if self._refresh is not None and not self._refresh.done():
+            self._refresh.cancel()
+        if self._http is not None and self._loop is asyncio.get_running_loop():
+            await self._http.aclose()
+        self._http = None
+        self._loop = None
+        self._refresh = None
+
+
+# =====================================================
+# CACHÉ DE TOKENS VERIFICADOS
+# =====================================================
+
+class ClaimsCache:
+    """
+    LRU de tokens ya verificados, indexado por el hash del token.
+    Cada entrada caduca en el `exp` del propio token: un token repetido
+    no vuelve a verificar la firma hasta entonces.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple[float, AuthUser]]" = OrderedDict()
+
+    @staticmethod
+    def make_key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> AuthUser | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if time.time() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return user
+
+    def set(self, key: str, user: AuthUser) -> None:
+        exp = user.raw.get("exp")
+        if self.max_entries <= 0 or not isinstance(exp, (int, float)):
+            return
+        self._entries[key] = (float(exp), user)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+jwks_cache = JWKSCache.from_settings()
+claims_cache = ClaimsCache(settings.auth_claims_cache_max_entries)
+
+
+async def warm_jwks() -> None:
+    """Descarga las claves al arrancar para que la primera petición no espere"""
     if not settings.supabase_jwks_url:
-        raise HTTPException(status_code=500, detail="Server misconfigured: SUPABASE_JWKS_URL is missing")
-    now = time.time()
-    if _jwks_cache is not None and now < _jwks_cache_exp:
-        return _jwks_cache
+        return
+    try:
+        await jwks_cache.refresh()
+    except Exception as e:
+        print(f"Could not pre-load JWKS: {str(e)}")
 
-    async with httpx.AsyncClient(timeout=10) as client:
-        resp = await client.get(settings.supabase_jwks_url)
-        resp.raise_for_status()
-        _jwks_cache = resp.json()
-        _jwks_cache_exp = now + 60 * 10  # 10 min
-        return _jwks_cache
 
+async def close_auth_client() -> None:
+    await jwks_cache.aclose()
 
-async def get_current_user(request: Request) -> AuthUser:
-    auth = request.headers.get("authorization") or ""
-    if not auth.lower().startswith("bearer "):
-        raise HTTPException(status_code=401, detail="Missing bearer token")
-    token = auth.split(" ", 1)[1].strip()
-    if not token:
-        raise HTTPException(status_code=401, detail="Missing bearer token")
 
+async def _verify(token: str) -> AuthUser:
     try:
         header = jwt.get_unverified_header(token)
         kid = header.get("kid")
         if not kid:
             raise HTTPException(status_code=401, detail="Invalid token header")
 
-        jwks = await _get_jwks()
-        keys = jwks.get("keys", [])
-        key = next((k for k in keys if k.get("kid") == kid), None)
-        if key is None:
-            # Refresh once if key rotated
-            global _jwks_cache_exp
-            _jwks_cache_exp = 0
-            jwks = await _get_jwks()
-            keys = jwks.get("keys", [])
-            key = next((k for k in keys if k.get("kid") == kid), None)
+        try:
+            key = await jwks_cache.get_key(kid)
+        except HTTPException:
+            raise
+        except Exception:
+            raise HTTPException(status_code=503, detail="Could not fetch signing keys")
         if key is None:
             raise HTTPException(status_code=401, detail="Unknown signing key")
 
@@ -84,5 +218,20 @@ async def get_current_user(request: Request) -> AuthUser:
     return AuthUser(id=sub, email=payload.get("email"), raw=payload)
 
 
-CurrentUser = Depends(get_current_user)
+async def get_current_user(request: Request) -> AuthUser:
+    auth = request.headers.get("authorization") or ""
+    if not auth.lower().startswith("bearer "):
+        raise HTTPException(status_code=401, detail="Missing bearer token")
+    token = auth.split(" ", 1)[1].strip()
+    if not token:
+        raise HTTPException(status_code=401, detail="Missing bearer token")
 
+    cache_key = claims_cache.make_key(token)
+    user = claims_cache.get(cache_key)
+    if user is None:
+        user = await _verify(token)
+        claims_cache.set(cache_key, user)
+    return user
+
+
+CurrentUser = Depends(get_current_user)
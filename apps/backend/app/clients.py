@@ -1,10 +1,122 @@
-from supabase import Client, create_client
+from __future__ import annotations
 
+import threading
+from typing import Any, Dict
+
+from fastapi import HTTPException
+from supabase import Client, ClientOptions, create_client
+
+from .services.ai_service import AIService
+from .services.llm_client import LLMClient, close_llm_client, get_llm_client
 from .settings import settings
 
 
+class ClientRegistry:
+    """
+    Clientes externos compartidos por proceso (Supabase, LLM, AIService).
+
+    - Se crean una sola vez, al arrancar la API (lifespan) o en el primer uso (worker).
+    - Las rutas los reciben con dependencias, así no hay handshakes TLS por petición.
+    - `override` permite sustituirlos por dobles locales en pruebas y benchmarks.
+    """
+
+    def __init__(self):
+        self._supabase: Client | None = None
+        self._ai_service: AIService | None = None
+        self._overrides: Dict[str, Any] = {}
+        # El worker descarga archivos desde varios hilos
+        self._lock = threading.Lock()
+
+    def supabase(self) -> Client:
+        if "supabase" in self._overrides:
+            return self._overrides["supabase"]
+        if self._supabase is None:
+            if not settings.supabase_url or not settings.supabase_service_role_key:
+                raise RuntimeError("Server misconfigured: SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY missing")
+            with self._lock:
+                if self._supabase is None:
+                    self._supabase = create_client(
+                        settings.supabase_url,
+                        settings.supabase_service_role_key,
+                        options=ClientOptions(
+                            auto_refresh_token=False,
+                            persist_session=False,
+                            storage_client_timeout=settings.supabase_storage_timeout_seconds,
+                            postgrest_client_timeout=settings.supabase_postgrest_timeout_seconds,
+                        ),
+                    )
+        return self._supabase
+
+    def llm(self) -> LLMClient:
+        if "llm" in self._overrides:
+            return self._overrides["llm"]
+        # Un pool por event loop (ver get_llm_client)
+        return get_llm_client()
+
+    def ai_service(self) -> AIService:
+        if "ai_service" in self._overrides:
+            return self._overrides["ai_service"]
+        if self._ai_service is None:
+            self._ai_service = AIService(llm=self.llm)
+        return self._ai_service
+
+    def override(self, **clients: Any) -> None:
+        """Sustituye clientes por nombre: supabase, llm, ai_service"""
+        self._overrides.update(clients)
+
+    def is_overridden(self, name: str) -> bool:
+        return name in self._overrides
+
+    def clear_overrides(self) -> None:
+        self._overrides.clear()
+
+    async def startup(self) -> None:
+        """Crea los clientes del proceso dentro del event loop de la API"""
+        self.llm()
+        self.ai_service()
+        if settings.supabase_url and settings.supabase_service_role_key:
+            try:
+                self.supabase()
+            except Exception as e:
+                # No impide arrancar: las rutas que lo usan devolverán el error
+                print(f"Could not create Supabase client: {str(e)}")
+
+    async def shutdown(self) -> None:
+        await close_llm_client()
+        self._ai_service = None
+        client, self._supabase = self._supabase, None
+        if client is not None:
+            # Solo se cierran los subclientes que llegaron a crearse
+            for sub in (getattr(client, "_storage", None), getattr(client, "_postgrest", None)):
+                session = getattr(sub, "session", None)
+                if session is not None:
+                    session.close()
+
+
+clients = ClientRegistry()
+
+
 def supabase_admin() -> Client:
-    if not settings.supabase_url or not settings.supabase_service_role_key:
-        raise RuntimeError("Server misconfigured: SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY missing")
-    return create_client(settings.supabase_url, settings.supabase_service_role_key)
+    return clients.supabase()
+
+
+# =====================================================
+# DEPENDENCIAS PARA LAS RUTAS
+# =====================================================
+
+def get_supabase() -> Client:
+    try:
+        return clients.supabase()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def get_llm() -> LLMClient:
+    # Asíncrona: el cliente se resuelve en el event loop de la petición, no en el threadpool
+    if not settings.groq_api_key and not settings.llm_local_base_url and not clients.is_overridden("llm"):
+        raise HTTPException(status_code=500, detail="Server misconfigured: GROQ_API_KEY or LLM_LOCAL_BASE_URL is missing")
+    return clients.llm()
+
 
+def get_ai_service() -> AIService:
+    return clients.ai_service()
@@ -1,25 +1,160 @@
-from sqlalchemy import create_engine
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .settings import settings
 
 # URL de conexión a la base de datos
-# Para desarrollo local, usar SQLite. Para producción, configurar DATABASE_URL con la URL de Supabase
-DATABASE_URL = "sqlite:///./uni_ai.db"  # Forzar SQLite para desarrollo local
+# Para desarrollo local, SQLite. Para producción, configurar DATABASE_URL con la URL de Supabase (Postgres)
+DATABASE_URL = settings.database_url or f"sqlite:///{settings.sqlite_path}"
+
+
+def sync_database_url(url: str) -> str:
+    """SQLAlchemy 2 no acepta el esquema postgres:// que dan Supabase/Heroku"""
+    if url.startswith("postgres://"):
+        return "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def async_database_url(url: str) -> str:
+    """Misma base de datos con el driver asíncrono (aiosqlite / asyncpg)"""
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    if url.startswith("postgres://"):
+        return "postgresql+asyncpg://" + url[len("postgres://"):]
+    if url.startswith("postgresql://") or url.startswith("postgresql+psycopg2://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    return url
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _pool_options(url: str, pool_size: int) -> dict:
+    # SQLite en memoria no admite más de una conexión
+    if _is_sqlite(url) and ":memory:" in url:
+        return {}
+    options = {
+        "pool_size": pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout_seconds,
+    }
+    if not _is_sqlite(url):
+        options.update(pool_pre_ping=True, pool_recycle=settings.db_pool_recycle_seconds)
+    return options
+
+
+def _postgres_connect_args(url: str, read_only: bool) -> dict:
+    """statement_timeout (y modo solo lectura) fijados al abrir cada conexión"""
+    server_settings = {}
+    if settings.db_statement_timeout_ms:
+        server_settings["statement_timeout"] = str(settings.db_statement_timeout_ms)
+    if read_only:
+        server_settings["default_transaction_read_only"] = "on"
+    if not server_settings:
+        return {}
+
+    if "+asyncpg" in url:
+        return {"server_settings": server_settings}
+    return {"options": " ".join(f"-c {name}={value}" for name, value in server_settings.items())}
+
+
+def _install_sqlite_pragmas(sync_engine: Engine, read_only: bool) -> None:
+    """WAL y ajustes de rendimiento en cada conexión nueva del pool"""
+
+    @event.listens_for(sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL: los lectores no bloquean al escritor ni al revés
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+        # Valor negativo = tamaño en KiB
+        cursor.execute(f"PRAGMA cache_size=-{int(settings.sqlite_cache_size_kib)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size_bytes)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
 
-engine = create_engine(DATABASE_URL, echo=False)
+def make_engine(url: str, read_only: bool = False, pool_size: Optional[int] = None) -> Engine:
+    url = sync_database_url(url)
+    options = _pool_options(url, pool_size or settings.db_pool_size)
+    if not _is_sqlite(url):
+        options["connect_args"] = _postgres_connect_args(url, read_only)
+
+    new_engine = create_engine(url, echo=False, **options)
+    if _is_sqlite(url):
+        _install_sqlite_pragmas(new_engine, read_only)
+    return new_engine
+
+
+def make_async_engine(url: str, read_only: bool = False, pool_size: Optional[int] = None) -> AsyncEngine:
+    url = async_database_url(url)
+    options = _pool_options(url, pool_size or settings.db_pool_size)
+    if _is_sqlite(url):
+        # aiosqlite usa NullPool por defecto: reutilizar conexiones evita reabrir
+        # el archivo y repetir los pragmas en cada petición
+        if options:
+            options["poolclass"] = AsyncAdaptedQueuePool
+    else:
+        options["connect_args"] = _postgres_connect_args(url, read_only)
+
+    new_engine = create_async_engine(url, echo=False, **options)
+    if _is_sqlite(url):
+        _install_sqlite_pragmas(new_engine.sync_engine, read_only)
+    return new_engine
+
+
+# Motor síncrono: lo usan el worker de Celery y create_tables
+engine = make_engine(DATABASE_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Motor asíncrono: lo usan los routers de la API
+async_engine = make_async_engine(DATABASE_URL)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Pool de solo lectura (opcional) para endpoints de lectura intensiva
+read_async_engine: Optional[AsyncEngine] = None
+ReadAsyncSessionLocal = AsyncSessionLocal
+if settings.db_read_pool_enabled:
+    read_async_engine = make_async_engine(
+        settings.database_read_url or DATABASE_URL,
+        read_only=True,
+        pool_size=settings.db_read_pool_size,
+    )
+    ReadAsyncSessionLocal = async_sessionmaker(read_async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
-def get_db() -> Session:
-    db = SessionLocal()
-    try:
+
+async def get_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_read_db() -> AsyncIterator[AsyncSession]:
+    """Sesión para endpoints que solo leen; usa el pool de solo lectura si está activo"""
+    async with ReadAsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+async def dispose_engines() -> None:
+    await async_engine.dispose()
+    if read_async_engine is not None:
+        await read_async_engine.dispose()
+    engine.dispose()
+
 
 # Función para crear todas las tablas
 def create_tables():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
@@ -1,17 +1,43 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from .settings import settings
-from .database import create_tables
+from .auth import close_auth_client, warm_jwks
+from .pagination import NEXT_CURSOR_HEADER, PREV_CURSOR_HEADER
+from .database import create_tables, dispose_engines
+from .clients import clients
 from .routes.health import router as health_router
 from .routes.storage import router as storage_router
 from .routes.chat import router as chat_router
 from .routes.tasks import router as tasks_router
 from .routes.subjects import router as subjects_router
 from .routes.chats import router as chats_router
+from .routes.jobs import router as jobs_router
+from .routes.flashcards import router as flashcards_router
+from .routes.quizzes import router as quizzes_router
+from .services.uploads import upload_store
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Crear tablas en la base de datos al iniciar
+    create_tables()
+    # Clientes externos: uno por proceso, cerrados al apagar
+    await clients.startup()
+    await warm_jwks()
+    # Subidas por partes abandonadas: el staging está en el disco de este proceso
+    purge_uploads = asyncio.create_task(upload_store.purge_periodically(settings.upload_purge_interval_seconds))
+    yield
+    purge_uploads.cancel()
+    await clients.shutdown()
+    await close_auth_client()
+    await dispose_engines()
 
 
-app = FastAPI(title="UniAI Backend", version="0.1.0")
+app = FastAPI(title="UniAI Backend", version="0.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,6 +45,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, PREV_CURSOR_HEADER],
 )
 
 app.include_router(health_router)
@@ -27,9 +54,6 @@ app.include_router(chat_router)
 app.include_router(tasks_router)
 app.include_router(subjects_router)
 app.include_router(chats_router)
-
-# Crear tablas en la base de datos al iniciar
-@app.on_event("startup")
-async def startup_event():
-    create_tables()
-
+app.include_router(jobs_router)
+app.include_router(flashcards_router)
+app.include_router(quizzes_router)
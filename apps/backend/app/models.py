@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey, Table, Date, Interval
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Boolean, Float, ForeignKey, Table, Date, Interval, Uuid
 from sqlalchemy.dialects.postgresql import UUID, JSONB, ARRAY
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
@@ -7,6 +7,14 @@ import uuid
 
 Base = declarative_base()
 
+# Tabla gestionada por Supabase Auth; se declara solo para resolver la FK de profiles
+auth_users = Table(
+    "users",
+    Base.metadata,
+    Column("id", UUID(as_uuid=True), primary_key=True),
+    schema="auth",
+)
+
 # =====================================================
 # TABLAS PRINCIPALES
 # =====================================================
@@ -35,12 +43,16 @@ class Profile(Base):
     chats = relationship("Chat", back_populates="user")
     chat_messages = relationship("ChatMessage", back_populates="user")
 
+    __table_args__ = (
+        {'schema': 'public'}
+    )
+
 
 class Subject(Base):
     __tablename__ = "subjects"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("profiles.id"), nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("public.profiles.id"), nullable=False)
     name = Column(String, nullable=False)
     code = Column(String)
     color = Column(String, default="#3b82f6")
@@ -68,8 +80,8 @@ class Task(Base):
     __tablename__ = "tasks"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("profiles.id"), nullable=False)
-    subject_id = Column(UUID(as_uuid=True), ForeignKey("subjects.id"))
+    user_id = Column(UUID(as_uuid=True), ForeignKey("public.profiles.id"), nullable=False)
+    subject_id = Column(UUID(as_uuid=True), ForeignKey("public.subjects.id"))
     title = Column(String, nullable=False)
     description = Column(Text)
     task_type = Column(String, default="homework")
@@ -95,6 +107,9 @@ class Task(Base):
     progress_percentage = Column(Integer, default=0)
     notes = Column(Text)
 
+    # Urgencia (0-100) por fecha límite, prioridad, dificultad y duración; la refresca el worker
+    urgency_score = Column(Float)
+
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow)
 
@@ -113,9 +128,9 @@ class StudySession(Base):
     __tablename__ = "study_sessions"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("profiles.id"), nullable=False)
-    subject_id = Column(UUID(as_uuid=True), ForeignKey("subjects.id"))
-    task_id = Column(UUID(as_uuid=True), ForeignKey("tasks.id"))
+    user_id = Column(UUID(as_uuid=True), ForeignKey("public.profiles.id"), nullable=False)
+    subject_id = Column(UUID(as_uuid=True), ForeignKey("public.subjects.id"))
+    task_id = Column(UUID(as_uuid=True), ForeignKey("public.tasks.id"))
 
     title = Column(String, nullable=False)
     description = Column(Text)
@@ -161,8 +176,8 @@ class Flashcard(Base):
     __tablename__ = "flashcards"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("profiles.id"), nullable=False)
-    subject_id = Column(UUID(as_uuid=True), ForeignKey("subjects.id"), nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("public.profiles.id"), nullable=False)
+    subject_id = Column(UUID(as_uuid=True), ForeignKey("public.subjects.id"), nullable=False)
 
     front_content = Column(Text, nullable=False)
     back_content = Column(Text, nullable=False)
@@ -171,7 +186,7 @@ class Flashcard(Base):
     # Metadatos
     difficulty_level = Column(Integer, default=3)
     tags = Column(ARRAY(String), default=list)
-    source_task_id = Column(UUID(as_uuid=True), ForeignKey("tasks.id"))
+    source_task_id = Column(UUID(as_uuid=True), ForeignKey("public.tasks.id"))
     source_material = Column(String)
 
     # Spaced repetition system
@@ -202,9 +217,9 @@ class Quiz(Base):
     __tablename__ = "quizzes"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("profiles.id"), nullable=False)
-    subject_id = Column(UUID(as_uuid=True), ForeignKey("subjects.id"), nullable=False)
-    task_id = Column(UUID(as_uuid=True), ForeignKey("tasks.id"))
+    user_id = Column(UUID(as_uuid=True), ForeignKey("public.profiles.id"), nullable=False)
+    subject_id = Column(UUID(as_uuid=True), ForeignKey("public.subjects.id"), nullable=False)
+    task_id = Column(UUID(as_uuid=True), ForeignKey("public.tasks.id"))
 
     title = Column(String, nullable=False)
     description = Column(Text)
@@ -240,14 +255,24 @@ class Chat(Base):
     __tablename__ = "chats"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("profiles.id"), nullable=False)
-    task_id = Column(UUID(as_uuid=True), ForeignKey("tasks.id"))  # NULL para chat general
-    subject_id = Column(UUID(as_uuid=True), ForeignKey("subjects.id"))
+    user_id = Column(UUID(as_uuid=True), ForeignKey("public.profiles.id"), nullable=False)
+    task_id = Column(UUID(as_uuid=True), ForeignKey("public.tasks.id"))  # NULL para chat general
+    subject_id = Column(UUID(as_uuid=True), ForeignKey("public.subjects.id"))
 
     title = Column(String, nullable=False)
     chat_type = Column(String, default="general")  # "general" or "task"
     is_active = Column(Boolean, default=True)
 
+    # Resumen acumulado de los mensajes que ya no caben en la ventana de historial
+    summary = Column(Text)
+    summary_through_at = Column(DateTime)  # created_at del último mensaje resumido
+    summary_through_id = Column(UUID(as_uuid=True))
+
+    # Proyección del último mensaje (se actualiza al escribir mensajes)
+    last_message_id = Column(UUID(as_uuid=True))
+    last_message_preview = Column(Text)
+    last_message_at = Column(DateTime)
+
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow)
 
@@ -265,8 +290,8 @@ class ChatMessage(Base):
     __tablename__ = "chat_messages"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    chat_id = Column(UUID(as_uuid=True), ForeignKey("chats.id"), nullable=False)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("profiles.id"), nullable=False)
+    chat_id = Column(UUID(as_uuid=True), ForeignKey("public.chats.id"), nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("public.profiles.id"), nullable=False)
 
     role = Column(String, nullable=False)  # "user" or "assistant"
     content = Column(Text, nullable=False)
@@ -290,7 +315,7 @@ class CalendarEvent(Base):
     __tablename__ = "calendar_events"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("profiles.id"), nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("public.profiles.id"), nullable=False)
 
     title = Column(String, nullable=False)
     description = Column(Text)
@@ -305,9 +330,9 @@ class CalendarEvent(Base):
     recurrence_rule = Column(JSONB)
 
     # Relaciones
-    subject_id = Column(UUID(as_uuid=True), ForeignKey("subjects.id"))
-    task_id = Column(UUID(as_uuid=True), ForeignKey("tasks.id"))
-    study_session_id = Column(UUID(as_uuid=True), ForeignKey("study_sessions.id"))
+    subject_id = Column(UUID(as_uuid=True), ForeignKey("public.subjects.id"))
+    task_id = Column(UUID(as_uuid=True), ForeignKey("public.tasks.id"))
+    study_session_id = Column(UUID(as_uuid=True), ForeignKey("public.study_sessions.id"))
 
     # Notificaciones
     reminder_settings = Column(JSONB, default=dict)
@@ -332,7 +357,7 @@ class Achievement(Base):
     __tablename__ = "achievements"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("profiles.id"), nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("public.profiles.id"), nullable=False)
 
     achievement_type = Column(String, nullable=False)
     title = Column(String, nullable=False)
@@ -355,7 +380,7 @@ class DailyStats(Base):
     __tablename__ = "daily_stats"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("profiles.id"), nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("public.profiles.id"), nullable=False)
     date = Column(Date, default=datetime.utcnow().date)
 
     # Tiempos de estudio
@@ -384,4 +409,133 @@ class DailyStats(Base):
 
     __table_args__ = (
         {'schema': 'public'}
-    )
\ No newline at end of file
+    )
+
+# =====================================================
+# DOCUMENTOS INGERIDOS
+# =====================================================
+
+class Document(Base):
+    __tablename__ = "documents"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("public.profiles.id"), nullable=False)
+    task_id = Column(UUID(as_uuid=True), ForeignKey("public.tasks.id"))
+
+    # Ubicación en Storage
+    bucket = Column(String, nullable=False, default="files")
+    path = Column(String, nullable=False)
+    filename = Column(String)
+    mime_type = Column(String)
+
+    # Estado de la ingesta
+    status = Column(String, default="pending")  # "pending", "processing", "ready", "failed"
+    error = Column(Text)
+    size_bytes = Column(BigInteger)
+    page_count = Column(Integer)
+    chunk_count = Column(Integer)
+    content_sha256 = Column(String)  # sha256 del archivo, para reutilizar la ingesta de duplicados
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    # Relaciones
+    chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan")
+
+    __table_args__ = (
+        {'schema': 'public'}
+    )
+
+
+class DocumentChunk(Base):
+    __tablename__ = "document_chunks"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    document_id = Column(UUID(as_uuid=True), ForeignKey("public.documents.id"), nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("public.profiles.id"), nullable=False)
+
+    chunk_index = Column(Integer, nullable=False)
+    page_start = Column(Integer)
+    page_end = Column(Integer)
+    content = Column(Text, nullable=False)
+    content_hash = Column(String, nullable=False)  # sha256 del contenido
+    overlap_chars = Column(Integer, default=0)  # Caracteres iniciales repetidos del chunk anterior
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Relaciones
+    document = relationship("Document", back_populates="chunks")
+
+    __table_args__ = (
+        {'schema': 'public'}
+    )
+
+# =====================================================
+# CONTADORES DE ESTADÍSTICAS
+# =====================================================
+
+class TaskCounter(Base):
+    """Contadores de tareas por usuario y materia, mantenidos por deltas al escribir tareas"""
+    __tablename__ = "task_counters"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("public.profiles.id"), primary_key=True)
+    # UUID nulo (00000000-...) para las tareas sin materia. En SQLite va como CHAR(32):
+    # con el tipo "UUID" la columna tiene afinidad numérica y guardaría el nulo como 0
+    subject_key = Column(UUID(as_uuid=True).with_variant(Uuid(native_uuid=False), "sqlite"), primary_key=True)
+
+    total_tasks = Column(Integer, nullable=False, default=0)
+    completed_tasks = Column(Integer, nullable=False, default=0)
+    pending_tasks = Column(Integer, nullable=False, default=0)
+    # Tareas abiertas con due_date < overdue_as_of; las vencidas después se cuentan al leer
+    overdue_tasks = Column(Integer, nullable=False, default=0)
+    overdue_as_of = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # Última reconciliación completa (NULL en filas creadas solo por deltas)
+    reconciled_at = Column(DateTime)
+
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        {'schema': 'public'}
+    )
+
+
+# =====================================================
+# BANCO DE PREGUNTAS
+# =====================================================
+
+class QuestionBankEntry(Base):
+    """Pregunta de quiz compartida entre usuarios, indexada por materia/tema/dificultad normalizados"""
+    __tablename__ = "question_bank"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # "<materia>|<tema>|<dificultad>" normalizados (ver services/question_bank.bank_key)
+    bank_key = Column(String, nullable=False)
+    subject_name = Column(String)
+    topic = Column(String)
+    difficulty = Column(Integer)
+    question_type = Column(String)
+
+    question = Column(JSONB, nullable=False)  # La pregunta tal como se sirve en quizzes.questions
+    question_hash = Column(String, nullable=False)  # sha256 del enunciado normalizado
+    minhash = Column(ARRAY(BigInteger), nullable=False)  # Firma para detectar casi duplicados
+    source = Column(String, default="generated")  # "generated", "quiz"
+    times_served = Column(Integer, default=0)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        {'schema': 'public'}
+    )
+
+
+class QuestionBankSeen(Base):
+    """Preguntas del banco que ya se sirvieron a cada usuario"""
+    __tablename__ = "question_bank_seen"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("public.profiles.id"), primary_key=True)
+    question_id = Column(UUID(as_uuid=True), ForeignKey("public.question_bank.id"), primary_key=True)
+    seen_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        {'schema': 'public'}
+    )
@@ -0,0 +1,151 @@
+import base64
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Generic, List, Optional, Sequence, Tuple, TypeVar
+from uuid import UUID
+
+from fastapi import HTTPException, Response
+from sqlalchemy import and_, false, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+PREV_CURSOR_HEADER = "X-Prev-Cursor"
+
+T = TypeVar("T")
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+def encode_cursor(*values: Any) -> str:
+    """Cursor opaco con los valores de la clave de ordenación de una fila"""
+    raw = json.dumps([_plain(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, types: Sequence[Callable[[Any], Any]]) -> List[Any]:
+    """Decodifica un cursor y convierte cada valor con su tipo (None se conserva)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("cursor length")
+        return [None if v is None else cast(v) for cast, v in zip(types, values)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# =====================================================
+# PAGINACIÓN KEYSET
+# =====================================================
+
+@dataclass
+class KeyColumn:
+    """Columna de la clave de ordenación. `nullable`: los NULL van al final."""
+    expr: Any
+    descending: bool = False
+    nullable: bool = False
+    cast: Callable[[Any], Any] = lambda value: value
+
+
+@dataclass
+class Page(Generic[T]):
+    items: List[T] = field(default_factory=list)
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+
+def _after(key: KeyColumn, value: Any):
+    """Filas estrictamente posteriores a `value` en el orden de la columna (None: ninguna)"""
+    if value is None:
+        return None
+    condition = key.expr < value if key.descending else key.expr > value
+    if key.nullable:
+        condition = or_(condition, key.expr.is_(None))
+    return condition
+
+
+def _before(key: KeyColumn, value: Any):
+    if value is None:
+        return key.expr.isnot(None)
+    return key.expr > value if key.descending else key.expr < value
+
+
+def _equal(key: KeyColumn, value: Any):
+    return key.expr.is_(None) if value is None else key.expr == value
+
+
+def keyset_condition(keys: Sequence[KeyColumn], values: Sequence[Any], forward: bool = True):
+    """Comparación lexicográfica (k1, k2, ...) > / < (v1, v2, ...) respetando dirección y NULLs"""
+    compare = _after if forward else _before
+    branches = []
+    for position, (key, value) in enumerate(zip(keys, values)):
+        condition = compare(key, value)
+        if condition is None:
+            continue
+        prefix = [_equal(k, v) for k, v in zip(keys[:position], values[:position])]
+        branches.append(and_(*prefix, condition))
+    return or_(*branches) if branches else false()
+
+
+def _order_by(keys: Sequence[KeyColumn], forward: bool) -> list:
+    clauses = []
+    for key in keys:
+        descending = key.descending != (not forward)
+        clause = key.expr.desc() if descending else key.expr.asc()
+        if key.nullable:
+            clause = clause.nulls_last() if forward else clause.nulls_first()
+        clauses.append(clause)
+    return clauses
+
+
+async def paginate(
+    db: AsyncSession,
+    query: Select,
+    keys: Sequence[KeyColumn],
+    row_key: Callable[[Any], Tuple[Any, ...]],
+    cursor: Optional[str],
+    limit: int,
+) -> Page:
+    """
+    Página de `limit` filas siguiendo el orden de `keys`. Los cursores guardan la dirección
+    y la clave de la fila frontera, así cualquier página cuesta lo mismo que la primera.
+    """
+    forward = True
+    if cursor:
+        direction, *values = decode_cursor(cursor, [str] + [k.cast for k in keys])
+        if direction not in ("n", "p"):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        forward = direction == "n"
+        query = query.where(keyset_condition(keys, values, forward))
+
+    rows = list((await db.scalars(query.order_by(*_order_by(keys, forward)).limit(limit + 1))).all())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not forward:
+        rows.reverse()
+
+    page = Page(items=rows)
+    if rows:
+        # Hacia delante: hay siguiente si sobró una fila; hay anterior si llegamos con cursor
+        has_next = has_more if forward else True
+        has_prev = bool(cursor) if forward else has_more
+        if has_next:
+            page.next_cursor = encode_cursor("n", *row_key(rows[-1]))
+        if has_prev:
+            page.prev_cursor = encode_cursor("p", *row_key(rows[0]))
+    return page
+
+
+def set_cursor_headers(response: Response, page: Page) -> None:
+    if page.next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+    if page.prev_cursor:
+        response.headers[PREV_CURSOR_HEADER] = page.prev_cursor
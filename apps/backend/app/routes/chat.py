@@ -1,9 +1,14 @@
-from groq import Groq
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 from ..auth import CurrentUser, AuthUser
+from ..clients import get_llm
 from ..schemas import ChatRequest, ChatResponse
+from ..services import retrieval
+from ..services.llm_client import LLMClient
 from ..settings import settings
+from ..sse import SSE_HEADERS, sse_event
 
 router = APIRouter(tags=["chat"])
 
@@ -30,31 +35,62 @@ def _system_prompt(mode: str) -> str:
     )
 
 
+async def _messages(body: ChatRequest, user: AuthUser) -> list[dict[str, str]]:
+    system = _system_prompt(body.mode)
+
+    # RAG: fragmentos de los materiales del usuario (prioriza los de body.task_id).
+    # BM25 + vectores es CPU: en un hilo, fuera del event loop
+    passages = await run_in_threadpool(retrieval.search, user.id, body.message, task_id=body.task_id)
+    if passages:
+        system += (
+            "- Usa los fragmentos siguientes cuando sean relevantes y cita la fuente como [n].\n\n"
+            f"{retrieval.format_passages(passages, settings.retrieval_context_char_budget)}\n"
+        )
+
+    return [
+        {"role": "system", "content": system},
+        {
+            "role": "user",
+            "content": f"Usuario: {user.id}\n\nMensaje:\n{body.message}",
+        },
+    ]
+
+
 @router.post("/chat", response_model=ChatResponse)
-async def chat(body: ChatRequest, user: AuthUser = CurrentUser) -> ChatResponse:
-    # For debugging: log the user info
-    print(f"Chat request from user: {user.id} - {user.email}")
-    print(f"Message: {body.message}")
-    print(f"Mode: {body.mode}")
-    # MVP: sin RAG aún (luego: recuperar chunks por task_id y añadir citas)
-    if not settings.groq_api_key:
-        raise HTTPException(status_code=500, detail="Server misconfigured: GROQ_API_KEY is missing")
+async def chat(
+    body: ChatRequest,
+    llm: LLMClient = Depends(get_llm),
+    user: AuthUser = CurrentUser
+) -> ChatResponse:
     try:
-        client = Groq(api_key=settings.groq_api_key)
-        completion = client.chat.completions.create(
-            model=settings.groq_model,
-            messages=[
-                {"role": "system", "content": _system_prompt(body.mode)},
-                {
-                    "role": "user",
-                    "content": f"Usuario: {user.id}\n\nMensaje:\n{body.message}",
-                },
-            ],
+        completion = await llm.complete(
+            messages=await _messages(body, user),
             temperature=0.3,
         )
-        answer = completion.choices[0].message.content or ""
+        answer = completion.content
         return ChatResponse(answer=answer.strip())
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Groq error: {e}")
+        raise HTTPException(status_code=500, detail=f"LLM error: {e}")
+
+
+
+
+@router.post("/chat/stream")
+async def chat_stream(
+    body: ChatRequest,
+    llm: LLMClient = Depends(get_llm),
+    user: AuthUser = CurrentUser
+) -> StreamingResponse:
+    """Igual que /chat pero enviando los tokens como Server-Sent Events."""
+    stream = llm.stream(messages=await _messages(body, user), temperature=0.3)
 
+    async def events():
+        try:
+            async for delta in stream:
+                yield sse_event("token", {"content": delta})
+        except Exception as e:
+            yield sse_event("error", {"detail": f"LLM error: {e}"})
+            return
+        yield sse_event("done", {"answer": stream.content.strip(), "tokens_used": stream.tokens_used})
 
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
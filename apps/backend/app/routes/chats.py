@@ -1,100 +1,196 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
 from datetime import datetime
+from uuid import UUID
 
-from ..database import get_db
+from ..database import AsyncSessionLocal, get_db, get_read_db
 from ..auth import CurrentUser, AuthUser
+from ..clients import get_ai_service
 from ..schemas import ChatRequest, ChatResponse
 from ..models import Chat as ChatModel, ChatMessage as ChatMessageModel, Task as TaskModel
 from ..services.ai_service import AIService
+from ..pagination import KeyColumn, paginate, set_cursor_headers
+from ..services.chat_context import ChatWindow, last_message_update, load_window
+from ..services import retrieval
+from ..services.ingestion import task_document_text
+from ..settings import settings
+from ..sse import SSE_HEADERS, sse_event
+from ..worker import schedule_chat_summary
 
 router = APIRouter(prefix="/chats", tags=["chats"])
-ai_service = AIService()
+
+# Claves de ordenación, cubiertas por idx_chats_user_updated e idx_chat_messages_chat_created
+CHAT_ORDER = (
+    KeyColumn(ChatModel.updated_at, descending=True, cast=datetime.fromisoformat),
+    KeyColumn(ChatModel.id, descending=True, cast=UUID),
+)
+MESSAGE_ORDER = (
+    KeyColumn(ChatMessageModel.created_at, cast=datetime.fromisoformat),
+    KeyColumn(ChatMessageModel.id, cast=UUID),
+)
+
+
+def _message_dict(msg: ChatMessageModel) -> dict:
+    return {
+        "id": str(msg.id),
+        "role": msg.role,
+        "content": msg.content,
+        "message_type": msg.message_type,
+        "tokens_used": msg.tokens_used,
+        "model_used": msg.model_used,
+        "created_at": msg.created_at
+    }
+
+
+def _task_context(db: Session, chat: ChatModel, passages: List[retrieval.RetrievedPassage]) -> str:
+    """Contexto de la tarea asociada para los chats de tipo task (se ejecuta con db.run_sync)"""
+    if chat.chat_type != "task" or not chat.task_id:
+        return ""
+
+    task = db.query(TaskModel).filter(TaskModel.id == chat.task_id).first()
+    if not task:
+        return ""
+
+    context = f"""
+            Información de la tarea:
+            Título: {task.title}
+            Descripción: {task.description or 'No disponible'}
+            Materia: {task.subject.name if task.subject else 'No especificada'}
+            Estado: {task.status}
+            Análisis previo: {task.ai_analysis or 'No disponible'}
+            """
+
+    # Fragmentos más relevantes para el mensaje; sin índice, un extracto de los documentos
+    if passages:
+        context += (
+            "\nFragmentos relevantes de los materiales del estudiante. "
+            "Si los usas, cita la fuente con su número, p. ej. [1]:\n"
+            f"{retrieval.format_passages(passages, settings.retrieval_context_char_budget)}\n"
+        )
+    else:
+        document_text = task_document_text(db, task.id, settings.chat_document_char_budget)
+        if document_text:
+            context += f"\nDocumentos de la tarea (extracto):\n{document_text}\n"
+
+    return context
+
+
+async def _chat_context(db: AsyncSession, chat: ChatModel, query: str) -> str:
+    passages: List[retrieval.RetrievedPassage] = []
+    if chat.chat_type == "task" and chat.task_id:
+        # BM25 + vectores es CPU: en un hilo, fuera del event loop (run_sync corre en él)
+        passages = await run_in_threadpool(retrieval.search, str(chat.user_id), query, task_id=str(chat.task_id))
+    return await db.run_sync(_task_context, chat, passages)
+
+
+async def _history_window(db: AsyncSession, chat: ChatModel) -> ChatWindow:
+    """Ventana de historial; si quedan mensajes fuera, se recalcula el resumen en el worker"""
+    window = await db.run_sync(load_window, chat)
+    if window.overflow:
+        try:
+            # SET NX en Redis + publicación en el broker: en un hilo, fuera del event loop
+            await run_in_threadpool(schedule_chat_summary, str(chat.id))
+        except Exception as e:
+            print(f"Could not schedule chat summary: {str(e)}")
+    return window
 
 
 @router.get("/", response_model=List[dict])
 async def get_user_chats(
-    db: Session = Depends(get_db),
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_read_db),
     user: AuthUser = CurrentUser
 ):
-    """Obtener todos los chats del usuario"""
-    chats = db.query(ChatModel).filter(ChatModel.user_id == user.id).order_by(desc(ChatModel.updated_at)).all()
-
-    result = []
-    for chat in chats:
-        # Obtener último mensaje
-        last_message = db.query(ChatMessageModel).filter(
-            ChatMessageModel.chat_id == chat.id
-        ).order_by(desc(ChatMessageModel.created_at)).first()
+    """Obtener los chats del usuario, los más recientes primero (cursores en X-Next-Cursor / X-Prev-Cursor)"""
+    # Una sola consulta sobre idx_chats_user_updated; el último mensaje viene de la proyección
+    page = await paginate(
+        db,
+        select(ChatModel).where(ChatModel.user_id == user.id),
+        CHAT_ORDER,
+        lambda chat: (chat.updated_at, chat.id),
+        cursor,
+        limit
+    )
+    set_cursor_headers(response, page)
 
-        result.append({
+    return [
+        {
             "id": str(chat.id),
             "title": chat.title,
             "chat_type": chat.chat_type,
             "task_id": str(chat.task_id) if chat.task_id else None,
             "subject_id": str(chat.subject_id) if chat.subject_id else None,
             "is_active": chat.is_active,
-            "last_message": last_message.content[:100] + "..." if last_message and len(last_message.content) > 100 else last_message.content if last_message else None,
-            "last_message_at": last_message.created_at if last_message else None,
+            "last_message_id": str(chat.last_message_id) if chat.last_message_id else None,
+            "last_message": chat.last_message_preview,
+            "last_message_at": chat.last_message_at,
             "created_at": chat.created_at,
             "updated_at": chat.updated_at
-        })
-
-    return result
+        }
+        for chat in page.items
+    ]
 
 
 @router.get("/{chat_id}/messages", response_model=List[dict])
 async def get_chat_messages(
     chat_id: str,
-    skip: int = 0,
-    limit: int = 50,
-    db: Session = Depends(get_db),
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_read_db),
     user: AuthUser = CurrentUser
 ):
-    """Obtener mensajes de un chat específico"""
+    """Obtener mensajes de un chat en orden cronológico (cursores en X-Next-Cursor / X-Prev-Cursor)"""
     # Verificar que el chat pertenece al usuario
-    chat = db.query(ChatModel).filter(
+    chat = await db.scalar(select(ChatModel).where(
         ChatModel.id == chat_id,
         ChatModel.user_id == user.id
-    ).first()
+    ))
 
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
 
-    messages = db.query(ChatMessageModel).filter(
-        ChatMessageModel.chat_id == chat_id
-    ).order_by(ChatMessageModel.created_at).offset(skip).limit(limit).all()
+    page = await paginate(
+        db,
+        select(ChatMessageModel).where(ChatMessageModel.chat_id == chat.id),
+        MESSAGE_ORDER,
+        lambda msg: (msg.created_at, msg.id),
+        cursor,
+        limit
+    )
+    set_cursor_headers(response, page)
 
-    return [{
-        "id": str(msg.id),
-        "role": msg.role,
-        "content": msg.content,
-        "message_type": msg.message_type,
-        "tokens_used": msg.tokens_used,
-        "model_used": msg.model_used,
-        "created_at": msg.created_at
-    } for msg in messages]
+    return [_message_dict(msg) for msg in page.items]
 
 
 @router.post("/{chat_id}/messages", response_model=dict)
 async def send_chat_message(
     chat_id: str,
     message: ChatRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
+    ai_service: AIService = Depends(get_ai_service),
     user: AuthUser = CurrentUser
 ):
     """Enviar un mensaje a un chat específico"""
     # Verificar que el chat pertenece al usuario
-    chat = db.query(ChatModel).filter(
+    chat = await db.scalar(select(ChatModel).where(
         ChatModel.id == chat_id,
         ChatModel.user_id == user.id
-    ).first()
+    ))
 
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
 
+    # Historial reciente dentro del presupuesto de tokens (sin el mensaje nuevo)
+    window = await _history_window(db, chat)
+
     # Guardar mensaje del usuario
     user_message = ChatMessageModel(
         chat_id=chat_id,
@@ -105,19 +201,7 @@ async def send_chat_message(
     db.add(user_message)
 
     # Preparar contexto para IA
-    context = ""
-    if chat.chat_type == "task" and chat.task_id:
-        # Obtener información de la tarea para contexto
-        task = db.query(TaskModel).filter(TaskModel.id == chat.task_id).first()
-        if task:
-            context = f"""
-            Información de la tarea:
-            Título: {task.title}
-            Descripción: {task.description or 'No disponible'}
-            Materia: {task.subject.name if task.subject else 'No especificada'}
-            Estado: {task.status}
-            Análisis previo: {task.ai_analysis or 'No disponible'}
-            """
+    context = await _chat_context(db, chat, message.message)
 
     try:
         # Obtener respuesta de IA
@@ -125,7 +209,9 @@ async def send_chat_message(
             user_message=message.message,
             chat_type=chat.chat_type,
             mode=message.mode,
-            context=context
+            context=context,
+            history=window.messages,
+            summary=window.summary
         )
 
         # Guardar respuesta de IA
@@ -138,38 +224,100 @@ async def send_chat_message(
             model_used=ai_response.get("model_used", "llama-3.1-8b-instant")
         )
         db.add(ai_message)
+        await db.flush()
 
-        # Actualizar timestamp del chat
-        chat.updated_at = datetime.utcnow()
+        # Último mensaje y timestamp del chat
+        await db.execute(last_message_update(ai_message))
 
-        db.commit()
-        db.refresh(ai_message)
+        await db.commit()
+        await db.refresh(ai_message)
 
-        return {
-            "id": str(ai_message.id),
-            "role": ai_message.role,
-            "content": ai_message.content,
-            "message_type": ai_message.message_type,
-            "tokens_used": ai_message.tokens_used,
-            "model_used": ai_message.model_used,
-            "created_at": ai_message.created_at
-        }
+        return _message_dict(ai_message)
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Error generating AI response: {str(e)}")
 
 
+@router.post("/{chat_id}/messages/stream")
+async def stream_chat_message(
+    chat_id: str,
+    message: ChatRequest,
+    db: AsyncSession = Depends(get_db),
+    ai_service: AIService = Depends(get_ai_service),
+    user: AuthUser = CurrentUser
+):
+    """Enviar un mensaje y recibir la respuesta de la IA como Server-Sent Events"""
+    chat = await db.scalar(select(ChatModel).where(
+        ChatModel.id == chat_id,
+        ChatModel.user_id == user.id
+    ))
+
+    if not chat:
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+    window = await _history_window(db, chat)
+
+    # El mensaje del usuario se guarda antes de empezar a emitir tokens
+    user_message = ChatMessageModel(
+        chat_id=chat_id,
+        user_id=user.id,
+        role="user",
+        content=message.message
+    )
+    db.add(user_message)
+    await db.flush()
+    await db.execute(last_message_update(user_message))
+    await db.commit()
+
+    stream = ai_service.stream_chat_response(
+        user_message=message.message,
+        chat_type=chat.chat_type,
+        mode=message.mode,
+        context=await _chat_context(db, chat, message.message),
+        history=window.messages,
+        summary=window.summary
+    )
+
+    async def events():
+        # Si el cliente se desconecta, la generación se cancela aquí y no se guarda nada más
+        try:
+            async for delta in stream:
+                yield sse_event("token", {"content": delta})
+        except Exception as e:
+            yield sse_event("error", {"detail": f"Error generating AI response: {str(e)}"})
+            return
+
+        # La sesión de la petición ya está cerrada cuando se emite el cuerpo
+        async with AsyncSessionLocal() as stream_db:
+            ai_message = ChatMessageModel(
+                chat_id=chat_id,
+                user_id=user.id,
+                role="assistant",
+                content=stream.content.strip() or "Lo siento, no pude generar una respuesta.",
+                tokens_used=stream.tokens_used,
+                model_used=stream.model
+            )
+            stream_db.add(ai_message)
+            await stream_db.flush()
+            await stream_db.execute(last_message_update(ai_message))
+            await stream_db.commit()
+            await stream_db.refresh(ai_message)
+            yield sse_event("done", _message_dict(ai_message))
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
 @router.get("/general")
 async def get_general_chat(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: AuthUser = CurrentUser
 ):
     """Obtener el chat general del usuario"""
-    chat = db.query(ChatModel).filter(
+    chat = await db.scalar(select(ChatModel).where(
         ChatModel.user_id == user.id,
         ChatModel.chat_type == "general"
-    ).first()
+    ).limit(1))
 
     if not chat:
         # Crear chat general si no existe
@@ -179,8 +327,8 @@ async def get_general_chat(
             chat_type="general"
         )
         db.add(chat)
-        db.commit()
-        db.refresh(chat)
+        await db.commit()
+        await db.refresh(chat)
 
     return {
         "id": str(chat.id),
@@ -193,14 +341,14 @@ async def get_general_chat(
 @router.delete("/{chat_id}")
 async def delete_chat(
     chat_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: AuthUser = CurrentUser
 ):
     """Eliminar un chat (solo chats de tareas, no el general)"""
-    chat = db.query(ChatModel).filter(
+    chat = await db.scalar(select(ChatModel).where(
         ChatModel.id == chat_id,
         ChatModel.user_id == user.id
-    ).first()
+    ))
 
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
@@ -208,6 +356,6 @@ async def delete_chat(
     if chat.chat_type == "general":
         raise HTTPException(status_code=400, detail="Cannot delete general chat")
 
-    db.delete(chat)
-    db.commit()
+    await db.delete(chat)
+    await db.commit()
     return {"message": "Chat deleted successfully"}
\ No newline at end of file
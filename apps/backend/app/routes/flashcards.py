@@ -0,0 +1,196 @@
+from datetime import date, datetime, timedelta
+from typing import Optional
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from ..auth import CurrentUser, AuthUser
+from ..database import ReadAsyncSessionLocal, get_db
+from ..models import (
+    Document as DocumentModel, Flashcard as FlashcardModel, Subject as SubjectModel, Task as TaskModel
+)
+from ..pagination import KeyColumn, keyset_condition
+from ..schemas import (
+    Flashcard, FlashcardGenerateRequest, JobResponse, ReviewBatchRequest, ReviewBatchResponse, ReviewedCard,
+    ReviewForecastDay, ReviewForecastResponse
+)
+from ..services.srs import Review, apply_reviews, forecast_review_load
+from ..settings import settings
+from ..sse import SSE_HEADERS, sse_event
+from ..worker import enqueue_job, generate_document_flashcards
+
+router = APIRouter(prefix="/flashcards", tags=["flashcards"])
+
+# Orden de la cola de repaso, sobre idx_flashcards_user_next_review
+DUE_ORDER = (
+    KeyColumn(FlashcardModel.next_review_date),
+    KeyColumn(FlashcardModel.id),
+)
+
+
+@router.post("/generate/document", response_model=JobResponse, status_code=202)
+async def generate_flashcards_from_document(
+    body: FlashcardGenerateRequest,
+    db: AsyncSession = Depends(get_db),
+    user: AuthUser = CurrentUser
+) -> JobResponse:
+    """Encolar la generación de flashcards de todo un documento ingerido (por chunks)"""
+    document = await db.scalar(select(DocumentModel).where(
+        DocumentModel.id == body.document_id,
+        DocumentModel.user_id == user.id
+    ))
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if document.status != "ready":
+        raise HTTPException(status_code=409, detail=f"Document is {document.status}, not ready")
+
+    subject_id = body.subject_id
+    if subject_id is None and document.task_id is not None:
+        subject_id = await db.scalar(select(TaskModel.subject_id).where(
+            TaskModel.id == document.task_id,
+            TaskModel.user_id == user.id
+        ))
+    if subject_id is None:
+        raise HTTPException(status_code=400, detail="subject_id is required for documents without a task subject")
+    elif body.subject_id is not None:
+        owned = await db.scalar(select(SubjectModel.id).where(
+            SubjectModel.id == subject_id,
+            SubjectModel.user_id == user.id
+        ))
+        if not owned:
+            raise HTTPException(status_code=404, detail="Subject not found")
+
+    try:
+        job = await run_in_threadpool(
+            enqueue_job, generate_document_flashcards, user.id,
+            str(document.id), user.id, str(subject_id), body.cards_per_chunk
+        )
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Could not enqueue flashcard generation: {str(e)}")
+
+    return JobResponse(job_id=job.id, status="queued", events_url=f"/jobs/{job.id}/events")
+
+
+@router.get("/review/due")
+async def stream_due_cards(
+    subject_id: Optional[UUID] = None,
+    limit: int = Query(200, ge=1, le=2000),
+    user: AuthUser = CurrentUser
+) -> StreamingResponse:
+    """
+    Tarjetas pendientes de repaso (next_review_date <= hoy), las más atrasadas primero,
+    como Server-Sent Events: un evento `card` por tarjeta y `done` al final.
+    """
+    today = datetime.utcnow().date()
+
+    async def events():
+        sent = 0
+        last = None
+        # La sesión de la petición ya está cerrada cuando se emite el cuerpo
+        async with ReadAsyncSessionLocal() as db:
+            while sent < limit:
+                query = select(FlashcardModel).where(
+                    FlashcardModel.user_id == user.id,
+                    FlashcardModel.next_review_date <= today
+                )
+                if subject_id:
+                    query = query.where(FlashcardModel.subject_id == subject_id)
+                if last is not None:
+                    query = query.where(keyset_condition(DUE_ORDER, last))
+                page_size = min(settings.review_queue_page_size, limit - sent)
+                page = (await db.scalars(
+                    query.order_by(FlashcardModel.next_review_date, FlashcardModel.id).limit(page_size)
+                )).all()
+
+                for card in page:
+                    yield sse_event("card", Flashcard.model_validate(card).model_dump(mode="json"))
+                sent += len(page)
+                if len(page) < page_size:
+                    break
+                last = (page[-1].next_review_date, page[-1].id)
+
+        yield sse_event("done", {"count": sent})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.post("/review", response_model=ReviewBatchResponse)
+async def submit_reviews(
+    body: ReviewBatchRequest,
+    db: AsyncSession = Depends(get_db),
+    user: AuthUser = CurrentUser
+) -> ReviewBatchResponse:
+    """Aplicar un lote de notas SM-2 en una transacción y registrar la sesión de estudio"""
+    if len(body.reviews) > settings.review_batch_max:
+        raise HTTPException(status_code=400, detail=f"At most {settings.review_batch_max} reviews per request")
+
+    now = datetime.utcnow()
+    reviews = [Review(r.card_id, r.grade, r.reviewed_at or now) for r in body.reviews]
+    try:
+        result = await apply_reviews(
+            db, user.id, reviews,
+            session_id=body.session_id, subject_id=body.subject_id, started_at=body.started_at
+        )
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    await db.commit()
+
+    return ReviewBatchResponse(
+        session_id=result.session.id,
+        reviewed=result.reviewed,
+        correct=result.correct,
+        cards=[ReviewedCard(**card) for card in result.cards],
+        missing=result.missing,
+    )
+
+
+@router.get("/review/forecast", response_model=ReviewForecastResponse)
+async def get_review_forecast(
+    days: int = Query(30, ge=1),
+    until: Optional[date] = None,
+    subject_id: Optional[UUID] = None,
+    simulations: int = Query(200, ge=1, le=1000),
+    seed: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+    user: AuthUser = CurrentUser
+) -> ReviewForecastResponse:
+    """
+    Cuántos repasos tendrá el usuario cada día (por ejemplo hasta un examen con `until`),
+    simulando SM-2 con notas aleatorias calibradas en el historial de cada tarjeta.
+    """
+    today = datetime.utcnow().date()
+    if until is not None:
+        if until < today:
+            raise HTTPException(status_code=400, detail="until must not be in the past")
+        days = (until - today).days + 1
+    if days > settings.review_forecast_max_days:
+        raise HTTPException(status_code=400, detail=f"At most {settings.review_forecast_max_days} days")
+
+    forecast = await forecast_review_load(
+        db, user.id, days, simulations,
+        max_card_days=settings.review_forecast_max_card_days,
+        subject_id=subject_id, start=today, seed=seed
+    )
+
+    expected = forecast.expected.round(2)
+    peak = int(expected.argmax()) if forecast.cards else None
+    return ReviewForecastResponse(
+        cards=forecast.cards,
+        simulations=forecast.simulations,
+        days=[
+            ReviewForecastDay(
+                date=today + timedelta(days=i),
+                expected=float(expected[i]),
+                low=int(forecast.low[i]),
+                high=int(forecast.high[i]),
+            )
+            for i in range(days)
+        ],
+        total_expected=round(float(forecast.expected.sum()), 2),
+        peak_date=today + timedelta(days=peak) if peak is not None else None,
+        peak_expected=float(expected[peak]) if peak is not None else 0.0,
+    )
@@ -1,6 +1,8 @@
 from fastapi import APIRouter
 
+from ..clients import clients
 from ..schemas import HealthResponse
+from ..services.response_cache import response_cache
 
 router = APIRouter(tags=["health"])
 
@@ -9,3 +11,13 @@ router = APIRouter(tags=["health"])
 async def health() -> HealthResponse:
     return HealthResponse()
 
+
+@router.get("/health/ai-cache")
+async def ai_cache_stats() -> dict:
+    return response_cache.stats()
+
+
+@router.get("/health/llm")
+async def llm_router_stats() -> dict:
+    router = getattr(clients.llm(), "router", None)
+    return router.stats() if router is not None else {}
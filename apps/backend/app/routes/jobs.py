@@ -0,0 +1,89 @@
+import asyncio
+import time
+from typing import Any
+
+from celery.result import AsyncResult
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+
+from ..auth import CurrentUser, AuthUser
+from ..schemas import JobStatus
+from ..settings import settings
+from ..sse import SSE_HEADERS, sse_event
+from ..worker import celery, job_owner
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+def _owned_snapshot(job_id: str, user: AuthUser) -> tuple[str, Any]:
+    # Un job de otro usuario (o desconocido) no existe para este, sea cual sea su estado
+    if job_owner(job_id) != user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _snapshot(job_id)
+
+
+def _snapshot(job_id: str) -> tuple[str, Any]:
+    # Consulta bloqueante al result backend (Redis); se ejecuta en un hilo.
+    result = AsyncResult(job_id, app=celery)
+    return result.state, result.info
+
+
+def _job_status(job_id: str, state: str, info: Any) -> JobStatus:
+    if isinstance(info, dict):
+        return JobStatus(
+            job_id=job_id,
+            state=state,
+            stage=info.get("stage"),
+            progress=info.get("progress"),
+            result=info.get("result") if state == "SUCCESS" else None,
+        )
+    if state == "FAILURE":
+        return JobStatus(job_id=job_id, state=state, error=str(info))
+    return JobStatus(job_id=job_id, state=state)
+
+
+@router.get("/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str, user: AuthUser = CurrentUser) -> JobStatus:
+    """Estado actual de un job en segundo plano"""
+    state, info = await asyncio.to_thread(_owned_snapshot, job_id, user)
+    return _job_status(job_id, state, info)
+
+
+@router.get("/{job_id}/events")
+async def job_events(job_id: str, user: AuthUser = CurrentUser) -> StreamingResponse:
+    """Progreso y resultado de un job como Server-Sent Events"""
+    state, info = await asyncio.to_thread(_owned_snapshot, job_id, user)
+    status = _job_status(job_id, state, info)
+
+    async def events():
+        nonlocal status
+        last = None
+        last_sent_at = time.monotonic()
+        deadline = last_sent_at + settings.job_events_timeout_seconds
+
+        while True:
+            current = status.model_dump(exclude_none=True)
+            if current != last:
+                last = current
+                last_sent_at = time.monotonic()
+                if status.state == "SUCCESS":
+                    yield sse_event("result", current)
+                    return
+                if status.state in ("FAILURE", "REVOKED"):
+                    yield sse_event("error", current)
+                    return
+                yield sse_event("status", current)
+            elif time.monotonic() - last_sent_at > 15:
+                # Comentario SSE para que los proxies no cierren la conexión
+                last_sent_at = time.monotonic()
+                yield ": keep-alive\n\n"
+
+            if time.monotonic() > deadline:
+                yield sse_event("timeout", current)
+                return
+
+            await asyncio.sleep(settings.job_poll_interval_seconds)
+            state, info = await asyncio.to_thread(_snapshot, job_id)
+            status = _job_status(job_id, state, info)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
@@ -0,0 +1,80 @@
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..auth import CurrentUser, AuthUser
+from ..clients import get_ai_service
+from ..database import get_db, get_read_db
+from ..models import Quiz as QuizModel, Subject as SubjectModel
+from ..schemas import Quiz, QuizGenerateRequest, QuizGenerateResponse
+from ..services.ai_service import AIService
+from ..services.question_bank import assemble_quiz
+
+router = APIRouter(prefix="/quizzes", tags=["quizzes"])
+
+
+@router.post("/generate", response_model=QuizGenerateResponse)
+async def generate_quiz(
+    body: QuizGenerateRequest,
+    db: AsyncSession = Depends(get_db),
+    ai_service: AIService = Depends(get_ai_service),
+    user: AuthUser = CurrentUser
+) -> QuizGenerateResponse:
+    """
+    Crear un quiz sobre un tema: primero con preguntas del banco compartido de la materia
+    que el usuario no ha visto, y solo lo que falte se genera con IA.
+    """
+    subject = await db.scalar(select(SubjectModel).where(
+        SubjectModel.id == body.subject_id,
+        SubjectModel.user_id == user.id
+    ))
+    if not subject:
+        raise HTTPException(status_code=404, detail="Subject not found")
+
+    assembly = await assemble_quiz(
+        db, ai_service, user.id, subject.name, body.topic, body.difficulty, body.num_questions,
+        subtopics=body.subtopics, question_types=body.question_types
+    )
+    if not assembly.questions:
+        await db.rollback()
+        raise HTTPException(status_code=503, detail="Could not generate quiz questions")
+
+    quiz = QuizModel(
+        user_id=user.id,
+        subject_id=subject.id,
+        task_id=body.task_id,
+        title=body.title or f"Quiz: {body.topic}",
+        description=body.description,
+        quiz_type=body.quiz_type,
+        total_questions=len(assembly.questions),
+        passing_score=body.passing_score,
+        questions=[{**q, "topic": body.topic} for q in assembly.questions],
+        generated_by_ai=True,
+    )
+    db.add(quiz)
+    await db.commit()
+    await db.refresh(quiz)
+
+    return QuizGenerateResponse(
+        quiz=Quiz.model_validate(quiz),
+        from_bank=assembly.from_bank,
+        generated=assembly.generated,
+    )
+
+
+@router.get("/{quiz_id}", response_model=Quiz)
+async def get_quiz(
+    quiz_id: UUID,
+    db: AsyncSession = Depends(get_read_db),
+    user: AuthUser = CurrentUser
+):
+    """Obtener un quiz"""
+    quiz = await db.scalar(select(QuizModel).where(
+        QuizModel.id == quiz_id,
+        QuizModel.user_id == user.id
+    ))
+    if not quiz:
+        raise HTTPException(status_code=404, detail="Quiz not found")
+    return quiz
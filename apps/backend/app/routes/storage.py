@@ -1,28 +1,273 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from supabase import Client
 
 from ..auth import CurrentUser, AuthUser
-from ..clients import supabase_admin
-from ..schemas import SignedUploadRequest, SignedUploadResponse
+from ..clients import get_supabase
+from ..database import get_db, get_read_db
+from ..models import Document as DocumentModel, Task as TaskModel
+from ..schemas import (
+    IngestFileRequest, IngestFileResponse, SignedUploadBatchRequest, SignedUploadBatchResponse,
+    SignedUploadError, SignedUploadRequest, SignedUploadResponse, UploadCompleteResponse,
+    UploadCreateRequest, UploadPartResponse, UploadSessionResponse
+)
+from ..services.ingestion import add_task_attachment, detect_kind, ingested_document_query
+from ..services.uploads import UploadError, UploadNotFound, UploadSession, upload_store
+from ..settings import settings
+from ..worker import enqueue_job, ingest_file
 
 router = APIRouter(prefix="/files", tags=["files"])
 
 
-@router.post("/signed-upload", response_model=SignedUploadResponse)
-async def signed_upload(body: SignedUploadRequest, user: AuthUser = CurrentUser) -> SignedUploadResponse:
+def _check_path(user: AuthUser, path: str) -> None:
     # Basic safety: prevent writing outside user's namespace unless you want shared buckets later.
-    if not body.path.startswith(f"{user.id}/"):
+    if not path.startswith(f"{user.id}/"):
         raise HTTPException(status_code=400, detail="path must start with '<userId>/'")
 
-    sb = supabase_admin()
+
+def _sign_upload(sb: Client, bucket: str, path: str) -> SignedUploadResponse:
+    res = sb.storage.from_(bucket).create_signed_upload_url(path)
+    # supabase-py returns dict-like with fields: signedUrl, token, path (varies by version)
+    signed_url = res.get("signedUrl") or res.get("signed_url")
+    token = res.get("token")
+    if not signed_url:
+        raise RuntimeError("Missing signedUrl")
+    return SignedUploadResponse(bucket=bucket, path=res.get("path") or path, signed_url=signed_url, token=token)
+
+
+@router.post("/signed-upload", response_model=SignedUploadResponse)
+async def signed_upload(
+    body: SignedUploadRequest,
+    sb: Client = Depends(get_supabase),
+    user: AuthUser = CurrentUser
+) -> SignedUploadResponse:
+    _check_path(user, body.path)
     try:
-        res = sb.storage.from_(body.bucket).create_signed_upload_url(body.path)
-        # supabase-py returns dict-like with fields: signedUrl, token, path (varies by version)
-        signed_url = res.get("signedUrl") or res.get("signed_url")
-        token = res.get("token")
-        path = res.get("path") or body.path
-        if not signed_url:
-            raise RuntimeError("Missing signedUrl")
-        return SignedUploadResponse(bucket=body.bucket, path=path, signed_url=signed_url, token=token)
+        # El cliente de Supabase es síncrono: fuera del event loop
+        return await run_in_threadpool(_sign_upload, sb, body.bucket, body.path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Could not create signed upload URL: {e}")
 
+
+@router.post("/signed-uploads", response_model=SignedUploadBatchResponse)
+async def signed_uploads(
+    body: SignedUploadBatchRequest,
+    sb: Client = Depends(get_supabase),
+    user: AuthUser = CurrentUser
+) -> SignedUploadBatchResponse:
+    """Firmar varias rutas en una sola petición; los fallos se devuelven por ruta en `errors`"""
+    if len(body.uploads) > settings.signed_upload_batch_max:
+        raise HTTPException(status_code=400, detail=f"At most {settings.signed_upload_batch_max} uploads per request")
+    for item in body.uploads:
+        _check_path(user, item.path)
+
+    semaphore = asyncio.Semaphore(settings.signed_upload_concurrency)
+
+    async def sign(item: SignedUploadRequest):
+        async with semaphore:
+            try:
+                return await run_in_threadpool(_sign_upload, sb, item.bucket, item.path)
+            except Exception as e:
+                return SignedUploadError(bucket=item.bucket, path=item.path, detail=str(e))
+
+    results = await asyncio.gather(*(sign(item) for item in body.uploads))
+    return SignedUploadBatchResponse(
+        uploads=[r for r in results if isinstance(r, SignedUploadResponse)],
+        errors=[r for r in results if isinstance(r, SignedUploadError)],
+    )
+
+
+# =====================================================
+# SUBIDAS REANUDABLES POR PARTES
+# =====================================================
+
+def _session_response(session: UploadSession) -> UploadSessionResponse:
+    return UploadSessionResponse(
+        upload_id=session.upload_id,
+        bucket=session.bucket,
+        path=session.path,
+        size_bytes=session.size_bytes,
+        part_size=session.part_size,
+        part_count=session.part_count,
+        received_parts=upload_store.received_parts(session),
+    )
+
+
+def _get_session(upload_id: str, user: AuthUser) -> UploadSession:
+    try:
+        return upload_store.get(upload_id, user.id)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+
+def _duplicate_response(document: DocumentModel) -> UploadCompleteResponse:
+    return UploadCompleteResponse(
+        bucket=document.bucket,
+        path=document.path,
+        size_bytes=document.size_bytes or 0,
+        sha256=document.content_sha256,
+        document_id=str(document.id),
+        deduplicated=True,
+    )
+
+
+@router.post("/uploads", response_model=UploadSessionResponse, status_code=201)
+async def create_upload(
+    body: UploadCreateRequest,
+    db: AsyncSession = Depends(get_read_db),
+    user: AuthUser = CurrentUser
+) -> UploadSessionResponse:
+    """Iniciar una subida por partes; las partes pueden enviarse en paralelo y en cualquier orden"""
+    _check_path(user, body.path)
+    if body.sha256:
+        # El usuario ya subió este contenido: no hace falta enviar nada
+        existing = await db.scalar(ingested_document_query(body.sha256.lower(), user.id))
+        if existing:
+            return UploadSessionResponse(
+                bucket=existing.bucket,
+                path=existing.path,
+                size_bytes=existing.size_bytes or body.size_bytes,
+                part_size=0,
+                part_count=0,
+                duplicate=_duplicate_response(existing),
+            )
+    try:
+        session = upload_store.create(
+            user.id, body.bucket, body.path, body.size_bytes,
+            content_type=body.content_type, sha256=body.sha256, part_size=body.part_size
+        )
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _session_response(session)
+
+
+@router.get("/uploads/{upload_id}", response_model=UploadSessionResponse)
+async def get_upload(upload_id: str, user: AuthUser = CurrentUser) -> UploadSessionResponse:
+    """Estado de la subida: para reanudar, enviar solo las partes que faltan en `received_parts`"""
+    return _session_response(_get_session(upload_id, user))
+
+
+@router.put("/uploads/{upload_id}/parts/{index}", response_model=UploadPartResponse)
+async def upload_part(
+    upload_id: str,
+    index: int,
+    request: Request,
+    part_sha256: Optional[str] = Header(None, alias="X-Part-Sha256"),
+    user: AuthUser = CurrentUser
+) -> UploadPartResponse:
+    """Subir una parte (cuerpo binario). Repetir una parte la reemplaza."""
+    session = _get_session(upload_id, user)
+    try:
+        digest = await upload_store.write_part(session, index, request.stream(), part_sha256)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return UploadPartResponse(
+        upload_id=session.upload_id, index=index, size_bytes=session.part_length(index), sha256=digest
+    )
+
+
+@router.post("/uploads/{upload_id}/complete", response_model=UploadCompleteResponse)
+async def complete_upload(
+    upload_id: str,
+    db: AsyncSession = Depends(get_read_db),
+    user: AuthUser = CurrentUser
+) -> UploadCompleteResponse:
+    """Ensamblar las partes y guardar el archivo; después se puede llamar a /files/ingest con el sha256"""
+    async with upload_store.lock(_get_session(upload_id, user).upload_id):
+        # Una petición anterior pudo completarla mientras esperábamos: entonces 404
+        session = _get_session(upload_id, user)
+        try:
+            completed = await run_in_threadpool(upload_store.assemble, session)
+        except UploadError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        # Mismo contenido que un documento del usuario: se reutiliza el objeto ya guardado
+        existing = await db.scalar(ingested_document_query(completed.sha256, user.id))
+        if existing:
+            await run_in_threadpool(upload_store.abort, session)
+            return _duplicate_response(existing)
+
+        try:
+            await run_in_threadpool(upload_store.store, session, completed)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Could not store uploaded file: {e}")
+    return UploadCompleteResponse(
+        bucket=completed.bucket, path=completed.path, size_bytes=completed.size_bytes, sha256=completed.sha256
+    )
+
+
+@router.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str, user: AuthUser = CurrentUser):
+    """Cancelar una subida y borrar las partes recibidas"""
+    session = _get_session(upload_id, user)
+    # Mismo lock que /complete: no se borran las partes mientras se ensamblan
+    async with upload_store.lock(session.upload_id):
+        # rmtree de las partes: en un hilo, fuera del event loop
+        await run_in_threadpool(upload_store.abort, session)
+    return {"message": "Upload aborted"}
+
+
+@router.post("/ingest", response_model=IngestFileResponse, status_code=202)
+async def ingest(
+    body: IngestFileRequest,
+    db: AsyncSession = Depends(get_db),
+    user: AuthUser = CurrentUser
+) -> IngestFileResponse:
+    """Registrar un archivo subido y encolar la extracción de su texto"""
+    _check_path(user, body.path)
+
+    filename = body.filename or os.path.basename(body.path)
+    try:
+        detect_kind(filename, body.mime_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    task = None
+    if body.task_id:
+        task = await db.scalar(select(TaskModel).where(
+            TaskModel.id == body.task_id,
+            TaskModel.user_id == user.id
+        ))
+        if not task:
+            raise HTTPException(status_code=404, detail="Task not found")
+
+    if body.sha256:
+        # Archivo ya ingerido por el usuario: reutilizar texto, chunks e índice y solo referenciarlo
+        existing = await db.scalar(ingested_document_query(body.sha256.lower(), user.id))
+        if existing:
+            if task is not None and add_task_attachment(task, existing):
+                await db.commit()
+            return IngestFileResponse(document_id=str(existing.id), status=existing.status, deduplicated=True)
+
+    document = DocumentModel(
+        user_id=user.id,
+        task_id=body.task_id,
+        bucket=body.bucket,
+        path=body.path,
+        filename=filename,
+        mime_type=body.mime_type
+    )
+    db.add(document)
+    await db.flush()
+    if task is not None:
+        add_task_attachment(task, document)
+    await db.commit()
+    await db.refresh(document)
+
+    try:
+        job = await run_in_threadpool(enqueue_job, ingest_file, user.id, str(document.id))
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Could not enqueue ingestion: {e}")
+
+    return IngestFileResponse(
+        document_id=str(document.id),
+        job_id=job.id,
+        status=document.status,
+        events_url=f"/jobs/{job.id}/events"
+    )
@@ -1,21 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
+from datetime import datetime
+from uuid import UUID
 
-from ..database import get_db
+from ..database import get_db, get_read_db
 from ..auth import CurrentUser, AuthUser
 from ..schemas import (
     Subject, SubjectCreate, SubjectUpdate
 )
-from ..models import Subject as SubjectModel, Task as TaskModel
+from ..models import Subject as SubjectModel, Task as TaskModel, TaskCounter
+from ..pagination import KeyColumn, paginate, set_cursor_headers
+from ..services.stats import subject_stats
 
 router = APIRouter(prefix="/subjects", tags=["subjects"])
 
+# Orden de creación (idx_subjects_user_created)
+SUBJECT_ORDER = (
+    KeyColumn(SubjectModel.created_at, cast=datetime.fromisoformat),
+    KeyColumn(SubjectModel.id, cast=UUID),
+)
+
 
 @router.post("/", response_model=Subject)
 async def create_subject(
     subject: SubjectCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: AuthUser = CurrentUser
 ):
     """Crear una nueva materia"""
@@ -24,34 +35,52 @@ async def create_subject(
         **subject.model_dump()
     )
     db.add(db_subject)
-    db.commit()
-    db.refresh(db_subject)
+    await db.commit()
+    await db.refresh(db_subject)
     return db_subject
 
 
 @router.get("/", response_model=List[Subject])
 async def get_subjects(
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db),
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    db: AsyncSession = Depends(get_read_db),
     user: AuthUser = CurrentUser
 ):
-    """Obtener materias del usuario"""
-    subjects = db.query(SubjectModel).filter(SubjectModel.user_id == user.id).offset(skip).limit(limit).all()
-    return subjects
+    """Obtener materias del usuario (cursores en X-Next-Cursor / X-Prev-Cursor)"""
+    page = await paginate(
+        db,
+        select(SubjectModel).where(SubjectModel.user_id == user.id),
+        SUBJECT_ORDER,
+        lambda subject: (subject.created_at, subject.id),
+        cursor,
+        limit
+    )
+    set_cursor_headers(response, page)
+    return page.items
+
+
+@router.get("/stats")
+async def get_all_subject_stats(
+    db: AsyncSession = Depends(get_read_db),
+    user: AuthUser = CurrentUser
+):
+    """Estadísticas de todas las materias del usuario en una sola consulta"""
+    return {"subjects": await subject_stats(db, user.id)}
 
 
 @router.get("/{subject_id}", response_model=Subject)
 async def get_subject(
     subject_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     user: AuthUser = CurrentUser
 ):
     """Obtener una materia específica"""
-    subject = db.query(SubjectModel).filter(
+    subject = await db.scalar(select(SubjectModel).where(
         SubjectModel.id == subject_id,
         SubjectModel.user_id == user.id
-    ).first()
+    ))
 
     if not subject:
         raise HTTPException(status_code=404, detail="Subject not found")
@@ -63,14 +92,14 @@ async def get_subject(
 async def update_subject(
     subject_id: str,
     subject_update: SubjectUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: AuthUser = CurrentUser
 ):
     """Actualizar una materia"""
-    subject = db.query(SubjectModel).filter(
+    subject = await db.scalar(select(SubjectModel).where(
         SubjectModel.id == subject_id,
         SubjectModel.user_id == user.id
-    ).first()
+    ))
 
     if not subject:
         raise HTTPException(status_code=404, detail="Subject not found")
@@ -79,68 +108,52 @@ async def update_subject(
     for field, value in subject_update.model_dump(exclude_unset=True).items():
         setattr(subject, field, value)
 
-    db.commit()
-    db.refresh(subject)
+    await db.commit()
+    await db.refresh(subject)
     return subject
 
 
 @router.delete("/{subject_id}")
 async def delete_subject(
     subject_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: AuthUser = CurrentUser
 ):
     """Eliminar una materia"""
-    subject = db.query(SubjectModel).filter(
+    subject = await db.scalar(select(SubjectModel).where(
         SubjectModel.id == subject_id,
         SubjectModel.user_id == user.id
-    ).first()
+    ))
 
     if not subject:
         raise HTTPException(status_code=404, detail="Subject not found")
 
     # Verificar que no haya tareas asociadas
-    tasks_count = db.query(TaskModel).filter(TaskModel.subject_id == subject_id).count()
+    tasks_count = await db.scalar(
+        select(func.count()).select_from(TaskModel).where(TaskModel.subject_id == subject_id)
+    )
     if tasks_count > 0:
         raise HTTPException(status_code=400, detail="Cannot delete subject with associated tasks")
 
-    db.delete(subject)
-    db.commit()
+    await db.execute(delete(TaskCounter).where(
+        TaskCounter.user_id == user.id,
+        TaskCounter.subject_key == subject.id
+    ))
+    await db.delete(subject)
+    await db.commit()
     return {"message": "Subject deleted successfully"}
 
 
 @router.get("/{subject_id}/stats")
 async def get_subject_stats(
     subject_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     user: AuthUser = CurrentUser
 ):
     """Obtener estadísticas de una materia"""
-    subject = db.query(SubjectModel).filter(
-        SubjectModel.id == subject_id,
-        SubjectModel.user_id == user.id
-    ).first()
+    stats = await subject_stats(db, user.id, subject_id)
 
-    if not subject:
+    if not stats:
         raise HTTPException(status_code=404, detail="Subject not found")
 
-    # Estadísticas básicas
-    total_tasks = db.query(TaskModel).filter(TaskModel.subject_id == subject_id).count()
-    completed_tasks = db.query(TaskModel).filter(
-        TaskModel.subject_id == subject_id,
-        TaskModel.status == "completed"
-    ).count()
-
-    pending_tasks = db.query(TaskModel).filter(
-        TaskModel.subject_id == subject_id,
-        TaskModel.status.in_(["pending", "in_progress"])
-    ).count()
-
-    return {
-        "subject_id": subject_id,
-        "subject_name": subject.name,
-        "total_tasks": total_tasks,
-        "completed_tasks": completed_tasks,
-        "pending_tasks": pending_tasks,
-        "completion_rate": (completed_tasks / total_tasks * 100) if total_tasks > 0 else 0
-    }
\ No newline at end of file
+    return stats[0]
@@ -1,25 +1,64 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import and_, case, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
 from datetime import datetime, timedelta
+from uuid import UUID
 
-from ..database import get_db
+from ..database import get_db, get_read_db
 from ..auth import CurrentUser, AuthUser
+from ..clients import get_ai_service
 from ..schemas import (
-    Task, TaskCreate, TaskUpdate, TaskAnalysisRequest, TaskAnalysisResponse
+    Task, TaskCreate, TaskUpdate, TaskAnalysisRequest, TaskAnalysisResponse, JobResponse
 )
 from ..models import Task as TaskModel
+from ..pagination import KeyColumn, paginate, set_cursor_headers
 from ..services.ai_service import AIService
+from ..services.ingestion import task_document_text
+from ..services.stats import TaskState, apply_task_change, task_overview
+from ..services.task_analysis import apply_task_analysis
+from ..services.urgency import OPEN_STATUS_FILTER, task_urgency
+from ..settings import settings
+from ..worker import analyze_task as analyze_task_job, enqueue_job, schedule_index_rebuild
 
 router = APIRouter(prefix="/tasks", tags=["tasks"])
-ai_service = AIService()
+
+# Orden del listado: prioridad (urgent primero), fecha límite (sin fecha al final), id.
+# La misma expresión está indexada en idx_tasks_user_priority_due.
+# Literales en línea (no parámetros) para que Postgres reconozca la expresión del índice.
+PRIORITY_RANK = {"urgent": 0, "high": 1, "medium": 2, "low": 3}
+priority_rank = case(
+    {literal_column(f"'{name}'"): literal_column(str(rank)) for name, rank in PRIORITY_RANK.items()},
+    value=TaskModel.priority,
+    else_=literal_column(str(len(PRIORITY_RANK)))
+)
+
+TASK_ORDER = (
+    KeyColumn(priority_rank, cast=int),
+    KeyColumn(TaskModel.due_date, nullable=True, cast=datetime.fromisoformat),
+    KeyColumn(TaskModel.id, cast=UUID),
+)
+
+
+def _task_sort_key(task: TaskModel) -> tuple:
+    return PRIORITY_RANK.get(task.priority, len(PRIORITY_RANK)), task.due_date, task.id
+
+
+async def _reindex(user_id: str) -> None:
+    """El título y la descripción de las tareas están en el índice de recuperación del usuario"""
+    try:
+        # SET NX en Redis + publicación en el broker: en un hilo, fuera del event loop
+        await run_in_threadpool(schedule_index_rebuild, str(user_id))
+    except Exception as e:
+        print(f"Could not schedule retrieval index rebuild: {str(e)}")
 
 
 @router.post("/", response_model=Task)
 async def create_task(
     task: TaskCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: AuthUser = CurrentUser
 ):
     """Crear una nueva tarea"""
@@ -27,54 +66,69 @@ async def create_task(
         user_id=user.id,
         **task.model_dump()
     )
+    db_task.urgency_score = task_urgency(db_task)
     db.add(db_task)
-    db.commit()
-    db.refresh(db_task)
+    await db.flush()
+    await apply_task_change(db, user.id, None, TaskState.of(db_task))
+    await db.commit()
+    await db.refresh(db_task)
+    await _reindex(user.id)
     return db_task
 
 
 @router.get("/", response_model=List[Task])
 async def get_tasks(
-    skip: int = 0,
-    limit: int = 100,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
     status: Optional[str] = None,
     priority: Optional[str] = None,
     subject_id: Optional[str] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     user: AuthUser = CurrentUser
 ):
-    """Obtener tareas del usuario con filtros opcionales"""
-    query = db.query(TaskModel).filter(TaskModel.user_id == user.id)
+    """Obtener tareas del usuario con filtros opcionales (cursores en X-Next-Cursor / X-Prev-Cursor)"""
+    query = select(TaskModel).where(TaskModel.user_id == user.id)
 
     if status:
-        query = query.filter(TaskModel.status == status)
+        query = query.where(TaskModel.status == status)
     if priority:
-        query = query.filter(TaskModel.priority == priority)
+        query = query.where(TaskModel.priority == priority)
     if subject_id:
-        query = query.filter(TaskModel.subject_id == subject_id)
+        query = query.where(TaskModel.subject_id == subject_id)
 
     # Ordenar por prioridad y fecha límite
-    query = query.order_by(
-        desc(TaskModel.priority == "urgent"),
-        desc(TaskModel.priority == "high"),
-        desc(TaskModel.priority == "medium"),
-        TaskModel.due_date.asc().nulls_last()
-    )
+    page = await paginate(db, query, TASK_ORDER, _task_sort_key, cursor, limit)
+    set_cursor_headers(response, page)
+    return page.items
+
 
-    tasks = query.offset(skip).limit(limit).all()
+@router.get("/next", response_model=List[Task])
+async def get_next_tasks(
+    limit: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_read_db),
+    user: AuthUser = CurrentUser
+):
+    """Tareas abiertas más urgentes primero (rango de idx_tasks_user_urgency)"""
+    tasks = (await db.scalars(
+        select(TaskModel)
+        .where(TaskModel.user_id == user.id, OPEN_STATUS_FILTER)
+        .order_by(TaskModel.urgency_score.desc().nulls_last(), TaskModel.id)
+        .limit(limit)
+    )).all()
     return tasks
 
 
 @router.get("/{task_id}", response_model=Task)
 async def get_task(
     task_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     user: AuthUser = CurrentUser
 ):
     """Obtener una tarea específica"""
-    task = db.query(TaskModel).filter(
+    task = await db.scalar(select(TaskModel).where(
         and_(TaskModel.id == task_id, TaskModel.user_id == user.id)
-    ).first()
+    ))
 
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
@@ -86,46 +140,57 @@ async def get_task(
 async def update_task(
     task_id: str,
     task_update: TaskUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: AuthUser = CurrentUser
 ):
     """Actualizar una tarea"""
-    task = db.query(TaskModel).filter(
+    task = await db.scalar(select(TaskModel).where(
         and_(TaskModel.id == task_id, TaskModel.user_id == user.id)
-    ).first()
+    ))
 
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
+    previous_state = TaskState.of(task)
+    changes = task_update.model_dump(exclude_unset=True)
+
     # Actualizar campos proporcionados
-    for field, value in task_update.model_dump(exclude_unset=True).items():
+    for field, value in changes.items():
         setattr(task, field, value)
 
     # Marcar como completada si el status cambió a completed
     if task_update.status == "completed" and task.status != "completed":
         task.completed_at = datetime.utcnow()
 
-    db.commit()
-    db.refresh(task)
+    task.urgency_score = task_urgency(task)
+
+    # Contadores de estadísticas: solo si cambian estado, materia o fecha límite
+    await apply_task_change(db, user.id, previous_state, TaskState.of(task))
+    await db.commit()
+    await db.refresh(task)
+    if "title" in changes or "description" in changes:
+        await _reindex(user.id)
     return task
 
 
 @router.delete("/{task_id}")
 async def delete_task(
     task_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: AuthUser = CurrentUser
 ):
     """Eliminar una tarea"""
-    task = db.query(TaskModel).filter(
+    task = await db.scalar(select(TaskModel).where(
         and_(TaskModel.id == task_id, TaskModel.user_id == user.id)
-    ).first()
+    ))
 
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    db.delete(task)
-    db.commit()
+    await apply_task_change(db, user.id, TaskState.of(task), None)
+    await db.delete(task)
+    await db.commit()
+    await _reindex(user.id)
     return {"message": "Task deleted successfully"}
 
 
@@ -133,36 +198,37 @@ async def delete_task(
 async def analyze_task(
     task_id: str,
     analysis_request: TaskAnalysisRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
+    ai_service: AIService = Depends(get_ai_service),
     user: AuthUser = CurrentUser
 ):
     """Analizar una tarea con IA para generar explicación y solución"""
-    task = db.query(TaskModel).filter(
+    task = await db.scalar(select(TaskModel).where(
         and_(TaskModel.id == task_id, TaskModel.user_id == user.id)
-    ).first()
+    ))
 
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
+    # Sin texto explícito, usar los documentos ingeridos de la tarea
+    content_text = analysis_request.content_text or await db.run_sync(
+        task_document_text, task.id, settings.ai_document_char_budget
+    ) or None
+
     try:
         # Analizar el contenido de la tarea con IA
         analysis_result = await ai_service.analyze_task_content(
             task.title,
             task.description or "",
             analysis_request.file_url,
-            analysis_request.content_text
+            content_text
         )
 
         # Actualizar la tarea con el análisis de IA
-        task.ai_analysis = analysis_result["analysis"]
-        task.ai_explanation = analysis_result["explanation"]
-        task.ai_solution = analysis_result["solution"]
+        apply_task_analysis(task, analysis_result, ai_service)
 
-        # Estimar dificultad basada en el análisis
-        task.priority = ai_service.estimate_difficulty_priority(analysis_result["analysis"])
-
-        db.commit()
-        db.refresh(task)
+        await db.commit()
+        await db.refresh(task)
 
         return TaskAnalysisResponse(**analysis_result)
 
@@ -170,22 +236,60 @@ async def analyze_task(
         raise HTTPException(status_code=500, detail=f"AI analysis failed: {str(e)}")
 
 
+@router.post("/{task_id}/analyze/async", response_model=JobResponse, status_code=202)
+async def analyze_task_async(
+    task_id: str,
+    analysis_request: TaskAnalysisRequest,
+    db: AsyncSession = Depends(get_db),
+    user: AuthUser = CurrentUser
+):
+    """Encolar el análisis con IA en el worker y devolver el id del job"""
+    task = await db.scalar(select(TaskModel).where(
+        and_(TaskModel.id == task_id, TaskModel.user_id == user.id)
+    ))
+
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    try:
+        # Publicación bloqueante en el broker: en un hilo, fuera del event loop
+        job = await run_in_threadpool(
+            enqueue_job,
+            analyze_task_job,
+            user.id,
+            str(task.id),
+            user.id,
+            analysis_request.file_url,
+            analysis_request.content_text
+        )
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Could not enqueue analysis: {str(e)}")
+
+    return JobResponse(job_id=job.id, status="queued", events_url=f"/jobs/{job.id}/events")
+
+
 @router.get("/upcoming/deadlines")
 async def get_upcoming_deadlines(
     days: int = 7,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     user: AuthUser = CurrentUser
 ):
     """Obtener tareas con fechas límite próximas"""
     cutoff_date = datetime.utcnow() + timedelta(days=days)
 
-    tasks = db.query(TaskModel).filter(
-        and_(
-            TaskModel.user_id == user.id,
-            TaskModel.due_date <= cutoff_date,
-            TaskModel.status.in_(["pending", "in_progress"])
+    # selectinload: la sesión asíncrona no admite cargas perezosas de task.subject
+    tasks = (await db.scalars(
+        select(TaskModel)
+        .options(selectinload(TaskModel.subject))
+        .where(
+            and_(
+                TaskModel.user_id == user.id,
+                TaskModel.due_date <= cutoff_date,
+                TaskModel.status.in_(["pending", "in_progress"])
+            )
         )
-    ).order_by(TaskModel.due_date.asc()).all()
+        .order_by(TaskModel.due_date.asc())
+    )).all()
 
     return {
         "upcoming_deadlines": [
@@ -204,31 +308,8 @@ async def get_upcoming_deadlines(
 
 @router.get("/stats/overview")
 async def get_task_stats(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     user: AuthUser = CurrentUser
 ):
     """Obtener estadísticas generales de tareas"""
-    total_tasks = db.query(TaskModel).filter(TaskModel.user_id == user.id).count()
-    completed_tasks = db.query(TaskModel).filter(
-        and_(TaskModel.user_id == user.id, TaskModel.status == "completed")
-    ).count()
-
-    pending_tasks = db.query(TaskModel).filter(
-        and_(TaskModel.user_id == user.id, TaskModel.status.in_(["pending", "in_progress"]))
-    ).count()
-
-    overdue_tasks = db.query(TaskModel).filter(
-        and_(
-            TaskModel.user_id == user.id,
-            TaskModel.due_date < datetime.utcnow(),
-            TaskModel.status.in_(["pending", "in_progress"])
-        )
-    ).count()
-
-    return {
-        "total_tasks": total_tasks,
-        "completed_tasks": completed_tasks,
-        "pending_tasks": pending_tasks,
-        "overdue_tasks": overdue_tasks,
-        "completion_rate": (completed_tasks / total_tasks * 100) if total_tasks > 0 else 0
-    }
\ No newline at end of file
+    return await task_overview(db, user.id)
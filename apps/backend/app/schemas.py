@@ -1,9 +1,64 @@
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
-from datetime import datetime, date
+import re
+from pydantic import BaseModel, BeforeValidator, Field
+from typing import Annotated, Optional, List, Dict, Any
+from datetime import datetime, date, timedelta
 from uuid import UUID
 
 
+# =====================================================
+# INTERVALOS
+# =====================================================
+
+_INTERVAL_UNITS = {
+    "week": 7 * 86400, "semana": 7 * 86400,
+    "day": 86400, "dia": 86400, "día": 86400, "d": 86400,
+    "hour": 3600, "hr": 3600, "hora": 3600, "h": 3600,
+    "minute": 60, "min": 60, "minuto": 60, "m": 60,
+    "second": 1, "sec": 1, "segundo": 1, "s": 1,
+}
+_INTERVAL_PART = re.compile(r"(\d+(?:[.,]\d+)?)\s*([^\W\d_]+)")
+_INTERVAL_CLOCK = re.compile(r"(\d+):(\d{1,2})(?::(\d{1,2}(?:\.\d+)?))?$")
+
+
+def _interval_unit(unit: str) -> Optional[int]:
+    return _INTERVAL_UNITS.get(unit) or (_INTERVAL_UNITS.get(unit[:-1]) if unit.endswith("s") else None)
+
+
+def parse_interval(value: Any) -> Any:
+    """
+    Texto de un interval de Postgres como timedelta: "2 hours", "1 day 02:30:00",
+    "90 min", "1h 30m", "2 horas". Lo demás (ISO 8601 como "PT2H", segundos)
+    lo interpreta pydantic.
+    """
+    if not isinstance(value, str):
+        return value
+    text = value.strip().lower()
+    if not text:
+        return None
+    clock = _INTERVAL_CLOCK.search(text)
+    rest = text[:clock.start()] if clock else text
+    parts = list(_INTERVAL_PART.finditer(rest))
+    if not parts and not clock:
+        return value
+    if _INTERVAL_PART.sub("", rest).strip(" ,y"):
+        return value
+
+    seconds = 0.0
+    for number, unit in (match.groups() for match in parts):
+        factor = _interval_unit(unit)
+        if factor is None:
+            return value
+        seconds += float(number.replace(",", ".")) * factor
+    if clock:
+        hours, minutes, secs = clock.groups()
+        seconds += int(hours) * 3600 + int(minutes) * 60 + float(secs or 0)
+    return timedelta(seconds=seconds)
+
+
+# Columnas INTERVAL: se aceptan como texto y se guardan como timedelta (asyncpg solo acepta timedelta)
+IntervalValue = Annotated[timedelta, BeforeValidator(parse_interval)]
+
+
 # =====================================================
 # RESPUESTAS BÁSICAS
 # =====================================================
@@ -25,6 +80,77 @@ class SignedUploadResponse(BaseModel):
     token: str | None = None
 
 
+class SignedUploadBatchRequest(BaseModel):
+    uploads: List[SignedUploadRequest] = Field(..., min_length=1)
+
+
+class SignedUploadError(BaseModel):
+    bucket: str
+    path: str
+    detail: str
+
+
+class SignedUploadBatchResponse(BaseModel):
+    uploads: List[SignedUploadResponse]
+    errors: List[SignedUploadError] = []
+
+
+# Subidas reanudables por partes
+class UploadCreateRequest(BaseModel):
+    bucket: str = Field(default="files")
+    path: str = Field(..., description="Storage path, e.g. userId/tasks/taskId/file.pdf")
+    size_bytes: int = Field(..., gt=0)
+    content_type: Optional[str] = None
+    sha256: Optional[str] = Field(None, pattern="^[0-9a-fA-F]{64}$")
+    part_size: Optional[int] = Field(None, gt=0, description="Smaller parts for slow connections")
+
+
+class UploadCompleteResponse(BaseModel):
+    bucket: str
+    path: str
+    size_bytes: int
+    sha256: str
+    # El usuario ya tenía un documento con este contenido: no se guardó una copia
+    document_id: Optional[str] = None
+    deduplicated: bool = False
+
+
+class UploadSessionResponse(BaseModel):
+    upload_id: Optional[str] = None
+    bucket: str
+    path: str
+    size_bytes: int
+    part_size: int
+    part_count: int
+    received_parts: List[int] = []
+    # Con sha256 conocido: archivo ya subido, no hace falta enviar partes
+    duplicate: Optional[UploadCompleteResponse] = None
+
+
+class UploadPartResponse(BaseModel):
+    upload_id: str
+    index: int
+    size_bytes: int
+    sha256: str
+
+
+class IngestFileRequest(BaseModel):
+    bucket: str = Field(default="files")
+    path: str = Field(..., description="Storage path, e.g. userId/tasks/taskId/file.pdf")
+    task_id: Optional[UUID] = None
+    filename: Optional[str] = None
+    mime_type: Optional[str] = None
+    sha256: Optional[str] = Field(None, pattern="^[0-9a-fA-F]{64}$", description="Reuse an already ingested copy")
+
+
+class IngestFileResponse(BaseModel):
+    document_id: str
+    job_id: Optional[str] = None
+    status: str
+    events_url: Optional[str] = None
+    deduplicated: bool = False
+
+
 class ChatRequest(BaseModel):
     message: str = Field(..., min_length=1)
     mode: str = Field(default="learn", description="learn | review")
@@ -121,7 +247,7 @@ class TaskBase(BaseModel):
 class TaskCreate(TaskBase):
     subject_id: Optional[UUID] = None
     due_date: Optional[datetime] = None
-    estimated_duration: Optional[str] = None  # Interval as string
+    estimated_duration: Optional[IntervalValue] = None
     tags: List[str] = []
 
 
@@ -133,8 +259,8 @@ class TaskUpdate(BaseModel):
     status: Optional[str] = None
     subject_id: Optional[UUID] = None
     due_date: Optional[datetime] = None
-    estimated_duration: Optional[str] = None
-    actual_duration: Optional[str] = None
+    estimated_duration: Optional[IntervalValue] = None
+    actual_duration: Optional[IntervalValue] = None
     tags: Optional[List[str]] = None
     progress_percentage: Optional[int] = None
     notes: Optional[str] = None
@@ -146,8 +272,8 @@ class Task(TaskBase):
     subject_id: Optional[UUID] = None
     status: str = "pending"
     due_date: Optional[datetime] = None
-    estimated_duration: Optional[str] = None
-    actual_duration: Optional[str] = None
+    estimated_duration: Optional[timedelta] = None
+    actual_duration: Optional[timedelta] = None
     completed_at: Optional[datetime] = None
     attachments: List[Dict[str, Any]] = []
     ai_analysis: Dict[str, Any] = {}
@@ -156,6 +282,7 @@ class Task(TaskBase):
     tags: List[str] = []
     progress_percentage: int = 0
     notes: Optional[str] = None
+    urgency_score: Optional[float] = None
     created_at: datetime
     updated_at: datetime
 
@@ -211,6 +338,61 @@ class Flashcard(FlashcardBase):
         from_attributes = True
 
 
+class FlashcardGenerateRequest(BaseModel):
+    document_id: UUID
+    # Por defecto la materia de la tarea a la que pertenece el documento
+    subject_id: Optional[UUID] = None
+    cards_per_chunk: int = Field(3, ge=1, le=10)
+
+
+# Repaso espaciado (SM-2)
+class ReviewGrade(BaseModel):
+    card_id: UUID
+    grade: int = Field(..., ge=0, le=5, description="SM-2 quality: 0-2 forgotten, 3-5 recalled")
+    reviewed_at: Optional[datetime] = None
+
+
+class ReviewBatchRequest(BaseModel):
+    reviews: List[ReviewGrade] = Field(..., min_length=1)
+    # Lotes sucesivos de un mismo repaso se suman a la misma sesión
+    session_id: Optional[UUID] = None
+    subject_id: Optional[UUID] = None
+    started_at: Optional[datetime] = None
+
+
+class ReviewedCard(BaseModel):
+    id: UUID
+    easiness_factor: float
+    interval_days: int
+    repetitions: int
+    next_review_date: date
+
+
+class ReviewBatchResponse(BaseModel):
+    session_id: UUID
+    reviewed: int
+    correct: int
+    cards: List[ReviewedCard]
+    missing: List[str] = []
+
+
+class ReviewForecastDay(BaseModel):
+    date: date
+    expected: float
+    # Percentiles 10 y 90 de las simulaciones
+    low: int
+    high: int
+
+
+class ReviewForecastResponse(BaseModel):
+    cards: int
+    simulations: int
+    days: List[ReviewForecastDay]
+    total_expected: float
+    peak_date: Optional[date] = None
+    peak_expected: float = 0.0
+
+
 # =====================================================
 # QUIZZES
 # =====================================================
@@ -257,6 +439,27 @@ class Quiz(QuizBase):
         from_attributes = True
 
 
+class QuizGenerateRequest(BaseModel):
+    subject_id: UUID
+    topic: str = Field(..., min_length=1, max_length=200)
+    difficulty: int = Field(3, ge=1, le=5)
+    num_questions: int = Field(10, ge=1, le=100)
+    title: Optional[str] = None
+    description: Optional[str] = None
+    quiz_type: str = Field("practice", pattern="^(practice|exam_sim|spaced_review|weak_topics)$")
+    task_id: Optional[UUID] = None
+    passing_score: Optional[float] = None
+    subtopics: Optional[List[str]] = None
+    question_types: Optional[List[str]] = None
+
+
+class QuizGenerateResponse(BaseModel):
+    quiz: Quiz
+    # Preguntas servidas desde el banco compartido y generadas en esta petición
+    from_bank: int
+    generated: int
+
+
 # =====================================================
 # CALENDARIO
 # =====================================================
@@ -428,6 +631,45 @@ class TaskAnalysisResponse(BaseModel):
     key_concepts: List[str]
 
 
+# Formato que se exige a las respuestas del LLM (ver services/structured_output.py)
+class GeneratedQuizQuestion(BaseModel):
+    question: str = Field(..., min_length=1)
+    type: str = "multiple_choice"
+    options: Optional[List[str]] = None
+    correct_answer: Any
+    explanation: Optional[str] = None
+    difficulty: Optional[int] = None
+
+
+class GeneratedFlashcard(BaseModel):
+    front: str = Field(..., min_length=1)
+    back: str = Field(..., min_length=1)
+
+
+class StudyPatternAnalysis(BaseModel):
+    strengths: List[str]
+    weaknesses: List[str]
+    recommendations: List[str]
+    optimal_study_time: str
+    suggested_session_duration: str
+    study_streak_maintenance: str
+
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+    events_url: str
+
+
+class JobStatus(BaseModel):
+    job_id: str
+    state: str
+    stage: Optional[str] = None
+    progress: Optional[Dict[str, Any]] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+
 class StudyRecommendation(BaseModel):
     recommended_sessions: List[Dict[str, Any]]
     priority_subjects: List[Dict[str, Any]]
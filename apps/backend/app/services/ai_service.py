@@ -1,13 +1,37 @@
 import os
 import json
-from typing import Dict, List, Any, Optional
-from groq import Groq
+import math
+import asyncio
+from itertools import chain, zip_longest
+from typing import Callable, Dict, List, Any, Optional, Tuple
+from ..schemas import GeneratedFlashcard, GeneratedQuizQuestion, StudyPatternAnalysis, TaskAnalysisResponse
 from ..settings import settings
+from .llm_client import LLMClient, LLMStream, get_llm_client
+from .response_cache import response_cache
+from .similarity import NearDuplicateFilter
+from .structured_output import complete_list, complete_object
+
+# Reparto de tipos de pregunta cuando el quiz se divide en lotes
+QUIZ_TYPE_WEIGHTS = {"multiple_choice": 0.6, "true_false": 0.2, "short_answer": 0.2}
+# Enfoques para variar los lotes cuando no se indican subtemas
+QUIZ_FOCUS = [
+    "definiciones y conceptos clave",
+    "aplicación práctica",
+    "resolución de problemas",
+    "análisis y comparación",
+    "casos y ejemplos",
+]
+QUIZ_BASE_TOKENS = 200
 
 
 class AIService:
-    def __init__(self):
-        self.client = Groq(api_key=settings.groq_api_key)
+    def __init__(self, llm: Optional[Callable[[], LLMClient]] = None):
+        # Proveedor del cliente LLM (el registro de clientes lo inyecta); por defecto el del proceso
+        self._llm = llm or get_llm_client
+
+    @property
+    def llm(self) -> LLMClient:
+        return self._llm()
 
     async def analyze_task_content(
         self,
@@ -26,14 +50,14 @@ class AIService:
         # Preparar el contenido para análisis
         content = f"Título: {title}\nDescripción: {description}"
         if content_text:
-            content += f"\nContenido del archivo: {content_text[:2000]}"  # Limitar longitud
+            content += f"\nContenido del archivo: {content_text[:settings.ai_document_char_budget]}"  # Limitar longitud
 
         prompt = f"""
         Analiza esta tarea universitaria y proporciona un análisis detallado:
 
         {content}
 
-        Proporciona tu respuesta en formato JSON con la siguiente estructura:
+        Responde solo con un objeto JSON con la siguiente estructura:
         {{
             "analysis": {{
                 "task_type": "tipo de tarea (homework/exam/project/etc)",
@@ -66,22 +90,30 @@ class AIService:
         Si es un ensayo, proporciona estructura y consejos de redacción.
         """
 
+        cache_key = response_cache.make_key(
+            "analyze_task_content",
+            self.llm.model,
+            {"title": title, "description": description, "content_text": content_text[:settings.ai_document_char_budget] if content_text else None},
+            {"temperature": 0.3, "max_tokens": 2000}
+        )
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
-            completion = self.client.chat.completions.create(
-                model=settings.groq_model,
-                messages=[{"role": "user", "content": prompt}],
+            # Validado contra TaskAnalysisResponse; si faltan campos se piden solo esos
+            result = await complete_object(
+                self.llm,
+                [{"role": "user", "content": prompt}],
+                TaskAnalysisResponse,
                 temperature=0.3,
                 max_tokens=2000
             )
-
-            response_text = completion.choices[0].message.content or "{}"
-
-            # Intentar parsear JSON
-            try:
-                result = json.loads(response_text)
+            if result is not None:
+                await response_cache.set(cache_key, result)
                 return result
-            except json.JSONDecodeError:
-                # Si falla el parseo, crear una estructura básica
+            else:
+                # Si no se consigue una respuesta válida, crear una estructura básica
                 return {
                     "analysis": {
                         "task_type": "other",
@@ -155,45 +187,145 @@ class AIService:
         subject: str,
         topic: str,
         difficulty: int = 3,
-        num_questions: int = 10
+        num_questions: int = 10,
+        subtopics: Optional[List[str]] = None,
+        question_types: Optional[List[str]] = None,
+        avoid: Optional[List[str]] = None
     ) -> List[Dict[str, Any]]:
-        """Genera preguntas de quiz automáticamente"""
+        """
+        Genera preguntas de quiz automáticamente (`avoid`: enunciados que no se deben repetir).
+        El quiz se reparte en lotes pequeños por tipo de pregunta y subtema que se piden en paralelo
+        (el semáforo del cliente LLM limita cuántos van a la vez); al unirlos se descartan las
+        preguntas casi repetidas y, si faltan, se pide una ronda más.
+        """
+
+        cache_key = response_cache.make_key(
+            "generate_quiz_questions",
+            self.llm.model,
+            {
+                "subject": subject, "topic": topic, "difficulty": difficulty, "num_questions": num_questions,
+                "subtopics": subtopics, "question_types": question_types, "avoid": avoid
+            },
+            {"temperature": 0.7, "batch_size": settings.quiz_batch_size}
+        )
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        unique = NearDuplicateFilter(settings.quiz_duplicate_threshold)
+        for text in avoid or []:
+            unique.add(text)
+        questions: List[Dict[str, Any]] = []
+        # Se piden algunas de más para que los descartes no obliguen a otra ronda
+        extra = math.ceil(num_questions * settings.quiz_overgenerate_ratio) if num_questions > settings.quiz_batch_size else 0
+        batches = self._plan_quiz_batches(num_questions + extra, subtopics, question_types)
+        for _ in range(1 + settings.quiz_top_up_rounds):
+            results = await asyncio.gather(*(
+                self._generate_quiz_batch(subject, topic, difficulty, count, types, focus,
+                                          avoid=(avoid or []) + [q["question"] for q in questions])
+                for count, types, focus in batches
+            ))
+            # Intercalando los lotes, el recorte a num_questions respeta el reparto por tipo y subtema
+            for question in chain.from_iterable(zip_longest(*results)):
+                if question and len(questions) < num_questions and unique.add(question["question"]):
+                    questions.append(question)
+
+            missing = num_questions - len(questions)
+            if missing <= 0:
+                break
+            # Ronda extra solo por lo que faltó (lotes cortados o preguntas repetidas)
+            batches = self._plan_quiz_batches(missing, subtopics, question_types, offset=len(batches))
+
+        if questions:
+            await response_cache.set(cache_key, questions)
+        return questions
+
+    def _plan_quiz_batches(
+        self,
+        num_questions: int,
+        subtopics: Optional[List[str]],
+        question_types: Optional[List[str]],
+        offset: int = 0
+    ) -> List[Tuple[int, Optional[List[str]], Optional[str]]]:
+        """Lotes (cantidad, tipos, subtema) de como mucho quiz_batch_size preguntas"""
+        batch_size = max(1, settings.quiz_batch_size)
+        if num_questions <= batch_size and not subtopics and not question_types:
+            # Un solo lote con variedad de tipos, como una petición normal
+            return [(num_questions, None, None)]
+
+        weights = (
+            {t: 1.0 for t in question_types} if question_types
+            else QUIZ_TYPE_WEIGHTS
+        )
+        # Reparto por tipos con restos mayores, para que las cantidades sumen num_questions
+        total = sum(weights.values())
+        shares = {t: num_questions * w / total for t, w in weights.items()}
+        counts = {t: int(share) for t, share in shares.items()}
+        for t in sorted(shares, key=lambda t: shares[t] - counts[t], reverse=True)[:num_questions - sum(counts.values())]:
+            counts[t] += 1
+
+        focuses = subtopics or QUIZ_FOCUS
+        batches: List[Tuple[int, Optional[List[str]], Optional[str]]] = []
+        for question_type, count in counts.items():
+            # Lotes de tamaño parecido (6 -> 3 + 3, no 5 + 1)
+            parts = -(-count // batch_size)
+            for i in range(parts):
+                size = count // parts + (1 if i < count % parts else 0)
+                batches.append((size, [question_type], focuses[(offset + len(batches)) % len(focuses)]))
+        return batches
+
+    async def _generate_quiz_batch(
+        self,
+        subject: str,
+        topic: str,
+        difficulty: int,
+        num_questions: int,
+        question_types: Optional[List[str]],
+        focus: Optional[str],
+        avoid: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """Un lote de preguntas (solo las que validan contra GeneratedQuizQuestion); [] si falla"""
+
+        types = "|".join(question_types) if question_types else "multiple_choice|true_false|short_answer"
+        extra = ""
+        if focus:
+            extra += f"\n        Céntrate en: {focus}."
+        if avoid:
+            listed = "\n".join(f"- {q}" for q in avoid[-20:])
+            extra += f"\n        No repitas estas preguntas ya generadas:\n{listed}"
 
         prompt = f"""
         Genera {num_questions} preguntas de quiz sobre {topic} para la materia {subject}.
-        Nivel de dificultad: {difficulty}/5 (1=fácil, 5=difícil)
-
-        Formato requerido (JSON):
-        [
-            {{
-                "question": "Pregunta aquí",
-                "type": "multiple_choice|true_false|short_answer",
-                "options": ["A) Opción1", "B) Opción2", "C) Opción3", "D) Opción4"] // solo para multiple_choice
-                "correct_answer": "A) Opción1",
-                "explanation": "Explicación breve de por qué es correcta",
-                "difficulty": {difficulty}
-            }}
-        ]
+        Nivel de dificultad: {difficulty}/5 (1=fácil, 5=difícil){extra}
+
+        Formato requerido (objeto JSON):
+        {{
+            "questions": [
+                {{
+                    "question": "Pregunta aquí",
+                    "type": "{types}",
+                    "options": ["A) Opción1", "B) Opción2", "C) Opción3", "D) Opción4"] // solo para multiple_choice
+                    "correct_answer": "A) Opción1",
+                    "explanation": "Explicación breve de por qué es correcta",
+                    "difficulty": {difficulty}
+                }}
+            ]
+        }}
 
-        Incluye variedad de tipos de preguntas. Para matemáticas, incluye cálculo paso a paso.
+        {"Incluye variedad de tipos de preguntas." if not question_types else "Todas las preguntas deben ser del tipo indicado."} Para matemáticas, incluye cálculo paso a paso.
         """
 
         try:
-            completion = self.client.chat.completions.create(
-                model=settings.groq_model,
-                messages=[{"role": "user", "content": prompt}],
+            # Si la respuesta se corta se conservan las preguntas completas y se piden solo las que faltan
+            return await complete_list(
+                self.llm,
+                [{"role": "user", "content": prompt}],
+                GeneratedQuizQuestion,
+                "questions",
+                num_questions,
                 temperature=0.7,
-                max_tokens=1500
+                max_tokens=QUIZ_BASE_TOKENS + num_questions * settings.quiz_tokens_per_question
             )
-
-            response_text = completion.choices[0].message.content or "[]"
-
-            try:
-                questions = json.loads(response_text)
-                return questions if isinstance(questions, list) else []
-            except json.JSONDecodeError:
-                return []
-
         except Exception as e:
             print(f"Error generating quiz: {str(e)}")
             return []
@@ -212,33 +344,43 @@ class AIService:
         CONTENIDO:
         {content[:3000]}
 
-        Formato JSON:
-        [
-            {{
-                "front": "Pregunta o concepto clave",
-                "back": "Respuesta o explicación detallada"
-            }}
-        ]
+        Formato (objeto JSON):
+        {{
+            "flashcards": [
+                {{
+                    "front": "Pregunta o concepto clave",
+                    "back": "Respuesta o explicación detallada"
+                }}
+            ]
+        }}
 
         Enfócate en conceptos importantes, definiciones, fórmulas, y relaciones clave.
         Las flashcards deben ser efectivas para estudio espaciado.
         """
 
+        cache_key = response_cache.make_key(
+            "generate_flashcards",
+            self.llm.model,
+            {"content": content[:3000], "subject": subject, "num_cards": num_cards},
+            {"temperature": 0.6, "max_tokens": 1200}
+        )
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
-            completion = self.client.chat.completions.create(
-                model=settings.groq_model,
-                messages=[{"role": "user", "content": prompt}],
+            flashcards = await complete_list(
+                self.llm,
+                [{"role": "user", "content": prompt}],
+                GeneratedFlashcard,
+                "flashcards",
+                num_cards,
                 temperature=0.6,
                 max_tokens=1200
             )
-
-            response_text = completion.choices[0].message.content or "[]"
-
-            try:
-                flashcards = json.loads(response_text)
-                return flashcards if isinstance(flashcards, list) else []
-            except json.JSONDecodeError:
-                return []
+            if flashcards:
+                await response_cache.set(cache_key, flashcards)
+            return flashcards
 
         except Exception as e:
             print(f"Error generating flashcards: {str(e)}")
@@ -261,7 +403,7 @@ class AIService:
 
         {study_data}
 
-        Responde en JSON:
+        Responde solo con un objeto JSON:
         {{
             "strengths": ["fortaleza1", "fortaleza2"],
             "weaknesses": ["debilidad1", "debilidad2"],
@@ -273,19 +415,14 @@ class AIService:
         """
 
         try:
-            completion = self.client.chat.completions.create(
-                model=settings.groq_model,
-                messages=[{"role": "user", "content": prompt}],
+            result = await complete_object(
+                self.llm,
+                [{"role": "user", "content": prompt}],
+                StudyPatternAnalysis,
                 temperature=0.4,
                 max_tokens=800
             )
-
-            response_text = completion.choices[0].message.content or "{}"
-
-            try:
-                return json.loads(response_text)
-            except json.JSONDecodeError:
-                return {}
+            return result or {}
 
         except Exception as e:
             print(f"Error analyzing study pattern: {str(e)}")
@@ -296,29 +433,25 @@ class AIService:
         user_message: str,
         chat_type: str,
         mode: str,
-        context: str = ""
+        context: str = "",
+        history: Optional[List[Dict[str, str]]] = None,
+        summary: Optional[str] = None
     ) -> Dict[str, Any]:
         """Genera respuesta de chat contextual"""
 
-        system_prompt = self._get_chat_system_prompt(chat_type, mode, context)
-
         try:
-            completion = self.client.chat.completions.create(
-                model=settings.groq_model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
+            completion = await self.llm.complete(
+                messages=self._build_chat_messages(user_message, chat_type, mode, context, history, summary),
                 temperature=0.7,
                 max_tokens=1000
             )
 
-            content = completion.choices[0].message.content or "Lo siento, no pude generar una respuesta."
+            content = completion.content or "Lo siento, no pude generar una respuesta."
 
             return {
                 "content": content.strip(),
-                "tokens_used": completion.usage.total_tokens if completion.usage else None,
-                "model_used": settings.groq_model
+                "tokens_used": completion.tokens_used,
+                "model_used": completion.model
             }
 
         except Exception as e:
@@ -328,6 +461,72 @@ class AIService:
                 "error": str(e)
             }
 
+    def stream_chat_response(
+        self,
+        user_message: str,
+        chat_type: str,
+        mode: str,
+        context: str = "",
+        history: Optional[List[Dict[str, str]]] = None,
+        summary: Optional[str] = None
+    ) -> LLMStream:
+        """Igual que generate_chat_response pero devolviendo los tokens en streaming"""
+        return self.llm.stream(
+            messages=self._build_chat_messages(user_message, chat_type, mode, context, history, summary),
+            temperature=0.7,
+            max_tokens=1000
+        )
+
+    async def summarize_conversation(
+        self,
+        previous_summary: Optional[str],
+        messages: List[Dict[str, str]]
+    ) -> str:
+        """Integra mensajes antiguos en el resumen acumulado de un chat"""
+
+        transcript = "\n".join(
+            f"{'Estudiante' if m['role'] == 'user' else 'Tutor'}: {m['content']}" for m in messages
+        )
+        prompt = f"""
+        Actualiza el resumen de una conversación de tutoría universitaria.
+
+        RESUMEN ACTUAL:
+        {previous_summary or '(vacío)'}
+
+        NUEVOS MENSAJES:
+        {transcript}
+
+        Escribe el resumen actualizado en español, en menos de {settings.chat_summary_max_tokens} tokens.
+        Conserva: temas tratados, dudas del estudiante, explicaciones y resultados clave,
+        y lo que quedó pendiente. Responde solo con el resumen.
+        """
+
+        completion = await self.llm.complete(
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.2,
+            max_tokens=settings.chat_summary_max_tokens
+        )
+        return completion.content.strip()
+
+    def _build_chat_messages(
+        self,
+        user_message: str,
+        chat_type: str,
+        mode: str,
+        context: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        summary: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        system_prompt = self._get_chat_system_prompt(chat_type, mode, context)
+        if summary:
+            system_prompt += f"\n\nRESUMEN DE LA CONVERSACIÓN ANTERIOR:\n{summary}"
+
+        return [
+            {"role": "system", "content": system_prompt},
+            *(history or []),
+            {"role": "user", "content": user_message}
+        ]
+
     def _get_chat_system_prompt(self, chat_type: str, mode: str, context: str) -> str:
         """Genera el prompt del sistema basado en el tipo de chat"""
 
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy import and_, or_, update
+from sqlalchemy.sql.expression import Update
+from sqlalchemy.orm import Session
+
+from ..models import Chat as ChatModel, ChatMessage as ChatMessageModel
+from ..settings import settings
+
+PAGE_SIZE = 20
+# Longitud del extracto del último mensaje que se muestra en el listado de chats
+PREVIEW_CHARS = 100
+# Coste fijo aproximado por mensaje (rol, separadores)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación barata (~4 caracteres por token), suficiente para presupuestar"""
+    return len(text) // 4 + MESSAGE_OVERHEAD_TOKENS
+
+
+@dataclass
+class ChatWindow:
+    summary: Optional[str]
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    tokens: int = 0
+    # Hay mensajes sin resumir que no cupieron en la ventana
+    overflow: bool = False
+    # Mensaje más antiguo incluido en la ventana (límite para el resumen)
+    oldest_at: Optional[datetime] = None
+    oldest_id: Optional[UUID] = None
+
+
+def message_preview(content: str) -> str:
+    return content[:PREVIEW_CHARS] + "..." if len(content) > PREVIEW_CHARS else content
+
+
+def last_message_update(message: ChatMessageModel) -> Update:
+    """
+    Actualiza la proyección del último mensaje del chat (id, extracto y fecha).
+    No retrocede si un mensaje más antiguo se guarda después de otro más nuevo.
+    """
+    return (
+        update(ChatModel)
+        .where(
+            ChatModel.id == message.chat_id,
+            or_(ChatModel.last_message_at.is_(None), ChatModel.last_message_at <= message.created_at),
+        )
+        .values(
+            last_message_id=message.id,
+            last_message_preview=message_preview(message.content),
+            last_message_at=message.created_at,
+            updated_at=message.created_at,
+        )
+        .execution_options(synchronize_session="fetch")
+    )
+
+
+def _after_summary(chat: ChatModel):
+    if chat.summary_through_at is None:
+        return None
+    return or_(
+        ChatMessageModel.created_at > chat.summary_through_at,
+        and_(
+            ChatMessageModel.created_at == chat.summary_through_at,
+            ChatMessageModel.id > chat.summary_through_id,
+        ),
+    )
+
+
+def _before(created_at: datetime, message_id: UUID):
+    return or_(
+        ChatMessageModel.created_at < created_at,
+        and_(ChatMessageModel.created_at == created_at, ChatMessageModel.id < message_id),
+    )
+
+
+def load_window(db: Session, chat: ChatModel, budget_tokens: Optional[int] = None) -> ChatWindow:
+    """
+    Mensajes recientes del chat que caben en el presupuesto de tokens, del más nuevo
+    al más antiguo con paginación keyset sobre (created_at, id), sin pasar del resumen.
+    """
+    budget = budget_tokens or settings.chat_history_token_budget
+    if chat.summary:
+        budget -= estimate_tokens(chat.summary)
+    window = ChatWindow(summary=chat.summary)
+
+    collected: List[ChatMessageModel] = []
+    cursor = None
+    after_summary = _after_summary(chat)
+    while True:
+        query = db.query(ChatMessageModel).filter(ChatMessageModel.chat_id == chat.id)
+        if after_summary is not None:
+            query = query.filter(after_summary)
+        if cursor is not None:
+            query = query.filter(_before(*cursor))
+        page = query.order_by(ChatMessageModel.created_at.desc(), ChatMessageModel.id.desc()).limit(PAGE_SIZE).all()
+        if not page:
+            break
+
+        for msg in page:
+            cost = estimate_tokens(msg.content)
+            if len(collected) >= settings.chat_history_max_messages or window.tokens + cost > budget:
+                window.overflow = True
+                break
+            window.tokens += cost
+            collected.append(msg)
+        if window.overflow or len(page) < PAGE_SIZE:
+            break
+        cursor = (page[-1].created_at, page[-1].id)
+
+    if collected:
+        window.oldest_at = collected[-1].created_at
+        window.oldest_id = collected[-1].id
+    window.messages = [{"role": m.role, "content": m.content} for m in reversed(collected)]
+    return window
+
+
+def messages_to_summarize(db: Session, chat: ChatModel, window: ChatWindow, max_tokens: int) -> List[ChatMessageModel]:
+    """Mensajes posteriores al resumen y anteriores a la ventana, en orden cronológico"""
+    query = db.query(ChatMessageModel).filter(ChatMessageModel.chat_id == chat.id)
+    after_summary = _after_summary(chat)
+    if after_summary is not None:
+        query = query.filter(after_summary)
+    if window.oldest_at is not None:
+        query = query.filter(_before(window.oldest_at, window.oldest_id))
+
+    selected: List[ChatMessageModel] = []
+    tokens = 0
+    for msg in query.order_by(ChatMessageModel.created_at, ChatMessageModel.id).yield_per(PAGE_SIZE):
+        cost = estimate_tokens(msg.content)
+        if selected and tokens + cost > max_tokens:
+            break
+        selected.append(msg)
+        tokens += cost
+    return selected
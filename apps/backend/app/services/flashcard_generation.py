@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Sequence
+
+from sqlalchemy import Text, cast, func, insert, literal_column, select, true
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session
+
+from ..models import DocumentChunk as DocumentChunkModel, Document as DocumentModel, Flashcard as FlashcardModel
+from ..settings import settings
+from .ai_service import AIService
+from .similarity import NearDuplicateFilter, jaccard, shingle_hashes
+
+# Misma expresión que idx_flashcards_search (constantes literales, no parámetros),
+# para que Postgres use el índice GIN
+FLASHCARD_SEARCH_DOCUMENT = func.to_tsvector(
+    literal_column("'spanish'::regconfig"),
+    FlashcardModel.front_content + literal_column("' '") + FlashcardModel.back_content,
+)
+# Tarjetas existentes que se comparan con cada candidata
+MATCHES_PER_CARD = 5
+
+
+@dataclass
+class ChunkText:
+    chunk_index: int
+    page_start: Optional[int]
+    page_end: Optional[int]
+    text: str
+
+
+@dataclass
+class GeneratedCard:
+    chunk: ChunkText
+    front: str
+    back: str
+
+
+def document_chunks(db: Session, document: DocumentModel, max_chunks: int) -> List[ChunkText]:
+    """Chunks del documento en orden, sin el texto repetido del chunk anterior"""
+    rows = db.execute(
+        select(
+            DocumentChunkModel.chunk_index,
+            DocumentChunkModel.page_start,
+            DocumentChunkModel.page_end,
+            DocumentChunkModel.content,
+            DocumentChunkModel.overlap_chars,
+        )
+        .where(DocumentChunkModel.document_id == document.id)
+        .order_by(DocumentChunkModel.chunk_index)
+        .limit(max_chunks)
+    ).all()
+    chunks = []
+    for i, (chunk_index, page_start, page_end, content, overlap_chars) in enumerate(rows):
+        text = content if i == 0 else content[overlap_chars or 0:].lstrip()
+        if text.strip():
+            chunks.append(ChunkText(chunk_index, page_start, page_end, text))
+    return chunks
+
+
+async def generate_chunk_cards(
+    ai_service: AIService,
+    chunks: Sequence[ChunkText],
+    subject_name: str,
+    cards_per_chunk: int,
+    concurrency: int,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> List[GeneratedCard]:
+    """
+    Flashcards de cada chunk, como mucho `concurrency` completions a la vez.
+    `progress(chunks_done, cards)` se llama al terminar cada chunk. Conserva el orden del documento.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    done = 0
+    found = 0
+
+    async def one(chunk: ChunkText) -> List[GeneratedCard]:
+        nonlocal done, found
+        async with semaphore:
+            cards = await ai_service.generate_flashcards(chunk.text, subject_name, cards_per_chunk)
+        generated = [
+            GeneratedCard(chunk, card["front"].strip(), card["back"].strip())
+            for card in cards
+            if isinstance(card, dict)
+            and isinstance(card.get("front"), str) and card["front"].strip()
+            and isinstance(card.get("back"), str) and card["back"].strip()
+        ]
+        done += 1
+        found += len(generated)
+        if progress:
+            progress(done, found)
+        return generated
+
+    results = await asyncio.gather(*(one(chunk) for chunk in chunks))
+    return [card for cards in results for card in cards]
+
+
+def _existing_matches(db: Session, user_id: Any, fronts: List[str]) -> Dict[int, List[str]]:
+    """Para cada candidata (por posición), enunciados de tarjetas del usuario que podrían ser la misma"""
+    if not fronts:
+        return {}
+
+    if db.get_bind().dialect.name != "postgresql":
+        # Sin índice de texto completo (SQLite en desarrollo): se comparan todas
+        existing = db.execute(
+            select(FlashcardModel.front_content).where(FlashcardModel.user_id == user_id)
+        ).scalars().all()
+        return {i: list(existing) for i in range(len(fronts))}
+
+    # Una sola consulta: cada candidata busca en el índice GIN las tarjetas que contienen sus términos
+    candidates = (
+        func.unnest(cast(fronts, ARRAY(Text)))
+        .table_valued("front", with_ordinality="position")
+        .render_derived()
+    )
+    matches = (
+        select(FlashcardModel.front_content)
+        .where(
+            FlashcardModel.user_id == user_id,
+            FLASHCARD_SEARCH_DOCUMENT.op("@@")(func.plainto_tsquery(literal_column("'spanish'::regconfig"), candidates.c.front)),
+        )
+        .limit(MATCHES_PER_CARD)
+        .lateral()
+    )
+    rows = db.execute(
+        select(candidates.c.position, matches.c.front_content)
+        .select_from(candidates.join(matches, true()))
+    ).all()
+
+    found: Dict[int, List[str]] = {}
+    for position, front in rows:
+        found.setdefault(int(position) - 1, []).append(front)
+    return found
+
+
+def deduplicate_cards(db: Session, user_id: Any, cards: Sequence[GeneratedCard]) -> List[GeneratedCard]:
+    """
+    Quita las tarjetas repetidas dentro del lote y las que ya tiene el usuario:
+    el índice de texto completo propone candidatas y la similitud de shingles decide.
+    """
+    threshold = settings.flashcard_duplicate_threshold
+    unique = NearDuplicateFilter(threshold)
+    cards = [card for card in cards if unique.add(card.front)]
+
+    matches = _existing_matches(db, user_id, [card.front for card in cards])
+    existing: Dict[str, FrozenSet[int]] = {}
+    kept = []
+    for i, card in enumerate(cards):
+        shingles = shingle_hashes(card.front)
+        for other in matches.get(i, ()):
+            if other not in existing:
+                existing[other] = shingle_hashes(other)
+            if jaccard(shingles, existing[other]) >= threshold:
+                break
+        else:
+            kept.append(card)
+    return kept
+
+
+def source_material(document: DocumentModel, chunk: ChunkText) -> str:
+    name = document.filename or document.path
+    if chunk.page_start is None:
+        return name
+    if chunk.page_end is None or chunk.page_end == chunk.page_start:
+        return f"{name} (p. {chunk.page_start})"
+    return f"{name} (pp. {chunk.page_start}-{chunk.page_end})"
+
+
+def insert_cards(
+    db: Session,
+    user_id: Any,
+    subject_id: Any,
+    document: DocumentModel,
+    cards: Sequence[GeneratedCard],
+) -> int:
+    """INSERT masivo de las tarjetas (executemany), en la transacción de `db`. No hace commit."""
+    if not cards:
+        return 0
+    now = datetime.utcnow()
+    today = now.date()
+    db.execute(insert(FlashcardModel), [
+        {
+            "user_id": user_id,
+            "subject_id": subject_id,
+            "front_content": card.front,
+            "back_content": card.back,
+            "card_type": "basic",
+            "tags": [],
+            "source_task_id": document.task_id,
+            "source_material": source_material(document, card.chunk),
+            "next_review_date": today,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for card in cards
+    ])
+    return len(cards)
@@ -0,0 +1,441 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import insert, or_, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from ..models import Document as DocumentModel, DocumentChunk as DocumentChunkModel, Task as TaskModel
+from ..settings import settings
+from .storage_backends import StorageBackend, get_storage_backend
+
+# Tamaño de "página" para formatos sin paginación (DOCX/TXT)
+PSEUDO_PAGE_CHARS = 3000
+INSERT_BATCH_SIZE = 200
+
+
+@dataclass
+class TextChunk:
+    index: int
+    page_start: int
+    page_end: int
+    content: str
+    content_hash: str
+    overlap_chars: int
+
+
+def detect_kind(filename: str, mime_type: Optional[str] = None) -> str:
+    """Tipo de documento: pdf | docx | txt"""
+    name = (filename or "").lower()
+    mime = (mime_type or "").lower()
+    if name.endswith(".pdf") or mime == "application/pdf":
+        return "pdf"
+    if name.endswith(".docx") or "wordprocessingml" in mime:
+        return "docx"
+    if name.endswith((".txt", ".md", ".csv")) or mime.startswith("text/"):
+        return "txt"
+    raise ValueError(f"Unsupported document type: {filename or mime_type}")
+
+
+# =====================================================
+# EXTRACCIÓN DE TEXTO (página a página)
+# =====================================================
+
+def _extract_pdf_range(file_path: str, start: int, end: int) -> List[str]:
+    # Se ejecuta en procesos hijos: cada uno abre su propio lector
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _shared_pdf_pool(workers: int) -> ProcessPoolExecutor:
+    """Pool de extracción del proceso, creado una vez (no un pool por archivo)"""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=workers)
+        return _pdf_pool
+
+
+def _pdf_pages(file_path: str, workers: int) -> Iterator[Tuple[int, str]]:
+    from pypdf import PdfReader
+
+    page_count = len(PdfReader(file_path).pages)
+    if workers <= 1 or page_count < settings.ingest_parallel_min_pages:
+        for number, text in enumerate(_extract_pdf_range(file_path, 0, page_count), start=1):
+            yield number, text
+        return
+
+    # Rangos pequeños para repartir bien la carga y poder emitir en orden sin esperar al final
+    step = max(1, min(16, page_count // (workers * 4) or 1))
+    starts = list(range(0, page_count, step))
+    results = _shared_pdf_pool(workers).map(
+        _extract_pdf_range,
+        [file_path] * len(starts),
+        starts,
+        [min(s + step, page_count) for s in starts],
+    )
+    number = 1
+    for texts in results:
+        for text in texts:
+            yield number, text
+            number += 1
+
+
+def _has_page_break(paragraph) -> bool:
+    xml = paragraph._p.xml
+    return 'w:type="page"' in xml or "lastRenderedPageBreak" in xml
+
+
+def _docx_pages(file_path: str) -> Iterator[Tuple[int, str]]:
+    from docx import Document as DocxDocument
+
+    number = 1
+    buffer: List[str] = []
+    size = 0
+    for paragraph in DocxDocument(file_path).paragraphs:
+        if buffer and (_has_page_break(paragraph) or size >= PSEUDO_PAGE_CHARS):
+            yield number, "\n".join(buffer)
+            number += 1
+            buffer, size = [], 0
+        if paragraph.text:
+            buffer.append(paragraph.text)
+            size += len(paragraph.text)
+    if buffer:
+        yield number, "\n".join(buffer)
+
+
+def _txt_pages(file_path: str) -> Iterator[Tuple[int, str]]:
+    number = 1
+    buffer: List[str] = []
+    size = 0
+    with open(file_path, "r", encoding="utf-8", errors="replace") as fh:
+        for line in fh:
+            buffer.append(line)
+            size += len(line)
+            if size >= PSEUDO_PAGE_CHARS:
+                yield number, "".join(buffer)
+                number += 1
+                buffer, size = [], 0
+    if buffer:
+        yield number, "".join(buffer)
+
+
+def extract_pages(file_path: str, kind: str, workers: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """Genera (número de página, texto) a medida que se extraen"""
+    if kind == "pdf":
+        return _pdf_pages(file_path, workers or settings.ingest_workers)
+    if kind == "docx":
+        return _docx_pages(file_path)
+    return _txt_pages(file_path)
+
+
+# =====================================================
+# CHUNKING CON SOLAPAMIENTO
+# =====================================================
+
+def _page_at(offsets: List[Tuple[int, int]], pos: int) -> int:
+    page = offsets[0][1]
+    for start, number in offsets:
+        if start > pos:
+            break
+        page = number
+    return page
+
+
+def _shift_offsets(offsets: List[Tuple[int, int]], start: int) -> List[Tuple[int, int]]:
+    kept = [(pos - start, number) for pos, number in offsets if pos >= start]
+    before = [number for pos, number in offsets if pos < start]
+    if before and (not kept or kept[0][0] > 0):
+        kept.insert(0, (0, before[-1]))
+    return kept
+
+
+def chunk_pages(
+    pages: Iterable[Tuple[int, str]],
+    chunk_size: int,
+    overlap: int,
+) -> Iterator[TextChunk]:
+    """
+    Trocea el texto en ventanas de ~chunk_size caracteres con `overlap` de solapamiento,
+    cortando en espacios y conservando el rango de páginas de cada chunk.
+    """
+    chunk_size = max(chunk_size, 2)
+    # El corte cae como pronto en chunk_size // 2: con más solapamiento el inicio no avanzaría
+    overlap = min(max(overlap, 0), chunk_size // 2 - 1)
+    buffer = ""
+    offsets: List[Tuple[int, int]] = []
+    index = 0
+    overlap_chars = 0
+
+    def make(end: int) -> TextChunk:
+        content = buffer[:end].strip()
+        return TextChunk(
+            index=index,
+            page_start=_page_at(offsets, 0),
+            page_end=_page_at(offsets, max(end - 1, 0)),
+            content=content,
+            content_hash=hashlib.sha256(content.encode("utf-8")).hexdigest(),
+            overlap_chars=overlap_chars,
+        )
+
+    for number, text in pages:
+        text = re.sub(r"\s+", " ", text).strip()
+        if not text:
+            continue
+        if buffer:
+            buffer += " "
+        offsets.append((len(buffer), number))
+        buffer += text
+
+        while len(buffer) > chunk_size:
+            end = buffer.rfind(" ", chunk_size // 2, chunk_size)
+            if end <= 0:
+                end = chunk_size
+            yield make(end)
+            index += 1
+
+            start = max(end - overlap, 0)
+            space = buffer.find(" ", start, end)
+            if space != -1:
+                start = space + 1
+            overlap_chars = max(end - start, 0)
+            buffer = buffer[start:]
+            offsets = _shift_offsets(offsets, start)
+
+    if buffer.strip() and (index == 0 or len(buffer) > overlap_chars):
+        yield make(len(buffer))
+
+
+# =====================================================
+# DEDUPLICACIÓN POR CONTENIDO
+# =====================================================
+
+class _HashingWriter:
+    """Envuelve el destino de la descarga y calcula el sha256 al vuelo"""
+
+    def __init__(self, dest: BinaryIO):
+        self._dest = dest
+        self._digest = hashlib.sha256()
+
+    def write(self, block: bytes) -> int:
+        self._digest.update(block)
+        return self._dest.write(block)
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+
+def ingested_document_query(content_sha256: str, user_id: Any = None) -> Select:
+    """Documento ya ingerido con el mismo contenido (del usuario si se indica); usa idx_documents_content_hash"""
+    query = select(DocumentModel).where(
+        DocumentModel.content_sha256 == content_sha256,
+        DocumentModel.status == "ready",
+    )
+    if user_id is not None:
+        query = query.where(DocumentModel.user_id == user_id)
+    return query.order_by(DocumentModel.created_at).limit(1)
+
+
+def _copy_chunks(db: Session, source: DocumentModel, document: DocumentModel) -> int:
+    """Copia los chunks de `source` al documento nuevo sin volver a extraer el texto"""
+    rows = (
+        db.query(
+            DocumentChunkModel.chunk_index,
+            DocumentChunkModel.page_start,
+            DocumentChunkModel.page_end,
+            DocumentChunkModel.content,
+            DocumentChunkModel.content_hash,
+            DocumentChunkModel.overlap_chars,
+        )
+        .filter(DocumentChunkModel.document_id == source.id)
+        .order_by(DocumentChunkModel.chunk_index)
+        .yield_per(INSERT_BATCH_SIZE)
+    )
+    copied = 0
+    batch: List[Dict[str, Any]] = []
+    for row in rows:
+        batch.append({"document_id": document.id, "user_id": document.user_id, **row._asdict()})
+        if len(batch) >= INSERT_BATCH_SIZE:
+            db.execute(insert(DocumentChunkModel), batch)
+            copied += len(batch)
+            batch = []
+    if batch:
+        db.execute(insert(DocumentChunkModel), batch)
+        copied += len(batch)
+    return copied
+
+
+def attachment_ref(document: DocumentModel) -> Dict[str, Any]:
+    return {
+        "document_id": str(document.id),
+        "bucket": document.bucket,
+        "path": document.path,
+        "filename": document.filename,
+        "sha256": document.content_sha256,
+    }
+
+
+def attachment_document_ids(attachments: Any) -> List[uuid.UUID]:
+    ids = []
+    for attachment in attachments or []:
+        try:
+            ids.append(uuid.UUID(str(attachment["document_id"])))
+        except (TypeError, KeyError, ValueError):
+            # Adjuntos antiguos (URLs) u otras formas
+            continue
+    return ids
+
+
+def add_task_attachment(task: TaskModel, document: DocumentModel) -> bool:
+    """Añade la referencia al documento en task.attachments (una vez por documento)"""
+    attachments = [a for a in (task.attachments or []) if isinstance(a, dict)]
+    if any(a.get("document_id") == str(document.id) for a in attachments):
+        return False
+    # Lista nueva: JSONB no detecta cambios hechos en el sitio
+    task.attachments = [*attachments, attachment_ref(document)]
+    return True
+
+
+# =====================================================
+# PIPELINE
+# =====================================================
+
+def ingest_document(
+    db: Session,
+    document: DocumentModel,
+    storage: Optional[StorageBackend] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> DocumentModel:
+    """
+    Descarga el archivo, extrae el texto página a página, lo trocea y guarda los chunks.
+    Si ya hay un documento listo con el mismo sha256, copia sus chunks en lugar de extraer.
+    `progress(pages, chunks)` se llama después de cada lote insertado.
+    """
+    storage = storage or get_storage_backend()
+    kind = detect_kind(document.filename or document.path, document.mime_type)
+
+    suffix = os.path.splitext(document.filename or document.path)[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+        # El hash se calcula sobre los bytes descargados: solo reutiliza quien tiene el archivo
+        writer = _HashingWriter(tmp)
+        size = storage.download_to(document.bucket, document.path, writer)
+        tmp.flush()
+        document.content_sha256 = writer.hexdigest()
+
+        # Reingesta idempotente
+        db.query(DocumentChunkModel).filter(DocumentChunkModel.document_id == document.id).delete()
+
+        source = db.scalars(
+            ingested_document_query(document.content_sha256).where(DocumentModel.id != document.id)
+        ).first()
+        if source is not None:
+            return _finish(db, document, size, source.page_count or 0, _copy_chunks(db, source, document), progress)
+
+        pages_seen = 0
+
+        def counted_pages() -> Iterator[Tuple[int, str]]:
+            nonlocal pages_seen
+            for number, text in extract_pages(tmp.name, kind):
+                pages_seen = number
+                yield number, text
+
+        batch: List[DocumentChunkModel] = []
+        chunk_count = 0
+        for chunk in chunk_pages(counted_pages(), settings.ingest_chunk_size, settings.ingest_chunk_overlap):
+            batch.append(DocumentChunkModel(
+                document_id=document.id,
+                user_id=document.user_id,
+                chunk_index=chunk.index,
+                page_start=chunk.page_start,
+                page_end=chunk.page_end,
+                content=chunk.content,
+                content_hash=chunk.content_hash,
+                overlap_chars=chunk.overlap_chars,
+            ))
+            if len(batch) >= INSERT_BATCH_SIZE:
+                db.add_all(batch)
+                db.flush()
+                chunk_count += len(batch)
+                batch = []
+                if progress:
+                    progress(pages_seen, chunk_count)
+
+        if batch:
+            db.add_all(batch)
+            chunk_count += len(batch)
+
+    return _finish(db, document, size, pages_seen, chunk_count, progress)
+
+
+def _finish(
+    db: Session,
+    document: DocumentModel,
+    size: int,
+    page_count: int,
+    chunk_count: int,
+    progress: Optional[Callable[[int, int], None]],
+) -> DocumentModel:
+    document.size_bytes = size
+    document.page_count = page_count
+    document.chunk_count = chunk_count
+    document.status = "ready"
+    document.error = None
+    document.updated_at = datetime.utcnow()
+    db.flush()
+    if progress:
+        progress(page_count, chunk_count)
+    return document
+
+
+def task_document_text(db: Session, task_id, max_chars: int) -> str:
+    """
+    Texto de los documentos de una tarea (propios o referenciados en attachments), sin los solapamientos.
+    Solo documentos del dueño de la tarea: attachments puede traer ids de documentos ajenos.
+    """
+    task = db.query(TaskModel.user_id, TaskModel.attachments).filter(TaskModel.id == task_id).first()
+    if task is None:
+        return ""
+    document_ids = attachment_document_ids(task.attachments or [])
+    belongs = DocumentModel.task_id == task_id
+    if document_ids:
+        belongs = or_(belongs, DocumentModel.id.in_(document_ids))
+
+    rows = (
+        db.query(DocumentChunkModel.content, DocumentChunkModel.overlap_chars, DocumentChunkModel.document_id)
+        .join(DocumentModel, DocumentModel.id == DocumentChunkModel.document_id)
+        .filter(belongs, DocumentModel.user_id == task.user_id, DocumentModel.status == "ready")
+        .order_by(DocumentModel.created_at, DocumentModel.id, DocumentChunkModel.chunk_index)
+        .yield_per(100)
+    )
+
+    parts: List[str] = []
+    size = 0
+    current_document = None
+    for content, overlap_chars, document_id in rows:
+        if document_id != current_document:
+            current_document = document_id
+            text = content
+        else:
+            text = content[overlap_chars or 0:].lstrip()
+        parts.append(text)
+        size += len(text) + 1
+        if size >= max_chars:
+            break
+
+    return " ".join(parts)[:max_chars]
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import anyio
+import httpx
+
+from ..settings import settings
+from .llm_router import LLMResult, LLMRouter, backends_from_settings
+
+
+class LLMClient:
+    """
+    Cliente LLM asíncrono compartido por proceso.
+
+    - Un único pool HTTP keep-alive (httpx) para todas las completions.
+    - Semáforo que limita las completions en vuelo.
+    - Timeout total por llamada, además de los timeouts de conexión/lectura.
+    - Router entre backends (modelo principal, respaldos, servidor local): ver llm_router.py.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        max_concurrency: int,
+        timeout: float,
+        connect_timeout: float,
+        max_connections: int,
+        max_keepalive_connections: int,
+        keepalive_expiry: float,
+    ):
+        # Modelo principal: identifica las respuestas en la caché aunque conteste un respaldo
+        self.model = model
+        self.timeout = timeout
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            follow_redirects=True,
+        )
+        self.router = LLMRouter.from_settings(backends_from_settings(self.http))
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @classmethod
+    def from_settings(cls) -> "LLMClient":
+        return cls(
+            model=settings.groq_model,
+            max_concurrency=settings.llm_max_concurrency,
+            timeout=settings.llm_timeout_seconds,
+            connect_timeout=settings.llm_connect_timeout_seconds,
+            max_connections=settings.llm_max_connections,
+            max_keepalive_connections=settings.llm_max_keepalive_connections,
+            keepalive_expiry=settings.llm_keepalive_expiry_seconds,
+        )
+
+    async def complete(
+        self,
+        messages: List[Dict[str, Any]],
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        timeout: Optional[float] = None,
+        model: Optional[str] = None,
+        **params: Any,
+    ) -> LLMResult:
+        """
+        Ejecuta una completion sin bloquear el event loop. `model` limita el router
+        a los backends de ese modelo; el modelo que respondió va en LLMResult.model.
+        """
+        timeout = timeout or self.timeout
+        if max_tokens is not None:
+            params["max_tokens"] = max_tokens
+
+        async with self._semaphore:
+            return await self.router.complete(messages, temperature, timeout, params, model=model)
+
+    def stream(
+        self,
+        messages: List[Dict[str, Any]],
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        timeout: Optional[float] = None,
+        model: Optional[str] = None,
+        **params: Any,
+    ) -> "LLMStream":
+        """Completion en streaming: iterar el resultado produce los tokens según llegan."""
+        if max_tokens is not None:
+            params["max_tokens"] = max_tokens
+        params.update(messages=messages, temperature=temperature)
+        return LLMStream(self, model, timeout or self.timeout, params)
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
+
+
+class LLMStream:
+    """
+    Iterador asíncrono de deltas de texto.
+
+    Al terminar expone `content`, `tokens_used` y `finish_reason`. Si el consumidor
+    deja de iterar (p. ej. el cliente HTTP se desconecta), la respuesta upstream se
+    cierra y la petición al proveedor se cancela.
+    """
+
+    def __init__(self, client: LLMClient, model: Optional[str], timeout: float, params: Dict[str, Any]):
+        self._client = client
+        self._timeout = timeout
+        self._params = params
+        self._parts: List[str] = []
+        self._requested_model = model
+        # Al abrirse pasa a ser el modelo del backend que responde
+        self.model = model or client.model
+        self.tokens_used: int | None = None
+        self.finish_reason: str | None = None
+
+    @property
+    def content(self) -> str:
+        return "".join(self._parts)
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        async with self._client._semaphore:
+            backend, chunks = await self._client.router.open_stream(
+                self._params, self._timeout, model=self._requested_model
+            )
+            self.model = backend.model
+            try:
+                async for chunk in chunks:
+                    if chunk.tokens_used is not None:
+                        self.tokens_used = chunk.tokens_used
+                    if chunk.finish_reason:
+                        self.finish_reason = chunk.finish_reason
+                    if chunk.delta:
+                        self._parts.append(chunk.delta)
+                        yield chunk.delta
+            finally:
+                with anyio.CancelScope(shield=True):
+                    await chunks.aclose()
+
+
+_client: LLMClient | None = None
+_client_loop: asyncio.AbstractEventLoop | None = None
+
+
+def get_llm_client() -> LLMClient:
+    """Devuelve el cliente del proceso (debe llamarse dentro del event loop)."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    # El pool httpx y el semáforo quedan ligados al loop donde se crearon.
+    if _client is None or _client_loop is not loop:
+        _client = LLMClient.from_settings()
+        _client_loop = loop
+    return _client
+
+
+async def close_llm_client() -> None:
+    global _client, _client_loop
+    if _client is not None and _client_loop is asyncio.get_running_loop():
+        await _client.aclose()
+    _client = None
+    _client_loop = None
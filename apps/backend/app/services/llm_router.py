@@ -0,0 +1,505 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Sequence, Tuple
+
+import anyio
+import httpx
+from groq import AsyncGroq
+
+from ..settings import settings
+
+
+@dataclass
+class LLMResult:
+    content: str
+    tokens_used: int | None
+    model: str
+    finish_reason: str | None = None
+
+
+@dataclass
+class StreamChunk:
+    delta: str | None
+    finish_reason: str | None = None
+    tokens_used: int | None = None
+
+
+class LLMUnavailableError(RuntimeError):
+    """Ningún backend disponible (circuitos abiertos o sin configurar)"""
+
+
+# Errores de la petición (no del backend): no abren el circuito ni pasan al siguiente backend.
+# 400 incluye json_validate_failed, que structured_output aprovecha con failed_generation.
+REQUEST_ERROR_STATUSES = {400, 413, 422}
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    code = getattr(error, "status_code", None)
+    if code is None and isinstance(error, httpx.HTTPStatusError):
+        code = error.response.status_code
+    return code
+
+
+def is_request_error(error: Exception) -> bool:
+    return _status_code(error) in REQUEST_ERROR_STATUSES
+
+
+# =====================================================
+# BACKENDS
+# =====================================================
+
+class LLMBackend:
+    """Un modelo en un proveedor"""
+
+    name: str
+    model: str
+
+    async def complete(
+        self,
+        messages: List[Dict[str, Any]],
+        temperature: float,
+        timeout: float,
+        params: Dict[str, Any],
+    ) -> LLMResult:
+        raise NotImplementedError
+
+    def stream(self, params: Dict[str, Any], timeout: float) -> AsyncIterator[StreamChunk]:
+        raise NotImplementedError
+
+
+class GroqBackend(LLMBackend):
+    def __init__(self, groq: AsyncGroq, model: str):
+        self.groq = groq
+        self.model = model
+        self.name = f"groq:{model}"
+
+    async def complete(self, messages, temperature, timeout, params) -> LLMResult:
+        completion = await asyncio.wait_for(
+            self.groq.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                timeout=timeout,
+                **params,
+            ),
+            timeout=timeout,
+        )
+        choice = completion.choices[0] if completion.choices else None
+        return LLMResult(
+            content=(choice.message.content if choice else None) or "",
+            tokens_used=completion.usage.total_tokens if completion.usage else None,
+            model=completion.model or self.model,
+            finish_reason=choice.finish_reason if choice else None,
+        )
+
+    async def stream(self, params, timeout) -> AsyncIterator[StreamChunk]:
+        # El timeout total cubre hasta recibir la cabecera; entre chunks manda el read timeout.
+        stream = await asyncio.wait_for(
+            self.groq.chat.completions.create(model=self.model, stream=True, timeout=timeout, **params),
+            timeout=timeout,
+        )
+        try:
+            async for chunk in stream:
+                usage = chunk.usage or (chunk.x_groq.usage if chunk.x_groq else None)
+                choice = chunk.choices[0] if chunk.choices else None
+                yield StreamChunk(
+                    delta=choice.delta.content if choice else None,
+                    finish_reason=choice.finish_reason if choice else None,
+                    tokens_used=usage.total_tokens if usage is not None else None,
+                )
+        finally:
+            with anyio.CancelScope(shield=True):
+                await stream.close()
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """Servidor con la API /chat/completions de OpenAI (Ollama, vLLM, llama.cpp, LM Studio)"""
+
+    def __init__(self, http: httpx.AsyncClient, base_url: str, model: str, api_key: str = "", name: str = "local"):
+        self.http = http
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.model = model
+        self.name = f"{name}:{model}"
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+    async def complete(self, messages, temperature, timeout, params) -> LLMResult:
+        response = await asyncio.wait_for(
+            self.http.post(
+                self.url,
+                json={"model": self.model, "messages": messages, "temperature": temperature, **params},
+                headers=self.headers,
+                timeout=timeout,
+            ),
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        data = response.json()
+        choice = (data.get("choices") or [None])[0] or {}
+        return LLMResult(
+            content=(choice.get("message") or {}).get("content") or "",
+            tokens_used=(data.get("usage") or {}).get("total_tokens"),
+            model=data.get("model") or self.model,
+            finish_reason=choice.get("finish_reason"),
+        )
+
+    async def stream(self, params, timeout) -> AsyncIterator[StreamChunk]:
+        async with self.http.stream(
+            "POST",
+            self.url,
+            # include_usage: el último chunk trae los tokens consumidos
+            json={"model": self.model, "stream": True, "stream_options": {"include_usage": True}, **params},
+            headers=self.headers,
+            timeout=timeout,
+        ) as response:
+            response.raise_for_status()
+            # Server-Sent Events: líneas "data: {...}" terminadas en "data: [DONE]"
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                choice = (chunk.get("choices") or [None])[0] or {}
+                yield StreamChunk(
+                    delta=(choice.get("delta") or {}).get("content"),
+                    finish_reason=choice.get("finish_reason"),
+                    tokens_used=(chunk.get("usage") or {}).get("total_tokens"),
+                )
+
+
+# =====================================================
+# SALUD POR BACKEND
+# =====================================================
+
+class BackendHealth:
+    """
+    EWMA de latencia y de tasa de error, ventana de latencias para el p95 y circuit breaker:
+    tras `failure_threshold` fallos seguidos el circuito se abre; pasado `cooldown` se deja
+    pasar una petición de prueba (half-open) que lo cierra o lo vuelve a abrir.
+    """
+
+    def __init__(self, alpha: float, window: int, failure_threshold: int, cooldown: float):
+        self.alpha = alpha
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.latency_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.latencies: Deque[float] = deque(maxlen=max(1, window))
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+
+    def available(self, now: float) -> bool:
+        return self.state == "closed" or now - self.opened_at >= self.cooldown
+
+    def begin(self, now: float) -> bool:
+        """Reserva el intento. Con el circuito abierto solo pasa una prueba por cooldown."""
+        if self.state == "closed":
+            return True
+        if now - self.opened_at < self.cooldown:
+            return False
+        # Open, o half-open con la prueba anterior sin respuesta tras un cooldown
+        self.state = "half_open"
+        self.opened_at = now
+        return True
+
+    def record_latency(self, latency: float) -> None:
+        self.latencies.append(latency)
+        self.latency_ewma = latency if self.latency_ewma is None else (
+            self.alpha * latency + (1 - self.alpha) * self.latency_ewma
+        )
+
+    def record_success(self, latency: Optional[float]) -> None:
+        if latency is not None:
+            self.record_latency(latency)
+        self.error_ewma *= 1 - self.alpha
+        self.consecutive_failures = 0
+        self.state = "closed"
+
+    def record_failure(self) -> None:
+        self.error_ewma = self.alpha + (1 - self.alpha) * self.error_ewma
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def expected_latency(self) -> float:
+        """Tiempo esperado hasta una respuesta válida, contando reintentos por errores"""
+        return (self.latency_ewma or 0.0) / max(1e-3, 1 - self.error_ewma)
+
+
+# =====================================================
+# ROUTER
+# =====================================================
+
+class LLMRouter:
+    """
+    Reparte las completions entre backends (modelo principal, modelos de respaldo, servidor local).
+
+    - Orden: los sanos en el orden configurado (el principal primero); detrás los degradados
+      (tasa de error o latencia EWMA por encima del umbral), del más rápido al más lento.
+      Los que tienen el circuito abierto no reciben tráfico hasta su prueba.
+    - Si un backend falla se pasa al siguiente. Los errores de la propia petición (400) no.
+    - Hedging: si el primero no responde en su p95, se lanza la misma petición en el siguiente
+      backend (o en el mismo si no hay otro) y gana la primera respuesta. Un presupuesto de
+      hedges (fracción de las peticiones) evita duplicar la carga cuando todo va lento.
+    """
+
+    def __init__(
+        self,
+        backends: Sequence[LLMBackend],
+        ewma_alpha: float,
+        latency_window: int,
+        failure_threshold: int,
+        cooldown: float,
+        degraded_error_rate: float,
+        degraded_latency: float,
+        hedge_enabled: bool,
+        hedge_quantile: float,
+        hedge_min_samples: int,
+        hedge_min_delay: float,
+        hedge_budget: float,
+    ):
+        self.backends = list(backends)
+        self.health: Dict[str, BackendHealth] = {
+            b.name: BackendHealth(ewma_alpha, latency_window, failure_threshold, cooldown) for b in self.backends
+        }
+        self.degraded_error_rate = degraded_error_rate
+        self.degraded_latency = degraded_latency
+        self.hedge_enabled = hedge_enabled
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_budget = hedge_budget
+        # Cubo de tokens: cada petición suma hedge_budget, cada hedge gasta 1
+        self._hedge_tokens = 1.0
+        self._metrics = {"requests": 0, "fallbacks": 0, "hedges": 0, "hedge_wins": 0, "unavailable": 0}
+
+    @classmethod
+    def from_settings(cls, backends: Sequence[LLMBackend]) -> "LLMRouter":
+        return cls(
+            backends,
+            ewma_alpha=settings.llm_ewma_alpha,
+            latency_window=settings.llm_latency_window,
+            failure_threshold=settings.llm_circuit_failure_threshold,
+            cooldown=settings.llm_circuit_cooldown_seconds,
+            degraded_error_rate=settings.llm_degraded_error_rate,
+            degraded_latency=settings.llm_degraded_latency_seconds,
+            hedge_enabled=settings.llm_hedge_enabled,
+            hedge_quantile=settings.llm_hedge_quantile,
+            hedge_min_samples=settings.llm_hedge_min_samples,
+            hedge_min_delay=settings.llm_hedge_min_delay_seconds,
+            hedge_budget=settings.llm_hedge_budget,
+        )
+
+    def _degraded(self, health: BackendHealth) -> bool:
+        if health.error_ewma >= self.degraded_error_rate:
+            return True
+        return self.degraded_latency > 0 and (health.latency_ewma or 0.0) >= self.degraded_latency
+
+    def ranked(self, model: Optional[str] = None) -> List[LLMBackend]:
+        """Backends en el orden en que se intentarán (sin los de circuito abierto)"""
+        now = time.monotonic()
+        backends = [b for b in self.backends if model is None or b.model == model]
+        available = [b for b in backends if self.health[b.name].available(now)]
+        healthy = [b for b in available if not self._degraded(self.health[b.name])]
+        degraded = sorted(
+            (b for b in available if self._degraded(self.health[b.name])),
+            key=lambda b: self.health[b.name].expected_latency(),
+        )
+        return healthy + degraded
+
+    def _candidates(self, model: Optional[str]) -> List[LLMBackend]:
+        self._metrics["requests"] += 1
+        self._hedge_tokens = min(10.0, self._hedge_tokens + self.hedge_budget)
+        if not self.backends:
+            raise LLMUnavailableError("No LLM backends configured")
+        candidates = self.ranked(model)
+        if not candidates:
+            self._metrics["unavailable"] += 1
+            raise LLMUnavailableError(
+                f"No LLM backend available for model {model}" if model
+                else "All LLM backends are unavailable (circuit open)"
+            )
+        return candidates
+
+    def _hedge_delay(self, backend: LLMBackend) -> Optional[float]:
+        health = self.health[backend.name]
+        if not self.hedge_enabled or health.state != "closed" or len(health.latencies) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, health.quantile(self.hedge_quantile) or 0.0)
+
+    async def _attempt(self, backend: LLMBackend, messages, temperature, timeout, params) -> LLMResult:
+        health = self.health[backend.name]
+        started = time.monotonic()
+        # Solo cuentan los intentos que terminan por sí mismos: un hedge perdido o una
+        # desconexión del cliente (CancelledError) no dicen nada de la latencia del backend
+        try:
+            result = await backend.complete(messages, temperature, timeout, params)
+        except Exception as e:
+            if is_request_error(e):
+                health.record_success(None)
+            else:
+                health.record_failure()
+            raise
+        health.record_success(time.monotonic() - started)
+        return result
+
+    async def complete(
+        self,
+        messages: List[Dict[str, Any]],
+        temperature: float,
+        timeout: float,
+        params: Dict[str, Any],
+        model: Optional[str] = None,
+    ) -> LLMResult:
+        candidates = self._candidates(model)
+        tried: set = set()
+        last_error: Optional[Exception] = None
+
+        for backend in candidates:
+            if backend.name in tried or not self.health[backend.name].begin(time.monotonic()):
+                continue
+            tried.add(backend.name)
+            if last_error is not None:
+                self._metrics["fallbacks"] += 1
+
+            tasks = [asyncio.ensure_future(self._attempt(backend, messages, temperature, timeout, params))]
+            try:
+                delay = self._hedge_delay(backend)
+                if delay is not None:
+                    done, _ = await asyncio.wait(tasks, timeout=delay)
+                    if not done and self._hedge_tokens >= 1:
+                        self._hedge_tokens -= 1
+                        self._metrics["hedges"] += 1
+                        hedge = next(
+                            (b for b in candidates if b.name not in tried and self.health[b.name].begin(time.monotonic())),
+                            backend,
+                        )
+                        tried.add(hedge.name)
+                        tasks.append(asyncio.ensure_future(self._attempt(hedge, messages, temperature, timeout, params)))
+
+                pending = set(tasks)
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        error = task.exception()
+                        if error is None:
+                            if task is not tasks[0]:
+                                self._metrics["hedge_wins"] += 1
+                            return task.result()
+                        if is_request_error(error):
+                            raise error
+                        last_error = error
+            finally:
+                for task in tasks:
+                    if not task.done():
+                        task.cancel()
+
+        raise last_error or LLMUnavailableError("All LLM backends are unavailable (circuit open)")
+
+    async def open_stream(
+        self,
+        params: Dict[str, Any],
+        timeout: float,
+        model: Optional[str] = None,
+    ) -> Tuple[LLMBackend, AsyncIterator[StreamChunk]]:
+        """
+        Abre el stream en el primer backend que responda. Sin hedging (duplicaría tokens);
+        se pasa al siguiente solo si falla antes del primer chunk.
+        """
+        last_error: Optional[Exception] = None
+        for backend in self._candidates(model):
+            health = self.health[backend.name]
+            if not health.begin(time.monotonic()):
+                continue
+            if last_error is not None:
+                self._metrics["fallbacks"] += 1
+            chunks = backend.stream(params, timeout)
+            started = time.monotonic()
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except Exception as e:
+                with anyio.CancelScope(shield=True):
+                    await chunks.aclose()
+                if is_request_error(e):
+                    health.record_success(None)
+                    raise
+                health.record_failure()
+                last_error = e
+                continue
+            return backend, self._tracked(health, chunks, first, started)
+
+        raise last_error or LLMUnavailableError("All LLM backends are unavailable (circuit open)")
+
+    async def _tracked(
+        self,
+        health: BackendHealth,
+        chunks: AsyncIterator[StreamChunk],
+        first: Optional[StreamChunk],
+        started: float,
+    ) -> AsyncIterator[StreamChunk]:
+        try:
+            if first is None:
+                health.record_success(time.monotonic() - started)
+                return
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        except Exception:
+            health.record_failure()
+            raise
+        else:
+            # La duración de un stream depende de quien lo consume: no entra en el p95
+            health.record_success(None)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await chunks.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._metrics,
+            "backends": [
+                {
+                    "name": b.name,
+                    "model": b.model,
+                    "state": self.health[b.name].state,
+                    "latency_ewma": self.health[b.name].latency_ewma,
+                    "latency_p95": self.health[b.name].quantile(self.hedge_quantile),
+                    "error_rate_ewma": self.health[b.name].error_ewma,
+                    "consecutive_failures": self.health[b.name].consecutive_failures,
+                    "samples": len(self.health[b.name].latencies),
+                }
+                for b in self.backends
+            ],
+        }
+
+
+def backends_from_settings(http: httpx.AsyncClient) -> List[LLMBackend]:
+    """Modelo principal de Groq, modelos de respaldo de Groq y servidor local, en ese orden"""
+    backends: List[LLMBackend] = []
+    if settings.groq_api_key:
+        # max_retries del SDK: reintenta el mismo backend antes de que el router pase al siguiente
+        groq = AsyncGroq(api_key=settings.groq_api_key, http_client=http, max_retries=settings.llm_max_retries)
+        models = [settings.groq_model] + [m.strip() for m in settings.llm_fallback_models.split(",")]
+        for model in dict.fromkeys(m for m in models if m):
+            backends.append(GroqBackend(groq, model))
+    if settings.llm_local_base_url and settings.llm_local_model:
+        backends.append(OpenAICompatibleBackend(
+            http, settings.llm_local_base_url, settings.llm_local_model, settings.llm_local_api_key
+        ))
+    return backends
@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import weakref
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import exists, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..database import AsyncSessionLocal
+from ..models import QuestionBankEntry, QuestionBankSeen, Quiz as QuizModel, Subject as SubjectModel
+from ..settings import settings
+from .ai_service import AIService
+from .similarity import MINHASH_PERMUTATIONS, minhash_signature, minhash_similarity, normalize_text
+
+# Cuántas preguntas ya vistas se envían al LLM como "no repetir"
+AVOID_LIMIT = 20
+
+
+def bank_key(subject_name: str, topic: str, difficulty: int) -> str:
+    """Clave del banco: mismas materia/tema/dificultad aunque cambien tildes, mayúsculas o puntuación"""
+    return f"{normalize_text(subject_name)}|{normalize_text(topic)}|{int(difficulty)}"
+
+
+def question_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def _question_text(question: Dict[str, Any]) -> Optional[str]:
+    text = question.get("question") if isinstance(question, dict) else None
+    return text if isinstance(text, str) and text.strip() else None
+
+
+def _served(entry_id: Any, question: Dict[str, Any]) -> Dict[str, Any]:
+    return {**question, "bank_id": str(entry_id)}
+
+
+@dataclass
+class QuizAssembly:
+    questions: List[Dict[str, Any]]
+    from_bank: int
+    generated: int
+
+
+# =====================================================
+# LECTURA Y ESCRITURA DEL BANCO (sesión síncrona: worker o run_sync)
+# =====================================================
+
+def pick_unseen(
+    db: Session,
+    user_id: Any,
+    key: str,
+    limit: int,
+    question_types: Optional[Sequence[str]] = None,
+) -> List[Tuple[Any, Dict[str, Any]]]:
+    """
+    Hasta `limit` preguntas del banco que el usuario no ha visto, las menos servidas primero,
+    sin casi duplicados entre ellas (MinHash).
+    """
+    if limit <= 0:
+        return []
+    query = (
+        select(QuestionBankEntry.id, QuestionBankEntry.question, QuestionBankEntry.minhash)
+        .where(
+            QuestionBankEntry.bank_key == key,
+            ~exists().where(
+                QuestionBankSeen.user_id == user_id,
+                QuestionBankSeen.question_id == QuestionBankEntry.id
+            )
+        )
+        .order_by(QuestionBankEntry.times_served, QuestionBankEntry.id)
+        .limit(limit * settings.question_bank_candidate_factor)
+    )
+    if question_types:
+        query = query.where(QuestionBankEntry.question_type.in_(question_types))
+
+    picked: List[Tuple[Any, Dict[str, Any]]] = []
+    signatures = np.empty((0, MINHASH_PERMUTATIONS), dtype=np.uint64)
+    for entry_id, question, minhash in db.execute(query).all():
+        signature = np.asarray(minhash, dtype=np.uint64)
+        if (minhash_similarity(signature, signatures) >= settings.question_bank_duplicate_threshold).any():
+            continue
+        picked.append((entry_id, question))
+        signatures = np.vstack([signatures, signature])
+        if len(picked) >= limit:
+            break
+    return picked
+
+
+def seen_questions(db: Session, user_id: Any, key: str, limit: int = AVOID_LIMIT) -> List[str]:
+    """Enunciados del banco que el usuario ya vio, los más recientes primero"""
+    rows = db.execute(
+        select(QuestionBankEntry.question)
+        .join(QuestionBankSeen, QuestionBankSeen.question_id == QuestionBankEntry.id)
+        .where(QuestionBankSeen.user_id == user_id, QuestionBankEntry.bank_key == key)
+        .order_by(QuestionBankSeen.seen_at.desc())
+        .limit(limit)
+    ).scalars().all()
+    return [text for text in map(_question_text, rows) if text]
+
+
+def add_to_bank(
+    db: Session,
+    subject_name: str,
+    topic: str,
+    difficulty: int,
+    questions: Sequence[Dict[str, Any]],
+    source: str = "generated",
+) -> List[Tuple[Any, Dict[str, Any]]]:
+    """
+    Guarda las preguntas que no se parecen a ninguna del banco (ni entre sí).
+    Devuelve (id, pregunta) de las guardadas. No hace commit.
+    """
+    key = bank_key(subject_name, topic, difficulty)
+    existing = db.execute(
+        select(QuestionBankEntry.minhash).where(QuestionBankEntry.bank_key == key)
+    ).scalars().all()
+    signatures = np.asarray(existing, dtype=np.uint64).reshape(-1, MINHASH_PERMUTATIONS)
+
+    now = datetime.utcnow()
+    values: List[Dict[str, Any]] = []
+    for question in questions:
+        text = _question_text(question)
+        if text is None:
+            continue
+        signature = minhash_signature(text)
+        if (minhash_similarity(signature, signatures) >= settings.question_bank_duplicate_threshold).any():
+            continue
+        signatures = np.vstack([signatures, signature])
+        question = {k: v for k, v in question.items() if k != "bank_id"}
+        values.append({
+            "bank_key": key,
+            "subject_name": subject_name,
+            "topic": topic,
+            "difficulty": int(difficulty),
+            "question_type": question.get("type"),
+            "question": question,
+            "question_hash": question_hash(text),
+            "minhash": [int(v) for v in signature],
+            "source": source,
+            "times_served": 0,
+            "created_at": now,
+        })
+    if not values:
+        return []
+
+    # Otra petición pudo guardar la misma pregunta a la vez: UNIQUE(bank_key, question_hash)
+    dialect_insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    stmt = (
+        dialect_insert(QuestionBankEntry.__table__)
+        .values(values)
+        .on_conflict_do_nothing()
+        .returning(QuestionBankEntry.id, QuestionBankEntry.question_hash)
+    )
+    inserted = {row.question_hash: row.id for row in db.execute(stmt)}
+    return [(inserted[v["question_hash"]], v["question"]) for v in values if v["question_hash"] in inserted]
+
+
+def mark_seen(db: Session, user_id: Any, entry_ids: Sequence[Any]) -> None:
+    """Registra las preguntas servidas al usuario y suma times_served. No hace commit."""
+    if not entry_ids:
+        return
+    now = datetime.utcnow()
+    dialect_insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    db.execute(
+        dialect_insert(QuestionBankSeen.__table__)
+        .values([{"user_id": user_id, "question_id": entry_id, "seen_at": now} for entry_id in entry_ids])
+        .on_conflict_do_nothing()
+    )
+    db.execute(
+        update(QuestionBankEntry)
+        .where(QuestionBankEntry.id.in_(entry_ids))
+        .values(times_served=QuestionBankEntry.times_served + 1)
+    )
+
+
+def bank_quiz_questions(db: Session, since: Optional[datetime] = None, batch_size: int = 500) -> int:
+    """
+    Añade al banco las preguntas de quizzes.questions (keyset sobre id).
+    El tema es el de cada pregunta si lo trae, si no el título del quiz. Devuelve cuántas se añadieron.
+    """
+    added = 0
+    last_id = None
+    while True:
+        query = (
+            select(QuizModel.id, QuizModel.title, QuizModel.questions, SubjectModel.name)
+            .join(SubjectModel, SubjectModel.id == QuizModel.subject_id)
+            .order_by(QuizModel.id)
+            .limit(batch_size)
+        )
+        if since is not None:
+            query = query.where(QuizModel.created_at >= since)
+        if last_id is not None:
+            query = query.where(QuizModel.id > last_id)
+        rows = db.execute(query).all()
+        if not rows:
+            break
+
+        groups: Dict[Tuple[str, str, int], List[Dict[str, Any]]] = {}
+        for _, title, questions, subject_name in rows:
+            for question in questions or []:
+                # Las que vienen del banco ya están en él
+                if not _question_text(question) or question.get("bank_id"):
+                    continue
+                topic = question.get("topic") or title
+                try:
+                    difficulty = int(question.get("difficulty") or 3)
+                except (TypeError, ValueError):
+                    difficulty = 3
+                groups.setdefault((subject_name, topic, difficulty), []).append(question)
+
+        for (subject_name, topic, difficulty), questions in groups.items():
+            added += len(add_to_bank(db, subject_name, topic, difficulty, questions, source="quiz"))
+        db.commit()
+
+        last_id = rows[-1][0]
+        if len(rows) < batch_size:
+            break
+    return added
+
+
+# =====================================================
+# ARMADO DE QUIZZES
+# =====================================================
+
+# Un solo generador por clave del banco en el proceso: los demás esperan y leen del banco
+_fill_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+async def assemble_quiz(
+    db: AsyncSession,
+    ai_service: AIService,
+    user_id: Any,
+    subject_name: str,
+    topic: str,
+    difficulty: int,
+    num_questions: int,
+    subtopics: Optional[List[str]] = None,
+    question_types: Optional[List[str]] = None,
+) -> QuizAssembly:
+    """
+    Preguntas para un quiz nuevo: primero del banco (no vistas por el usuario) y el resto del LLM.
+    Lo generado se guarda en el banco en su propia transacción, para que lo aprovechen
+    otros estudiantes aunque falle la petición. Las preguntas servidas quedan marcadas
+    como vistas en `db` (sin commit).
+    """
+    key = bank_key(subject_name, topic, difficulty)
+    picked = await db.run_sync(pick_unseen, user_id, key, num_questions, question_types)
+    generated = 0
+
+    if len(picked) < num_questions:
+        lock = _fill_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Otro estudiante pudo llenar el banco mientras esperábamos
+            picked = await db.run_sync(pick_unseen, user_id, key, num_questions, question_types)
+            missing = num_questions - len(picked)
+            if missing > 0:
+                avoid = [q["question"] for _, q in picked] + await db.run_sync(seen_questions, user_id, key)
+                questions = await ai_service.generate_quiz_questions(
+                    subject_name, topic, difficulty, missing,
+                    subtopics=subtopics, question_types=question_types, avoid=avoid
+                )
+                async with AsyncSessionLocal() as bank_db:
+                    added = await bank_db.run_sync(add_to_bank, subject_name, topic, difficulty, questions)
+                    await bank_db.commit()
+                generated = min(len(added), missing)
+                picked += added[:missing]
+
+    await db.run_sync(mark_seen, user_id, [entry_id for entry_id, _ in picked])
+    return QuizAssembly(
+        questions=[_served(entry_id, question) for entry_id, question in picked],
+        from_bank=len(picked) - generated,
+        generated=generated,
+    )
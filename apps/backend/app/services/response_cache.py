@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from ..settings import settings
+
+
+def _normalize(value: Any) -> Any:
+    """Normaliza las entradas del prompt para que cambios de espacios no cambien la clave."""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+class ResponseCache:
+    """
+    Caché de respuestas del LLM direccionada por contenido.
+
+    Nivel 1: LRU + TTL en memoria del proceso.
+    Nivel 2 (opcional): Redis, compartido entre workers.
+    Los valores se guardan serializados en JSON, así cada lectura devuelve una copia.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: int,
+        redis_url: str | None = None,
+        namespace: str = "uniai:ai-cache:",
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.redis_url = redis_url
+        self.namespace = namespace
+        self._entries: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._redis = None
+        self._redis_loop: asyncio.AbstractEventLoop | None = None
+        self._metrics: Dict[str, int] = {
+            "hits_memory": 0,
+            "hits_redis": 0,
+            "misses": 0,
+            "sets": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "redis_errors": 0,
+        }
+
+    @classmethod
+    def from_settings(cls) -> "ResponseCache":
+        return cls(
+            max_entries=settings.ai_cache_max_entries,
+            ttl_seconds=settings.ai_cache_ttl_seconds,
+            redis_url=settings.redis_url if settings.ai_cache_redis_enabled else None,
+        )
+
+    @staticmethod
+    def make_key(kind: str, model: str, inputs: Dict[str, Any], params: Dict[str, Any]) -> str:
+        payload = json.dumps(
+            {"kind": kind, "model": model, "inputs": _normalize(inputs), "params": params},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _redis_client(self):
+        if not self.redis_url:
+            return None
+        loop = asyncio.get_running_loop()
+        if self._redis is None or self._redis_loop is not loop:
+            from redis.asyncio import Redis
+
+            self._redis = Redis.from_url(self.redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+            self._redis_loop = loop
+        return self._redis
+
+    def _remember(self, key: str, raw: str) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, raw)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._metrics["evictions"] += 1
+
+    async def get(self, key: str) -> Optional[Any]:
+        if not settings.ai_cache_enabled:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, raw = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self._metrics["hits_memory"] += 1
+                return json.loads(raw)
+            del self._entries[key]
+            self._metrics["expirations"] += 1
+
+        redis = self._redis_client()
+        if redis is not None:
+            try:
+                raw = await redis.get(self.namespace + key)
+            except Exception as e:
+                print(f"AI cache redis error: {e}")
+                self._metrics["redis_errors"] += 1
+                raw = None
+            if raw is not None:
+                raw = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+                self._remember(key, raw)
+                self._metrics["hits_redis"] += 1
+                return json.loads(raw)
+
+        self._metrics["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Any) -> None:
+        if not settings.ai_cache_enabled:
+            return
+
+        raw = json.dumps(value, ensure_ascii=False)
+        self._remember(key, raw)
+        self._metrics["sets"] += 1
+
+        redis = self._redis_client()
+        if redis is not None:
+            try:
+                await redis.set(self.namespace + key, raw, ex=self.ttl_seconds)
+            except Exception as e:
+                print(f"AI cache redis error: {e}")
+                self._metrics["redis_errors"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self._metrics["hits_memory"] + self._metrics["hits_redis"]
+        lookups = hits + self._metrics["misses"]
+        return {
+            **self._metrics,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hit_rate": (hits / lookups) if lookups else 0.0,
+            "redis_enabled": bool(self.redis_url),
+        }
+
+
+response_cache = ResponseCache.from_settings()
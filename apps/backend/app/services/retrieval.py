@@ -0,0 +1,373 @@
+"""
+Índice de recuperación local por usuario (BM25 + vectores densos opcionales).
+
+El índice se construye en el worker y se guarda en archivos .npy que los procesos de
+la API abren con mmap, así todos los workers comparten las mismas páginas en memoria.
+
+Estructura en disco: <retrieval_index_dir>/<user_id>/<versión>/
+    term_hashes.npy  uint64 ordenado (hash de cada término del vocabulario)
+    term_ptr.npy     int64, posting list del término i = [term_ptr[i], term_ptr[i+1])
+    post_docs.npy    int32, documento de cada posting
+    post_weights.npy float32, peso BM25 precalculado (idf * tf saturado)
+    task_idx.npy     int32, índice en tasks.json o -1
+    dense.npy        float32 (N, dim) normalizado L2 (opcional)
+    text.bin / text_ptr.npy, meta.bin / meta_ptr.npy  textos y metadatos por entrada
+y un archivo CURRENT con el nombre de la versión activa.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..models import (
+    Document as DocumentModel,
+    DocumentChunk as DocumentChunkModel,
+    Flashcard as FlashcardModel,
+    Task as TaskModel,
+)
+from ..settings import settings
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_STOPWORDS = frozenset(
+    "de la que el en y a los del se las por un para con no una su al lo como mas pero sus le ya o "
+    "este si porque esta entre cuando muy sin sobre tambien me hasta hay donde quien desde todo nos "
+    "durante todos uno les ni contra otros ese eso ante ellos e esto mi antes algunos que unos yo otro "
+    "otras otra el tanto esa estos mucho quienes nada muchos cual poco ella estar estas algunas algo "
+    "nosotros the of and to in is it for on are as with be by this that".split()
+)
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclass
+class RetrievedPassage:
+    text: str
+    score: float
+    source: str
+    source_id: str
+    title: str
+    task_id: Optional[str] = None
+    page_start: Optional[int] = None
+    page_end: Optional[int] = None
+
+    def citation(self) -> str:
+        if self.page_start:
+            pages = f"pág. {self.page_start}" if self.page_start == self.page_end else f"págs. {self.page_start}-{self.page_end}"
+            return f"{self.title}, {pages}"
+        return self.title
+
+
+# =====================================================
+# TOKENIZACIÓN Y EMBEDDINGS POR HASHING
+# =====================================================
+
+def tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in _TOKEN_RE.findall(text) if len(t) > 1 and t not in _STOPWORDS]
+
+
+@lru_cache(maxsize=1 << 18)
+def _term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _hash_terms(terms: Iterable[str]) -> np.ndarray:
+    return np.fromiter((_term_hash(t) for t in terms), dtype=np.uint64)
+
+
+def embed(tokens: List[str], dim: int) -> np.ndarray:
+    """Embedding por feature hashing (unigramas + bigramas, signo por hash, tf sublineal)"""
+    vec = np.zeros(dim, dtype=np.float32)
+    if not tokens:
+        return vec
+    features = Counter(tokens)
+    features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    hashes = _hash_terms(features.keys())
+    weights = 1.0 + np.log(np.fromiter(features.values(), dtype=np.float32))
+    signs = np.where((hashes >> np.uint64(63)) == 1, -1.0, 1.0).astype(np.float32)
+    np.add.at(vec, (hashes % np.uint64(dim)).astype(np.int64), signs * weights)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+# =====================================================
+# CONSTRUCCIÓN
+# =====================================================
+
+def _user_dir(user_id: str) -> Path:
+    return Path(settings.retrieval_index_dir) / str(user_id)
+
+
+def _iter_entries(db: Session, user_id: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    chunks = (
+        db.query(DocumentChunkModel, DocumentModel.task_id, DocumentModel.filename)
+        .join(DocumentModel, DocumentModel.id == DocumentChunkModel.document_id)
+        .filter(DocumentChunkModel.user_id == user_id, DocumentModel.status == "ready")
+        .order_by(DocumentChunkModel.document_id, DocumentChunkModel.chunk_index)
+        .yield_per(500)
+    )
+    for chunk, task_id, filename in chunks:
+        yield chunk.content, {
+            "source": "document",
+            "source_id": str(chunk.document_id),
+            "title": filename or "Documento",
+            "task_id": str(task_id) if task_id else None,
+            "page_start": chunk.page_start,
+            "page_end": chunk.page_end,
+        }
+
+    tasks = db.query(TaskModel.id, TaskModel.title, TaskModel.description).filter(TaskModel.user_id == user_id)
+    for task_id, title, description in tasks.yield_per(500):
+        yield f"{title}. {description or ''}", {
+            "source": "task",
+            "source_id": str(task_id),
+            "title": f"Tarea: {title}",
+            "task_id": str(task_id),
+        }
+
+    flashcards = db.query(
+        FlashcardModel.id, FlashcardModel.front_content, FlashcardModel.back_content, FlashcardModel.source_task_id
+    ).filter(FlashcardModel.user_id == user_id)
+    for card_id, front, back, source_task_id in flashcards.yield_per(500):
+        yield f"{front}\n{back}", {
+            "source": "flashcard",
+            "source_id": str(card_id),
+            "title": "Flashcard",
+            "task_id": str(source_task_id) if source_task_id else None,
+        }
+
+
+def _write_blobs(directory: Path, name: str, blobs: List[bytes]) -> None:
+    ptr = np.zeros(len(blobs) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in blobs], out=ptr[1:])
+    with open(directory / f"{name}.bin", "wb") as fh:
+        for blob in blobs:
+            fh.write(blob)
+    np.save(directory / f"{name}_ptr.npy", ptr)
+
+
+def build_user_index(db: Session, user_id: str) -> int:
+    """Reconstruye el índice del usuario y lo publica de forma atómica. Devuelve el nº de entradas."""
+    dim = settings.retrieval_dense_dim if settings.retrieval_dense_enabled else 0
+
+    texts: List[bytes] = []
+    metas: List[bytes] = []
+    task_ids: Dict[str, int] = {}
+    task_idx: List[int] = []
+    doc_lens: List[int] = []
+    vectors: List[np.ndarray] = []
+    post_terms: List[np.ndarray] = []
+    post_docs: List[np.ndarray] = []
+    post_tfs: List[np.ndarray] = []
+
+    for doc_id, (text, meta) in enumerate(_iter_entries(db, user_id)):
+        tokens = tokenize(text)
+        counts = Counter(tokens)
+        post_terms.append(_hash_terms(counts.keys()))
+        post_tfs.append(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        post_docs.append(np.full(len(counts), doc_id, dtype=np.int32))
+        doc_lens.append(len(tokens))
+        if dim:
+            vectors.append(embed(tokens, dim))
+
+        task_id = meta.get("task_id")
+        task_idx.append(task_ids.setdefault(task_id, len(task_ids)) if task_id else -1)
+        texts.append(text.encode("utf-8"))
+        metas.append(json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+
+    n_docs = len(texts)
+    base = _user_dir(user_id)
+    base.mkdir(parents=True, exist_ok=True)
+    version = f"v{time.time_ns()}"
+    tmp = base / f".tmp-{version}"
+    tmp.mkdir()
+
+    terms = np.concatenate(post_terms) if post_terms else np.zeros(0, dtype=np.uint64)
+    docs = np.concatenate(post_docs) if post_docs else np.zeros(0, dtype=np.int32)
+    tfs = np.concatenate(post_tfs) if post_tfs else np.zeros(0, dtype=np.float32)
+
+    # Agrupar postings por término (CSR)
+    order = np.argsort(terms, kind="stable")
+    terms, docs, tfs = terms[order], docs[order], tfs[order]
+    term_hashes, term_start, doc_freq = np.unique(terms, return_index=True, return_counts=True)
+    term_ptr = np.append(term_start, len(terms)).astype(np.int64)
+
+    # Peso BM25 precalculado por posting
+    lens = np.asarray(doc_lens, dtype=np.float32)
+    avg_len = float(lens.mean()) if n_docs else 1.0
+    idf = np.log(1.0 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+    norm = BM25_K1 * (1.0 - BM25_B + BM25_B * lens[docs] / max(avg_len, 1.0)) if n_docs else np.zeros(0)
+    weights = (np.repeat(idf, doc_freq) * tfs * (BM25_K1 + 1.0) / (tfs + norm)).astype(np.float32)
+
+    np.save(tmp / "term_hashes.npy", term_hashes.astype(np.uint64))
+    np.save(tmp / "term_ptr.npy", term_ptr)
+    np.save(tmp / "post_docs.npy", docs.astype(np.int32))
+    np.save(tmp / "post_weights.npy", weights)
+    np.save(tmp / "task_idx.npy", np.asarray(task_idx, dtype=np.int32))
+    if dim:
+        dense = np.vstack(vectors) if vectors else np.zeros((0, dim), dtype=np.float32)
+        np.save(tmp / "dense.npy", dense.astype(np.float32))
+    _write_blobs(tmp, "text", texts)
+    _write_blobs(tmp, "meta", metas)
+    with open(tmp / "tasks.json", "w", encoding="utf-8") as fh:
+        json.dump(list(task_ids.keys()), fh)
+
+    # Publicar: renombrar la versión y apuntar CURRENT a ella (os.replace es atómico)
+    (tmp).rename(base / version)
+    with open(base / "CURRENT.tmp", "w") as fh:
+        fh.write(version)
+    os.replace(base / "CURRENT.tmp", base / "CURRENT")
+
+    # Conservar la versión anterior por si algún proceso la tiene abierta
+    versions = sorted(p for p in base.iterdir() if p.is_dir() and p.name.startswith("v"))
+    for old in versions[:-2]:
+        shutil.rmtree(old, ignore_errors=True)
+
+    return n_docs
+
+
+# =====================================================
+# CONSULTA
+# =====================================================
+
+class UserIndex:
+    def __init__(self, directory: Path):
+        def load(name: str) -> np.ndarray:
+            return np.load(directory / f"{name}.npy", mmap_mode="r")
+
+        self.term_hashes = load("term_hashes")
+        self.term_ptr = load("term_ptr")
+        self.post_docs = load("post_docs")
+        self.post_weights = load("post_weights")
+        self.task_idx = load("task_idx")
+        self.text_ptr = load("text_ptr")
+        self.meta_ptr = load("meta_ptr")
+        self.dense = load("dense") if (directory / "dense.npy").exists() else None
+        self.text = np.memmap(directory / "text.bin", dtype=np.uint8, mode="r") if self.text_ptr[-1] else None
+        self.meta = np.memmap(directory / "meta.bin", dtype=np.uint8, mode="r") if self.meta_ptr[-1] else None
+        with open(directory / "tasks.json", encoding="utf-8") as fh:
+            self.task_ids: Dict[str, int] = {task_id: i for i, task_id in enumerate(json.load(fh))}
+        self.size = len(self.task_idx)
+
+    def _blob(self, data: Optional[np.memmap], ptr: np.ndarray, i: int) -> str:
+        if data is None:
+            return ""
+        return data[ptr[i]:ptr[i + 1]].tobytes().decode("utf-8")
+
+    def bm25(self, query_tokens: List[str]) -> np.ndarray:
+        scores = np.zeros(self.size, dtype=np.float32)
+        if not len(self.term_hashes):
+            return scores
+        hashes = _hash_terms(set(query_tokens))
+        pos = np.searchsorted(self.term_hashes, hashes)
+        # Términos fuera del vocabulario: se quitan de los dos arrays para no desalinearlos
+        valid = pos < len(self.term_hashes)
+        pos, hashes = pos[valid], hashes[valid]
+        for p, h in zip(pos, hashes):
+            if self.term_hashes[p] != h:
+                continue
+            start, end = self.term_ptr[p], self.term_ptr[p + 1]
+            scores += np.bincount(
+                self.post_docs[start:end], weights=self.post_weights[start:end], minlength=self.size
+            ).astype(np.float32)
+        return scores
+
+    def search(self, query: str, k: int, task_id: Optional[str] = None) -> List[RetrievedPassage]:
+        if not self.size:
+            return []
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        scores = self.bm25(tokens)
+        top = float(scores.max())
+        if top > 0:
+            scores /= top
+        if self.dense is not None:
+            scores += settings.retrieval_dense_weight * (self.dense @ embed(tokens, self.dense.shape[1]))
+        if task_id is not None and task_id in self.task_ids:
+            scores[self.task_idx == self.task_ids[task_id]] *= settings.retrieval_task_boost
+
+        k = min(k, self.size)
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+
+        passages = []
+        for i in best:
+            if scores[i] <= 0:
+                break
+            meta = json.loads(self._blob(self.meta, self.meta_ptr, i))
+            passages.append(RetrievedPassage(
+                text=self._blob(self.text, self.text_ptr, i),
+                score=float(scores[i]),
+                **meta,
+            ))
+        return passages
+
+
+# LRU de índices abiertos por usuario (versión, índice). Al salir del LRU solo se suelta la
+# referencia: los mmaps se cierran cuando termina la última búsqueda que aún los usa.
+_indexes: "OrderedDict[str, Tuple[str, UserIndex]]" = OrderedDict()
+# search corre en el threadpool: varias búsquedas tocan el LRU a la vez
+_indexes_lock = threading.Lock()
+
+
+def load_user_index(user_id: str) -> Optional[UserIndex]:
+    base = _user_dir(user_id)
+    try:
+        version = (base / "CURRENT").read_text().strip()
+    except FileNotFoundError:
+        return None
+
+    key = str(user_id)
+    with _indexes_lock:
+        cached = _indexes.get(key)
+        if cached and cached[0] == version:
+            _indexes.move_to_end(key)
+            return cached[1]
+
+    index = UserIndex(base / version)
+    with _indexes_lock:
+        _indexes[key] = (version, index)
+        _indexes.move_to_end(key)
+        while len(_indexes) > max(1, settings.retrieval_index_cache_size):
+            _indexes.popitem(last=False)
+    return index
+
+
+def search(user_id: str, query: str, k: Optional[int] = None, task_id: Optional[str] = None) -> List[RetrievedPassage]:
+    """Top-k pasajes del usuario para la consulta (lista vacía si aún no hay índice)"""
+    index = load_user_index(user_id)
+    if index is None:
+        return []
+    return index.search(query, k or settings.retrieval_top_k, str(task_id) if task_id else None)
+
+
+def format_passages(passages: List[RetrievedPassage], max_chars: int) -> str:
+    """Bloque de contexto numerado para que el modelo cite como [n]"""
+    lines = []
+    size = 0
+    for n, passage in enumerate(passages, start=1):
+        line = f"[{n}] ({passage.citation()}) {passage.text}"
+        if lines and size + len(line) > max_chars:
+            break
+        lines.append(line[:max_chars])
+        size += len(line)
+    return "\n".join(lines)
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import hashlib
+import re
+import unicodedata
+from typing import FrozenSet, List
+
+import numpy as np
+
+# Shingles de k palabras: con 3, preguntas que solo cambian en una palabra siguen pareciéndose
+SHINGLE_SIZE = 3
+
+_WORD = re.compile(r"\w+")
+
+# MinHash: h(x) = (a*x + b) mod p sobre hashes de 32 bits; con a, b, x < 2^32 no desborda uint64.
+# Semilla fija: las firmas guardadas en la base de datos deben seguir siendo comparables
+MINHASH_PERMUTATIONS = 64
+_MINHASH_PRIME = np.uint64((1 << 32) + 15)
+_minhash_rng = np.random.default_rng(20240917)
+_MINHASH_A = _minhash_rng.integers(1, 1 << 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_MINHASH_B = _minhash_rng.integers(0, 1 << 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sin tildes ni puntuación, para comparar preguntas entre sí"""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def _hash64(value: str) -> int:
+    # Hash estable entre procesos (hash() de Python cambia en cada arranque)
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> FrozenSet[int]:
+    """Conjunto de hashes de los shingles de `size` palabras del texto normalizado"""
+    words = normalize_text(text).split()
+    if len(words) <= size:
+        return frozenset([_hash64(" ".join(words))]) if words else frozenset()
+    return frozenset(_hash64(" ".join(words[i:i + size])) for i in range(len(words) - size + 1))
+
+
+def jaccard(a: FrozenSet[int], b: FrozenSet[int]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class NearDuplicateFilter:
+    """
+    Acepta textos mientras no se parezcan (Jaccard de shingles >= threshold)
+    a ninguno de los ya aceptados.
+    """
+
+    def __init__(self, threshold: float, size: int = SHINGLE_SIZE):
+        self.threshold = threshold
+        self.size = size
+        self._accepted: List[FrozenSet[int]] = []
+
+    def add(self, text: str) -> bool:
+        shingles = shingle_hashes(text, self.size)
+        if not shingles:
+            return False
+        for other in self._accepted:
+            if jaccard(shingles, other) >= self.threshold:
+                return False
+        self._accepted.append(shingles)
+        return True
+
+
+# =====================================================
+# MINHASH
+# =====================================================
+
+def minhash_signature(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """
+    Firma MinHash (MINHASH_PERMUTATIONS valores) de los shingles del texto.
+    La fracción de posiciones iguales entre dos firmas estima su Jaccard.
+    """
+    shingles = shingle_hashes(text, size)
+    if not shingles:
+        return np.full(MINHASH_PERMUTATIONS, _MINHASH_PRIME, dtype=np.uint64)
+    x = np.fromiter((h & 0xFFFFFFFF for h in shingles), np.uint64, len(shingles))
+    return ((_MINHASH_A[:, None] * x[None, :] + _MINHASH_B[:, None]) % _MINHASH_PRIME).min(axis=1)
+
+
+def minhash_similarity(signature: np.ndarray, signatures: np.ndarray) -> np.ndarray:
+    """Jaccard estimado entre una firma y cada fila de `signatures` (shape n x MINHASH_PERMUTATIONS)"""
+    if len(signatures) == 0:
+        return np.zeros(0)
+    return (np.asarray(signatures, dtype=np.uint64) == signature).mean(axis=1)
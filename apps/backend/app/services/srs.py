@@ -0,0 +1,386 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models import Flashcard as FlashcardModel, StudySession as StudySessionModel
+
+# Parámetros de SM-2
+MIN_EASINESS = 1.3
+DEFAULT_EASINESS = 2.5
+PASSING_GRADE = 3
+FIRST_INTERVAL_DAYS = 1
+SECOND_INTERVAL_DAYS = 6
+
+# Previsión de carga: notas simuladas al acertar (3, 4, 5) y peso del promedio del usuario
+# frente al historial de cada tarjeta
+PASS_GRADES = np.array([3, 4, 5])
+PASS_GRADE_WEIGHTS = np.array([0.25, 0.45, 0.30])
+FAIL_GRADE = 1
+PRIOR_REVIEWS = 4.0
+MIN_RECALL, MAX_RECALL = 0.05, 0.99
+
+# Columnas del estado de repetición que se leen y escriben en bloque
+SRS_COLUMNS = (
+    FlashcardModel.id,
+    FlashcardModel.easiness_factor,
+    FlashcardModel.interval_days,
+    FlashcardModel.repetitions,
+    FlashcardModel.times_reviewed,
+    FlashcardModel.times_correct,
+    FlashcardModel.times_incorrect,
+)
+
+
+@dataclass
+class SRSState:
+    """Estado de repetición de un conjunto de tarjetas, como arrays alineados"""
+    easiness: np.ndarray
+    interval: np.ndarray
+    repetitions: np.ndarray
+
+
+def sm2_step(state: SRSState, grades: np.ndarray) -> SRSState:
+    """
+    Una repetición SM-2 para todas las tarjetas a la vez (grades 0-5).
+    Con nota < 3 la tarjeta vuelve a empezar sin cambiar su factor de facilidad.
+    """
+    grades = grades.astype(np.float64)
+    passed = grades >= PASSING_GRADE
+    miss = 5.0 - grades
+    easiness = np.where(
+        passed,
+        np.maximum(MIN_EASINESS, state.easiness + 0.1 - miss * (0.08 + miss * 0.02)),
+        state.easiness,
+    )
+    repetitions = np.where(passed, state.repetitions + 1, 0)
+    interval = np.where(
+        repetitions <= 1,
+        FIRST_INTERVAL_DAYS,
+        np.where(
+            repetitions == 2,
+            SECOND_INTERVAL_DAYS,
+            np.rint(np.maximum(state.interval, 1) * easiness),
+        ),
+    ).astype(np.int64)
+    return SRSState(easiness=easiness, interval=interval, repetitions=repetitions.astype(np.int64))
+
+
+@dataclass
+class Review:
+    card_id: Any
+    grade: int
+    reviewed_at: datetime
+
+
+@dataclass
+class ReviewBatchResult:
+    session: StudySessionModel
+    cards: List[Dict[str, Any]]
+    missing: List[str]
+    reviewed: int
+    correct: int
+
+
+def _naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _occurrence_rounds(positions: np.ndarray) -> np.ndarray:
+    """Para cada revisión, cuántas veces apareció antes la misma tarjeta en el lote"""
+    rounds = np.zeros(len(positions), dtype=np.int64)
+    seen: Dict[int, int] = {}
+    for i, position in enumerate(positions.tolist()):
+        rounds[i] = seen.get(position, 0)
+        seen[position] = rounds[i] + 1
+    return rounds
+
+
+def _session_stats(grades: np.ndarray, cards: int) -> Dict[str, Any]:
+    counts = np.bincount(grades, minlength=6)
+    return {
+        "cards": cards,
+        "grades": {str(g): int(counts[g]) for g in range(6)},
+        "lapses": int((grades < PASSING_GRADE).sum()),
+    }
+
+
+async def apply_reviews(
+    db: AsyncSession,
+    user_id: Any,
+    reviews: Sequence[Review],
+    session_id: Optional[Any] = None,
+    subject_id: Optional[Any] = None,
+    started_at: Optional[datetime] = None,
+) -> ReviewBatchResult:
+    """
+    Aplica un lote de notas en una transacción: lee el estado de las tarjetas en una consulta,
+    calcula SM-2 con NumPy, escribe con un UPDATE masivo por clave primaria y actualiza
+    (o crea) la sesión de estudio. No hace commit.
+    Una tarjeta repetida en el lote se procesa en orden, una ronda por aparición.
+    """
+    now = datetime.utcnow()
+    reviews = sorted(reviews, key=lambda r: _naive_utc(r.reviewed_at))
+    card_ids = list(dict.fromkeys(r.card_id for r in reviews))
+
+    rows = (await db.execute(
+        select(*SRS_COLUMNS)
+        .where(FlashcardModel.user_id == user_id, FlashcardModel.id.in_(card_ids))
+        .with_for_update()
+    )).all()
+    position_of = {row.id: i for i, row in enumerate(rows)}
+    missing = [str(card_id) for card_id in card_ids if card_id not in position_of]
+    reviews = [r for r in reviews if r.card_id in position_of]
+
+    easiness = np.array([row.easiness_factor or DEFAULT_EASINESS for row in rows], dtype=np.float64)
+    interval = np.array([row.interval_days or FIRST_INTERVAL_DAYS for row in rows], dtype=np.int64)
+    repetitions = np.array([row.repetitions or 0 for row in rows], dtype=np.int64)
+    times_reviewed = np.array([row.times_reviewed or 0 for row in rows], dtype=np.int64)
+    times_correct = np.array([row.times_correct or 0 for row in rows], dtype=np.int64)
+    times_incorrect = np.array([row.times_incorrect or 0 for row in rows], dtype=np.int64)
+    last_reviewed: List[Optional[datetime]] = [None] * len(rows)
+
+    positions = np.array([position_of[r.card_id] for r in reviews], dtype=np.int64)
+    grades = np.array([r.grade for r in reviews], dtype=np.int64)
+    rounds = _occurrence_rounds(positions)
+
+    for round_number in range(int(rounds.max()) + 1 if len(rounds) else 0):
+        in_round = np.flatnonzero(rounds == round_number)
+        idx = positions[in_round]
+        step = sm2_step(SRSState(easiness[idx], interval[idx], repetitions[idx]), grades[in_round])
+        easiness[idx], interval[idx], repetitions[idx] = step.easiness, step.interval, step.repetitions
+        passed = grades[in_round] >= PASSING_GRADE
+        times_reviewed[idx] += 1
+        times_correct[idx] += passed
+        times_incorrect[idx] += ~passed
+        for i in in_round.tolist():
+            last_reviewed[positions[i]] = _naive_utc(reviews[i].reviewed_at)
+
+    cards: List[Dict[str, Any]] = []
+    for i, row in enumerate(rows):
+        if last_reviewed[i] is None:
+            continue
+        cards.append({
+            "id": row.id,
+            "easiness_factor": round(float(easiness[i]), 4),
+            "interval_days": int(interval[i]),
+            "repetitions": int(repetitions[i]),
+            "next_review_date": last_reviewed[i].date() + timedelta(days=int(interval[i])),
+            "times_reviewed": int(times_reviewed[i]),
+            "times_correct": int(times_correct[i]),
+            "times_incorrect": int(times_incorrect[i]),
+            "last_reviewed_at": last_reviewed[i],
+            "updated_at": now,
+        })
+    if cards:
+        # UPDATE masivo por clave primaria (executemany)
+        await db.execute(update(FlashcardModel), cards)
+
+    correct = int((grades >= PASSING_GRADE).sum())
+    session = await _record_session(
+        db, user_id, session_id, subject_id, started_at, now, len(reviews), correct,
+        _session_stats(grades, len(cards))
+    )
+    return ReviewBatchResult(session=session, cards=cards, missing=missing, reviewed=len(reviews), correct=correct)
+
+
+async def _record_session(
+    db: AsyncSession,
+    user_id: Any,
+    session_id: Optional[Any],
+    subject_id: Optional[Any],
+    started_at: Optional[datetime],
+    now: datetime,
+    reviewed: int,
+    correct: int,
+    stats: Dict[str, Any],
+) -> StudySessionModel:
+    """Suma el lote a la sesión de repaso (varios lotes pueden formar una sesión)"""
+    session = None
+    if session_id is not None:
+        session = await db.scalar(select(StudySessionModel).where(
+            StudySessionModel.id == session_id,
+            StudySessionModel.user_id == user_id
+        ))
+        if session is None:
+            raise LookupError("Study session not found")
+
+    if session is None:
+        session = StudySessionModel(
+            user_id=user_id,
+            subject_id=subject_id,
+            title="Repaso de flashcards",
+            session_type="flashcards",
+            start_time=_naive_utc(started_at) if started_at else now,
+            flashcards_reviewed=0,
+            correct_answers=0,
+            ai_insights={},
+        )
+        db.add(session)
+
+    session.flashcards_reviewed = (session.flashcards_reviewed or 0) + reviewed
+    session.correct_answers = (session.correct_answers or 0) + correct
+    session.end_time = now
+    session.actual_duration = now - _naive_utc(session.start_time)
+    session.updated_at = now
+
+    # Estadísticas acumuladas del repaso junto a los insights existentes
+    insights = dict(session.ai_insights or {})
+    previous = insights.get("review") or {}
+    grades = {g: previous.get("grades", {}).get(g, 0) + n for g, n in stats["grades"].items()}
+    total = sum(grades.values())
+    insights["review"] = {
+        "batches": previous.get("batches", 0) + 1,
+        "cards": previous.get("cards", 0) + stats["cards"],
+        "grades": grades,
+        "average_grade": round(sum(int(g) * n for g, n in grades.items()) / total, 2) if total else None,
+        "lapses": previous.get("lapses", 0) + stats["lapses"],
+    }
+    session.ai_insights = insights
+    await db.flush()
+    return session
+
+
+# =====================================================
+# PREVISIÓN DE CARGA DE REPASO
+# =====================================================
+
+@dataclass
+class ReviewForecast:
+    start: date
+    cards: int
+    simulations: int
+    # Repasos por día: media y percentiles 10/90 entre simulaciones
+    expected: np.ndarray
+    low: np.ndarray
+    high: np.ndarray
+
+
+def recall_probability(times_correct: np.ndarray, times_incorrect: np.ndarray) -> np.ndarray:
+    """
+    Probabilidad de acierto por tarjeta: su historial suavizado hacia el promedio del usuario,
+    así una tarjeta nueva o con pocas revisiones no queda en 0 ni en 1.
+    """
+    correct = times_correct.astype(np.float64)
+    reviewed = correct + times_incorrect
+    user_rate = (correct.sum() + 1.0) / (reviewed.sum() + 2.0)
+    p = (correct + PRIOR_REVIEWS * user_rate) / (reviewed + PRIOR_REVIEWS)
+    return np.clip(p, MIN_RECALL, MAX_RECALL)
+
+
+def simulate_review_load(
+    state: SRSState,
+    due_in_days: np.ndarray,
+    recall: np.ndarray,
+    days: int,
+    simulations: int,
+    rng: Optional[np.random.Generator] = None,
+) -> np.ndarray:
+    """
+    Monte Carlo de los próximos `days` días: devuelve los repasos por día de cada simulación
+    (shape simulations x days). Todas las tarjetas de todas las simulaciones avanzan a la vez;
+    cada ronda revisa las que siguen dentro del horizonte, así el coste es proporcional al número
+    de repasos simulados y no a tarjetas x días.
+    due_in_days: días hasta el próximo repaso (las atrasadas cuentan como hoy, 0).
+    """
+    rng = rng or np.random.default_rng()
+    n = len(due_in_days)
+    counts = np.zeros(simulations * days, dtype=np.int64)
+    if n == 0 or days <= 0:
+        return counts.reshape(simulations, days)
+
+    # Vectores planos con una entrada por (simulación, tarjeta); en cada ronda se quedan
+    # solo las que siguen dentro del horizonte, sin volver a escribir en arrays completos
+    due = np.tile(np.maximum(due_in_days, 0).astype(np.int64), simulations)
+    keep = due < days
+    easiness = np.tile(state.easiness.astype(np.float64), simulations)[keep]
+    interval = np.tile(state.interval.astype(np.int64), simulations)[keep]
+    repetitions = np.tile(state.repetitions.astype(np.int64), simulations)[keep]
+    recall = np.tile(recall.astype(np.float64), simulations)[keep]
+    slot = (np.repeat(np.arange(simulations, dtype=np.int64) * days, n) + due)[keep]
+    due = due[keep]
+    # Umbrales acumulados para elegir la nota de un acierto con el mismo número aleatorio
+    pass_thresholds = np.cumsum(PASS_GRADE_WEIGHTS)[:-1]
+
+    while due.size:
+        counts += np.bincount(slot, minlength=simulations * days)
+
+        # u < recall es acierto; u / recall vuelve a ser uniforme y elige la nota (3, 4 o 5)
+        u = rng.random(due.size)
+        passed = u < recall
+        grades = np.where(
+            passed,
+            PASS_GRADES[np.searchsorted(pass_thresholds, u / recall, side="right")],
+            FAIL_GRADE,
+        )
+        step = sm2_step(SRSState(easiness, interval, repetitions), grades)
+
+        due = due + step.interval
+        slot = slot + step.interval
+        keep = due < days
+        due, slot, recall = due[keep], slot[keep], recall[keep]
+        easiness, interval, repetitions = step.easiness[keep], step.interval[keep], step.repetitions[keep]
+
+    return counts.reshape(simulations, days)
+
+
+async def forecast_review_load(
+    db: AsyncSession,
+    user_id: Any,
+    days: int,
+    simulations: int,
+    max_card_days: int,
+    subject_id: Optional[Any] = None,
+    start: Optional[date] = None,
+    seed: Optional[int] = None,
+) -> ReviewForecast:
+    """
+    Previsión de repasos diarios para las tarjetas del usuario (o de una asignatura).
+    Lee solo las columnas del estado SRS y reduce las simulaciones hasta que
+    tarjetas x días x simulaciones quepa en `max_card_days` (con mazos grandes basta con pocas:
+    la suma de miles de tarjetas ya varía poco entre simulaciones).
+    """
+    start = start or datetime.utcnow().date()
+    query = select(
+        FlashcardModel.easiness_factor,
+        FlashcardModel.interval_days,
+        FlashcardModel.repetitions,
+        FlashcardModel.next_review_date,
+        FlashcardModel.times_correct,
+        FlashcardModel.times_incorrect,
+    ).where(FlashcardModel.user_id == user_id)
+    if subject_id:
+        query = query.where(FlashcardModel.subject_id == subject_id)
+    rows = (await db.execute(query)).all()
+
+    n = len(rows)
+    simulations = max(1, min(simulations, max_card_days // max(n * days, 1)))
+    state = SRSState(
+        easiness=np.fromiter((r[0] or DEFAULT_EASINESS for r in rows), np.float64, n),
+        interval=np.fromiter((r[1] or FIRST_INTERVAL_DAYS for r in rows), np.int64, n),
+        repetitions=np.fromiter((r[2] or 0 for r in rows), np.int64, n),
+    )
+    # Sin fecha de repaso la tarjeta es nueva: se estudia hoy
+    due_in_days = np.fromiter(((r[3] - start).days if r[3] else 0 for r in rows), np.int64, n)
+    recall = recall_probability(
+        np.fromiter((r[4] or 0 for r in rows), np.int64, n),
+        np.fromiter((r[5] or 0 for r in rows), np.int64, n),
+    )
+
+    counts = simulate_review_load(state, due_in_days, recall, days, simulations, np.random.default_rng(seed))
+    low, high = np.percentile(counts, [10, 90], axis=0)
+    return ReviewForecast(
+        start=start,
+        cards=n,
+        simulations=simulations,
+        expected=counts.mean(axis=0),
+        low=np.floor(low).astype(np.int64),
+        high=np.ceil(high).astype(np.int64),
+    )
@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy import and_, case, delete, func, insert, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..models import Subject as SubjectModel, Task as TaskModel, TaskCounter
+
+OPEN_STATUSES = ("pending", "in_progress")
+# Clave de materia para las tareas sin materia
+NO_SUBJECT = UUID(int=0)
+
+
+def _aggregates(now: datetime) -> list:
+    """Contadores de tareas en una sola pasada (agregación condicional con FILTER)"""
+    is_open = TaskModel.status.in_(OPEN_STATUSES)
+    return [
+        # count(id) y no count(*): con LEFT JOIN una materia sin tareas cuenta 0
+        func.count(TaskModel.id).label("total_tasks"),
+        func.count(TaskModel.id).filter(TaskModel.status == "completed").label("completed_tasks"),
+        func.count(TaskModel.id).filter(is_open).label("pending_tasks"),
+        func.count(TaskModel.id).filter(and_(is_open, TaskModel.due_date < now)).label("overdue_tasks"),
+    ]
+
+
+def _as_stats(row: Any) -> Dict[str, Any]:
+    total = row.total_tasks or 0
+    completed = row.completed_tasks or 0
+    return {
+        "total_tasks": total,
+        "completed_tasks": completed,
+        "pending_tasks": row.pending_tasks or 0,
+        "overdue_tasks": row.overdue_tasks or 0,
+        "completion_rate": (completed / total * 100) if total > 0 else 0
+    }
+
+
+def _subject_key_expr():
+    return func.coalesce(TaskModel.subject_id, literal(NO_SUBJECT, TaskCounter.subject_key.type))
+
+
+# =====================================================
+# DELTAS AL ESCRIBIR TAREAS
+# =====================================================
+
+@dataclass(frozen=True)
+class TaskState:
+    """Campos de una tarea que afectan a los contadores"""
+    subject_key: UUID
+    status: Optional[str]
+    due_date: Optional[datetime]
+
+    @classmethod
+    def of(cls, task: TaskModel) -> "TaskState":
+        subject_id = task.subject_id
+        if subject_id is not None and not isinstance(subject_id, UUID):
+            subject_id = UUID(str(subject_id))
+        due_date = task.due_date
+        if due_date is not None and due_date.tzinfo is not None:
+            due_date = due_date.astimezone(timezone.utc).replace(tzinfo=None)
+        return cls(subject_id or NO_SUBJECT, task.status, due_date)
+
+
+def _counter_upsert(dialect_name: str, user_id: Any, state: TaskState, sign: int, now: datetime):
+    is_open = state.status in OPEN_STATUSES
+    has_deadline = is_open and state.due_date is not None
+    values = {
+        "user_id": user_id,
+        "subject_key": state.subject_key,
+        "total_tasks": sign,
+        "completed_tasks": sign if state.status == "completed" else 0,
+        "pending_tasks": sign if is_open else 0,
+        "overdue_tasks": sign if has_deadline and state.due_date < now else 0,
+        "overdue_as_of": now,
+        "updated_at": now,
+    }
+    dialect_insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(TaskCounter).values(**values)
+
+    # En la fila existente, "vencida" se mide contra su propio overdue_as_of
+    overdue = TaskCounter.overdue_tasks
+    if has_deadline:
+        overdue = overdue + case((TaskCounter.overdue_as_of > state.due_date, sign), else_=0)
+
+    return stmt.on_conflict_do_update(
+        index_elements=[TaskCounter.user_id, TaskCounter.subject_key],
+        set_={
+            "total_tasks": TaskCounter.total_tasks + stmt.excluded.total_tasks,
+            "completed_tasks": TaskCounter.completed_tasks + stmt.excluded.completed_tasks,
+            "pending_tasks": TaskCounter.pending_tasks + stmt.excluded.pending_tasks,
+            "overdue_tasks": overdue,
+            "updated_at": now,
+        },
+    )
+
+
+def counter_updates(
+    dialect_name: str,
+    user_id: Any,
+    old: Optional[TaskState],
+    new: Optional[TaskState],
+    now: Optional[datetime] = None,
+) -> list:
+    """Sentencias que restan la contribución anterior de la tarea y suman la nueva"""
+    if old == new:
+        return []
+    now = now or datetime.utcnow()
+    statements = []
+    if old is not None:
+        statements.append(_counter_upsert(dialect_name, user_id, old, -1, now))
+    if new is not None:
+        statements.append(_counter_upsert(dialect_name, user_id, new, 1, now))
+    return statements
+
+
+async def apply_task_change(
+    db: AsyncSession,
+    user_id: Any,
+    old: Optional[TaskState],
+    new: Optional[TaskState],
+) -> None:
+    """Aplica el delta en la misma transacción que el cambio de la tarea"""
+    dialect_name = db.get_bind().dialect.name
+    for stmt in counter_updates(dialect_name, user_id, old, new):
+        await db.execute(stmt)
+
+
+# =====================================================
+# RECONCILIACIÓN (worker)
+# =====================================================
+
+def reconcile_user_counters(db: Session, user_id: Any) -> int:
+    """
+    Recalcula desde las tareas los contadores de un usuario (sin commit).
+    Bloquea antes sus filas: los deltas concurrentes esperan y se aplican sobre el valor nuevo.
+    """
+    now = datetime.utcnow()
+    db.execute(select(TaskCounter.subject_key).where(TaskCounter.user_id == user_id).with_for_update())
+
+    subject_key = _subject_key_expr()
+    rows = db.execute(
+        select(subject_key.label("subject_key"), *_aggregates(now))
+        .where(TaskModel.user_id == user_id)
+        .group_by(subject_key)
+    ).all()
+
+    db.execute(delete(TaskCounter).where(TaskCounter.user_id == user_id))
+    counters = [
+        {
+            "user_id": user_id,
+            "subject_key": row.subject_key,
+            "total_tasks": row.total_tasks,
+            "completed_tasks": row.completed_tasks,
+            "pending_tasks": row.pending_tasks,
+            "overdue_tasks": row.overdue_tasks,
+            "overdue_as_of": now,
+            "reconciled_at": now,
+            "updated_at": now,
+        }
+        for row in rows
+    ]
+    # La fila NO_SUBJECT reconciliada marca al usuario como inicializado
+    if not any(row.subject_key == NO_SUBJECT for row in rows):
+        counters.append({
+            "user_id": user_id,
+            "subject_key": NO_SUBJECT,
+            "total_tasks": 0,
+            "completed_tasks": 0,
+            "pending_tasks": 0,
+            "overdue_tasks": 0,
+            "overdue_as_of": now,
+            "reconciled_at": now,
+            "updated_at": now,
+        })
+    db.execute(insert(TaskCounter), counters)
+    return len(counters)
+
+
+# =====================================================
+# LECTURA
+# =====================================================
+
+def _overdue_since_counted(now: datetime):
+    """Tareas abiertas vencidas después de overdue_as_of (rango corto de idx_tasks_user_due_date)"""
+    return (
+        select(func.count(TaskModel.id))
+        .where(
+            TaskModel.user_id == TaskCounter.user_id,
+            _subject_key_expr() == TaskCounter.subject_key,
+            TaskModel.status.in_(OPEN_STATUSES),
+            TaskModel.due_date >= TaskCounter.overdue_as_of,
+            TaskModel.due_date < now,
+        )
+        .correlate(TaskCounter)
+        .scalar_subquery()
+    )
+
+
+def _initialized(user_id: Any):
+    return (
+        select(TaskCounter.user_id)
+        .where(
+            TaskCounter.user_id == user_id,
+            TaskCounter.subject_key == NO_SUBJECT,
+            TaskCounter.reconciled_at.isnot(None),
+        )
+        .exists()
+    )
+
+
+def _schedule_reconcile(user_id: Any) -> None:
+    from ..worker import reconcile_task_counters
+
+    try:
+        reconcile_task_counters.delay(str(user_id))
+    except Exception as e:
+        print(f"Could not schedule counter reconciliation: {str(e)}")
+
+
+async def task_overview(db: AsyncSession, user_id: Any) -> Dict[str, Any]:
+    """Estadísticas de todas las tareas del usuario a partir de los contadores"""
+    now = datetime.utcnow()
+    row = (await db.execute(
+        select(
+            _initialized(user_id).label("initialized"),
+            func.sum(TaskCounter.total_tasks).label("total_tasks"),
+            func.sum(TaskCounter.completed_tasks).label("completed_tasks"),
+            func.sum(TaskCounter.pending_tasks).label("pending_tasks"),
+            func.sum(TaskCounter.overdue_tasks + _overdue_since_counted(now)).label("overdue_tasks"),
+        ).where(TaskCounter.user_id == user_id)
+    )).one()
+
+    if not row.initialized:
+        # Usuario sin contadores todavía: agregación directa y reconciliación en el worker
+        _schedule_reconcile(user_id)
+        row = (await db.execute(select(*_aggregates(now)).where(TaskModel.user_id == user_id))).one()
+    return _as_stats(row)
+
+
+async def subject_stats(db: AsyncSession, user_id: Any, subject_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Estadísticas por materia en una consulta: materias LEFT JOIN contadores.
+    Con `subject_id` devuelve solo esa materia (lista vacía si no es del usuario).
+    """
+    now = datetime.utcnow()
+    query = (
+        select(
+            SubjectModel.id,
+            SubjectModel.name,
+            _initialized(user_id).label("initialized"),
+            TaskCounter.total_tasks,
+            TaskCounter.completed_tasks,
+            TaskCounter.pending_tasks,
+            (TaskCounter.overdue_tasks + _overdue_since_counted(now)).label("overdue_tasks"),
+        )
+        .outerjoin(
+            TaskCounter,
+            and_(TaskCounter.user_id == SubjectModel.user_id, TaskCounter.subject_key == SubjectModel.id),
+        )
+        .where(SubjectModel.user_id == user_id)
+        .order_by(SubjectModel.name)
+    )
+    if subject_id:
+        query = query.where(SubjectModel.id == subject_id)
+    rows = (await db.execute(query)).all()
+
+    if rows and not rows[0].initialized:
+        _schedule_reconcile(user_id)
+        query = (
+            select(SubjectModel.id, SubjectModel.name, *_aggregates(now))
+            .outerjoin(TaskModel, TaskModel.subject_id == SubjectModel.id)
+            .where(SubjectModel.user_id == user_id)
+            .group_by(SubjectModel.id, SubjectModel.name)
+            .order_by(SubjectModel.name)
+        )
+        if subject_id:
+            query = query.where(SubjectModel.id == subject_id)
+        rows = (await db.execute(query)).all()
+
+    return [
+        {"subject_id": str(row.id), "subject_name": row.name, **_as_stats(row)}
+        for row in rows
+    ]
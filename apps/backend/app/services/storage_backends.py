@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import shutil
+from pathlib import Path
+from typing import BinaryIO, Optional, Protocol
+from urllib.parse import quote
+
+import httpx
+
+from ..settings import settings
+
+
+class StorageBackend(Protocol):
+    def download_to(self, bucket: str, path: str, dest: BinaryIO) -> int:
+        """Copia el objeto a `dest` por bloques y devuelve los bytes escritos."""
+        ...
+
+    def upload_from(self, bucket: str, path: str, src_path: str, content_type: Optional[str] = None) -> None:
+        """Sube (o reemplaza) el objeto con el contenido del archivo local `src_path`."""
+        ...
+
+
+class LocalStorageBackend:
+    """Sustituto de Supabase Storage sobre el disco local: <root>/<bucket>/<path>."""
+
+    def __init__(self, root: str):
+        self.root = Path(root).resolve()
+
+    def _resolve(self, bucket: str, path: str) -> Path:
+        full = (self.root / bucket / path).resolve()
+        if self.root not in full.parents:
+            raise ValueError(f"Invalid storage path: {bucket}/{path}")
+        return full
+
+    def download_to(self, bucket: str, path: str, dest: BinaryIO) -> int:
+        with self._resolve(bucket, path).open("rb") as src:
+            shutil.copyfileobj(src, dest, 1024 * 1024)
+            return src.tell()
+
+    def upload_from(self, bucket: str, path: str, src_path: str, content_type: Optional[str] = None) -> None:
+        target = self._resolve(bucket, path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Copia a un temporal y renombra: nunca queda un objeto a medias
+        tmp = target.with_name(f".{target.name}.uploading")
+        shutil.copyfile(src_path, tmp)
+        tmp.replace(target)
+
+
+class SupabaseStorageBackend:
+    """Descarga en streaming a través de una URL firmada de corta duración."""
+
+    def download_to(self, bucket: str, path: str, dest: BinaryIO) -> int:
+        from ..clients import supabase_admin
+
+        signed = supabase_admin().storage.from_(bucket).create_signed_url(path, 60)
+        url = signed.get("signedURL") or signed.get("signedUrl")
+        written = 0
+        with httpx.stream("GET", url, timeout=httpx.Timeout(30, connect=5)) as resp:
+            resp.raise_for_status()
+            for block in resp.iter_bytes(1024 * 1024):
+                dest.write(block)
+                written += len(block)
+        return written
+
+    def upload_from(self, bucket: str, path: str, src_path: str, content_type: Optional[str] = None) -> None:
+        # Cuerpo binario en streaming desde el archivo (el cliente de storage lo leería entero en memoria)
+        key = settings.supabase_service_role_key
+        url = f"{settings.supabase_url.rstrip('/')}/storage/v1/object/{bucket}/{quote(path)}"
+        headers = {
+            "Authorization": f"Bearer {key}",
+            "apikey": key,
+            "x-upsert": "true",
+            "content-type": content_type or "application/octet-stream",
+        }
+        timeout = httpx.Timeout(settings.supabase_storage_timeout_seconds, connect=5)
+        with open(src_path, "rb") as src:
+            resp = httpx.post(url, content=src, headers=headers, timeout=timeout)
+        resp.raise_for_status()
+
+
+def get_storage_backend() -> StorageBackend:
+    if settings.storage_backend == "local":
+        return LocalStorageBackend(settings.local_storage_root)
+    return SupabaseStorageBackend()
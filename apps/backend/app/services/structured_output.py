@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+from ..settings import settings
+from .llm_client import LLMClient
+
+# strict=False: los modelos a veces escriben saltos de línea literales dentro de las cadenas
+_decoder = json.JSONDecoder(strict=False)
+_WHITESPACE = " \t\r\n"
+MAX_JSON_STARTS = 20
+_NUMBER_CHARS = set("0123456789+-.eE")
+_LITERALS = ("true", "false", "null")
+
+
+class IncompleteJSON(Exception):
+    """El texto termina antes de cerrar el valor JSON"""
+
+
+# =====================================================
+# PARSER INCREMENTAL
+# =====================================================
+
+def _skip(text: str, pos: int) -> int:
+    while pos < len(text) and text[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+
+def _parse_value(text: str, pos: int) -> Tuple[Any, int, bool]:
+    """
+    (valor, posición siguiente, completo). Si el texto se corta dentro de un array
+    se conservan sus elementos completos; dentro de un objeto, sus claves completas
+    (y los arrays/objetos a medias con algo recuperado).
+    """
+    pos = _skip(text, pos)
+    if pos >= len(text):
+        raise IncompleteJSON()
+    char = text[pos]
+
+    if char == "[":
+        items: List[Any] = []
+        pos += 1
+        while True:
+            pos = _skip(text, pos)
+            if pos >= len(text):
+                return items, pos, False
+            if text[pos] == "]":
+                return items, pos + 1, True
+            if items:
+                if text[pos] != ",":
+                    raise ValueError(f"Expected ',' at {pos}")
+                pos += 1
+            try:
+                item, pos, complete = _parse_value(text, pos)
+            except IncompleteJSON:
+                return items, len(text), False
+            if not complete:
+                # Un elemento cortado (p. ej. una pregunta a medias) no se conserva
+                return items, pos, False
+            items.append(item)
+
+    if char == "{":
+        obj: Dict[str, Any] = {}
+        pos += 1
+        while True:
+            pos = _skip(text, pos)
+            if pos >= len(text):
+                return obj, pos, False
+            if text[pos] == "}":
+                return obj, pos + 1, True
+            if obj:
+                if text[pos] != ",":
+                    raise ValueError(f"Expected ',' at {pos}")
+                pos = _skip(text, pos + 1)
+            try:
+                key, pos = _decoder.raw_decode(text, pos)
+            except json.JSONDecodeError:
+                if _skip(text, pos) >= len(text) or text[pos] == '"':
+                    return obj, len(text), False
+                raise
+            pos = _skip(text, pos)
+            if pos >= len(text):
+                return obj, pos, False
+            if text[pos] != ":":
+                raise ValueError(f"Expected ':' at {pos}")
+            try:
+                value, pos, complete = _parse_value(text, pos + 1)
+            except IncompleteJSON:
+                return obj, len(text), False
+            if complete or (isinstance(value, (list, dict)) and value):
+                obj[key] = value
+            if not complete:
+                return obj, pos, False
+
+    try:
+        value, end = _decoder.raw_decode(text, pos)
+    except json.JSONDecodeError as e:
+        # Solo es un corte si el valor llega hasta el final del texto; "[nota]" en la prosa no lo es
+        if _cut_at_end(text, pos, e):
+            raise IncompleteJSON()
+        raise
+    # Un número al final del texto puede estar cortado ("12" de "125", "1." de "1.5")
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and set(text[end:]) <= _NUMBER_CHARS:
+        raise IncompleteJSON()
+    return value, end, True
+
+
+def _cut_at_end(text: str, pos: int, error: json.JSONDecodeError) -> bool:
+    """El valor que empieza en `pos` no es inválido, solo está sin terminar al final del texto"""
+    if text[pos] == '"':
+        return error.msg.startswith("Unterminated string") or (
+            error.msg.startswith("Invalid \\uXXXX") and error.pos + 6 > len(text)
+        )
+    tail = text[pos:]
+    if text[pos] in "-0123456789":
+        return set(tail) <= _NUMBER_CHARS
+    return any(literal.startswith(tail) for literal in _LITERALS)
+
+
+def parse_partial_json(text: str) -> Tuple[Any, bool]:
+    """
+    Primer valor JSON del texto, aunque venga rodeado de prosa o bloques ```json.
+    Devuelve (valor, completo); con completo=False el valor es lo recuperado antes del corte.
+    Lanza ValueError si no hay JSON.
+    """
+    # La prosa previa puede contener corchetes o llaves: se prueba cada inicio posible
+    starts = [i for i, char in enumerate(text) if char in "[{"][:MAX_JSON_STARTS]
+    for start in starts:
+        try:
+            value, _, complete = _parse_value(text, start)
+        except (IncompleteJSON, ValueError):
+            continue
+        return value, complete
+    raise ValueError("No JSON value found")
+
+
+# =====================================================
+# VALIDACIÓN
+# =====================================================
+
+def missing_fields(value: Dict[str, Any], model: Type[BaseModel]) -> List[str]:
+    """Campos de primer nivel que faltan o no validan contra el esquema"""
+    try:
+        model.model_validate(value)
+        return []
+    except ValidationError as e:
+        return list(dict.fromkeys(str(error["loc"][0]) for error in e.errors() if error["loc"]))
+
+
+def valid_items(items: List[Any], model: Type[BaseModel]) -> List[Dict[str, Any]]:
+    """Elementos que validan contra el esquema (los demás se descartan)"""
+    valid = []
+    for item in items:
+        try:
+            valid.append(model.model_validate(item).model_dump(exclude_none=True))
+        except ValidationError:
+            continue
+    return valid
+
+
+def _as_list(value: Any, key: str) -> List[Any]:
+    # En modo JSON la respuesta es un objeto {"<key>": [...]}; sin él puede llegar el array directo
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        if isinstance(value.get(key), list):
+            return value[key]
+        for item in value.values():
+            if isinstance(item, list):
+                return item
+    return []
+
+
+# =====================================================
+# COMPLETIONS ESTRUCTURADAS
+# =====================================================
+
+def _failed_generation(error: Exception) -> Optional[str]:
+    """Texto que el proveedor rechazó en modo JSON (p. ej. cortado por max_tokens)"""
+    body = getattr(error, "body", None)
+    if isinstance(body, dict):
+        detail = body.get("error", body)
+        if isinstance(detail, dict) and isinstance(detail.get("failed_generation"), str):
+            return detail["failed_generation"]
+    return None
+
+
+async def complete_json(
+    llm: LLMClient,
+    messages: List[Dict[str, Any]],
+    temperature: float,
+    max_tokens: int,
+) -> Tuple[Any, bool]:
+    """
+    Completion en modo JSON (si está activado) parseada de forma incremental.
+    Devuelve (valor, completo); (None, False) si no hay JSON aprovechable.
+    """
+    params: Dict[str, Any] = {}
+    if settings.llm_json_mode:
+        params["response_format"] = {"type": "json_object"}
+    try:
+        completion = await llm.complete(messages=messages, temperature=temperature, max_tokens=max_tokens, **params)
+        text, truncated = completion.content or "", completion.finish_reason == "length"
+    except Exception as e:
+        text = _failed_generation(e)
+        if text is None:
+            raise
+        truncated = True
+
+    try:
+        value, complete = parse_partial_json(text)
+    except ValueError:
+        return None, False
+    return value, complete and not truncated
+
+
+async def complete_object(
+    llm: LLMClient,
+    messages: List[Dict[str, Any]],
+    model: Type[BaseModel],
+    temperature: float,
+    max_tokens: int,
+) -> Optional[Dict[str, Any]]:
+    """
+    Objeto validado contra `model`. Si faltan campos (respuesta cortada o incompleta)
+    se piden solo esos, como mucho llm_repair_attempts veces. None si no se consigue.
+    """
+    value, _ = await complete_json(llm, messages, temperature, max_tokens)
+    value = value if isinstance(value, dict) else {}
+
+    for _ in range(settings.llm_repair_attempts):
+        missing = missing_fields(value, model)
+        if not missing:
+            break
+        kept = {k: v for k, v in value.items() if k not in missing}
+        patch, _ = await complete_json(llm, messages + [
+            {"role": "assistant", "content": json.dumps(kept, ensure_ascii=False)},
+            {"role": "user", "content": (
+                f"Faltan o no son válidos estos campos: {', '.join(missing)}. "
+                "Responde solo con un objeto JSON que contenga únicamente esas claves, con el formato pedido."
+            )},
+        ], temperature, max_tokens)
+        if isinstance(patch, dict):
+            value = {**kept, **{k: v for k, v in patch.items() if k in missing}}
+
+    try:
+        return model.model_validate(value).model_dump()
+    except ValidationError:
+        return None
+
+
+async def complete_list(
+    llm: LLMClient,
+    messages: List[Dict[str, Any]],
+    item_model: Type[BaseModel],
+    key: str,
+    count: int,
+    temperature: float,
+    max_tokens: int,
+) -> List[Dict[str, Any]]:
+    """
+    Hasta `count` elementos válidos. Los completos de una respuesta cortada se conservan y
+    solo se piden los que faltan (como mucho llm_repair_attempts veces).
+    """
+    value, _ = await complete_json(llm, messages, temperature, max_tokens)
+    items = valid_items(_as_list(value, key), item_model)
+
+    for _ in range(settings.llm_repair_attempts):
+        missing = count - len(items)
+        if missing <= 0:
+            break
+        more, _ = await complete_json(llm, messages + [
+            {"role": "assistant", "content": json.dumps({key: items}, ensure_ascii=False)},
+            {"role": "user", "content": (
+                f"Faltan {missing}: genera solo esos elementos, distintos de los anteriores, "
+                f'con el mismo formato: {{"{key}": [...]}}'
+            )},
+        ], temperature, max_tokens)
+        new_items = valid_items(_as_list(more, key), item_model)
+        if not new_items:
+            break
+        items += new_items
+
+    return items[:count]
@@ -0,0 +1,18 @@
+from typing import Any, Dict
+
+from ..models import Task as TaskModel
+from .ai_service import AIService
+from .urgency import task_urgency
+
+
+def apply_task_analysis(task: TaskModel, analysis_result: Dict[str, Any], ai_service: AIService) -> None:
+    """Vuelca el resultado del análisis de IA en la tarea (sin hacer commit)"""
+    task.ai_analysis = analysis_result["analysis"]
+    task.ai_explanation = analysis_result["explanation"]
+    task.ai_solution = analysis_result["solution"]
+
+    # Estimar dificultad basada en el análisis
+    task.priority = ai_service.estimate_difficulty_priority(analysis_result["analysis"])
+
+    # La dificultad estimada cambia la urgencia
+    task.urgency_score = task_urgency(task)
@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import shutil
+import time
+import uuid
+import weakref
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, BinaryIO, List, Optional
+
+from ..settings import settings
+from .storage_backends import StorageBackend, get_storage_backend
+
+MANIFEST = "manifest.json"
+COPY_BLOCK = 1024 * 1024
+
+
+class UploadError(ValueError):
+    """Petición inválida para la sesión de subida (se responde con 400)"""
+
+
+class UploadNotFound(LookupError):
+    pass
+
+
+@dataclass
+class UploadSession:
+    upload_id: str
+    user_id: str
+    bucket: str
+    path: str
+    size_bytes: int
+    part_size: int
+    content_type: Optional[str] = None
+    # sha256 esperado del archivo completo (opcional, lo envía el cliente)
+    sha256: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+
+    @property
+    def part_count(self) -> int:
+        return max(1, math.ceil(self.size_bytes / self.part_size))
+
+    def part_length(self, index: int) -> int:
+        if index < self.part_count - 1:
+            return self.part_size
+        return self.size_bytes - self.part_size * (self.part_count - 1)
+
+
+@dataclass
+class CompletedUpload:
+    bucket: str
+    path: str
+    size_bytes: int
+    sha256: str
+    # Archivo ensamblado en el directorio de la sesión (hasta store/abort)
+    local_path: str
+
+
+class ChunkedUploadStore:
+    """
+    Subidas reanudables por partes, preparadas en disco local: <root>/<upload_id>/.
+
+    - Cada parte se escribe en un temporal y se renombra: una parte existe completa o no existe,
+      así el cliente puede repetir o enviar partes en paralelo sin coordinarse.
+    - El estado de la sesión es el propio directorio (manifiesto + partes recibidas).
+    - Al completar se ensamblan las partes y se suben al backend de almacenamiento.
+    - El disco y el sha256 van en hilos: el event loop no se bloquea con partes de varios MB.
+    """
+
+    def __init__(self, root: str, part_size: int, max_bytes: int, ttl_seconds: float):
+        self.root = Path(root).resolve()
+        self.part_size = part_size
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # Un solo /complete a la vez por sesión en el proceso
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    @classmethod
+    def from_settings(cls) -> "ChunkedUploadStore":
+        return cls(
+            root=settings.upload_staging_dir,
+            part_size=settings.upload_part_size_bytes,
+            max_bytes=settings.upload_max_bytes,
+            ttl_seconds=settings.upload_session_ttl_seconds,
+        )
+
+    def _dir(self, upload_id: str) -> Path:
+        try:
+            upload_id = uuid.UUID(upload_id).hex
+        except (ValueError, AttributeError):
+            raise UploadNotFound(upload_id)
+        return self.root / upload_id
+
+    def _part_path(self, directory: Path, index: int) -> Path:
+        return directory / f"part-{index:05d}"
+
+    def create(
+        self,
+        user_id: str,
+        bucket: str,
+        path: str,
+        size_bytes: int,
+        content_type: Optional[str] = None,
+        sha256: Optional[str] = None,
+        part_size: Optional[int] = None,
+    ) -> UploadSession:
+        if size_bytes <= 0 or size_bytes > self.max_bytes:
+            raise UploadError(f"size_bytes must be between 1 and {self.max_bytes}")
+        # Partes más pequeñas solo si el cliente las pide (conexiones móviles)
+        part_size = min(part_size or self.part_size, self.part_size)
+        if part_size < settings.upload_min_part_size_bytes:
+            raise UploadError(f"part_size must be at least {settings.upload_min_part_size_bytes}")
+
+        session = UploadSession(
+            upload_id=uuid.uuid4().hex,
+            user_id=user_id,
+            bucket=bucket,
+            path=path,
+            size_bytes=size_bytes,
+            part_size=part_size,
+            content_type=content_type,
+            sha256=sha256.lower() if sha256 else None,
+        )
+        directory = self.root / session.upload_id
+        directory.mkdir(parents=True)
+        (directory / MANIFEST).write_text(json.dumps(asdict(session)), encoding="utf-8")
+        return session
+
+    def get(self, upload_id: str, user_id: str) -> UploadSession:
+        directory = self._dir(upload_id)
+        try:
+            session = UploadSession(**json.loads((directory / MANIFEST).read_text(encoding="utf-8")))
+        except FileNotFoundError:
+            raise UploadNotFound(upload_id)
+        if session.user_id != user_id or time.time() - session.created_at > self.ttl_seconds:
+            raise UploadNotFound(upload_id)
+        return session
+
+    def lock(self, upload_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(upload_id, asyncio.Lock())
+
+    def received_parts(self, session: UploadSession) -> List[int]:
+        directory = self.root / session.upload_id
+        return [i for i in range(session.part_count) if self._part_path(directory, i).exists()]
+
+    async def write_part(
+        self,
+        session: UploadSession,
+        index: int,
+        body: AsyncIterator[bytes],
+        sha256: Optional[str] = None,
+    ) -> str:
+        """Guarda la parte `index` leyendo el cuerpo por bloques; devuelve su sha256"""
+        if index < 0 or index >= session.part_count:
+            raise UploadError(f"part index must be between 0 and {session.part_count - 1}")
+        expected = session.part_length(index)
+
+        directory = self.root / session.upload_id
+        tmp = directory / f".part-{index:05d}.{uuid.uuid4().hex}"
+        digest = hashlib.sha256()
+        written = 0
+        buffer = bytearray()
+        try:
+            dest = await asyncio.to_thread(tmp.open, "wb")
+            try:
+                async for block in body:
+                    written += len(block)
+                    if written > expected:
+                        raise UploadError(f"part {index} must be {expected} bytes")
+                    buffer += block
+                    # Los bloques del cuerpo son pequeños (~64 KiB): se escriben de COPY_BLOCK en COPY_BLOCK
+                    if len(buffer) >= COPY_BLOCK:
+                        await asyncio.to_thread(_write_block, dest, digest, bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await asyncio.to_thread(_write_block, dest, digest, bytes(buffer))
+            finally:
+                await asyncio.to_thread(dest.close)
+            if written != expected:
+                raise UploadError(f"part {index} must be {expected} bytes")
+            if sha256 and sha256.lower() != digest.hexdigest():
+                raise UploadError(f"part {index} checksum mismatch")
+            await asyncio.to_thread(os.replace, tmp, self._part_path(directory, index))
+        finally:
+            tmp.unlink(missing_ok=True)
+        return digest.hexdigest()
+
+    def assemble(self, session: UploadSession) -> CompletedUpload:
+        """Ensambla las partes y verifica el tamaño/sha256 (bloqueante)"""
+        directory = self.root / session.upload_id
+        missing = sorted(set(range(session.part_count)) - set(self.received_parts(session)))
+        if missing:
+            raise UploadError(f"missing parts: {missing[:20]}")
+
+        # Nombre único: otro proceso que complete la misma sesión no escribe en el mismo archivo
+        assembled = directory / f"assembled-{uuid.uuid4().hex}"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with assembled.open("wb") as dest:
+                for index in range(session.part_count):
+                    with self._part_path(directory, index).open("rb") as src:
+                        while block := src.read(COPY_BLOCK):
+                            digest.update(block)
+                            dest.write(block)
+                            size += len(block)
+            if size != session.size_bytes:
+                raise UploadError("assembled size does not match size_bytes")
+            if session.sha256 and session.sha256 != digest.hexdigest():
+                raise UploadError("checksum mismatch for the assembled file")
+        except BaseException:
+            assembled.unlink(missing_ok=True)
+            raise
+
+        return CompletedUpload(session.bucket, session.path, size, digest.hexdigest(), str(assembled))
+
+    def store(
+        self,
+        session: UploadSession,
+        completed: CompletedUpload,
+        storage: Optional[StorageBackend] = None,
+    ) -> None:
+        """Sube el archivo ensamblado al backend y borra la sesión (bloqueante)"""
+        storage = storage or get_storage_backend()
+        storage.upload_from(session.bucket, session.path, completed.local_path, session.content_type)
+        self.abort(session)
+
+    def abort(self, session: UploadSession) -> None:
+        shutil.rmtree(self.root / session.upload_id, ignore_errors=True)
+
+    def purge_expired(self) -> int:
+        """Borra las sesiones abandonadas; devuelve cuántas"""
+        if not self.root.exists():
+            return 0
+        cutoff = time.time() - self.ttl_seconds
+        purged = 0
+        for directory in self.root.iterdir():
+            if directory.is_dir() and directory.stat().st_mtime < cutoff:
+                shutil.rmtree(directory, ignore_errors=True)
+                purged += 1
+        return purged
+
+    async def purge_periodically(self, interval: float) -> None:
+        """
+        Purga en el proceso de la API (lifespan): el staging está en su disco local,
+        así que un worker en otra máquina no vería estas sesiones.
+        """
+        while True:
+            try:
+                purged = await asyncio.to_thread(self.purge_expired)
+                if purged:
+                    print(f"Purged {purged} stale uploads")
+            except Exception as e:
+                print(f"Could not purge stale uploads: {str(e)}")
+            await asyncio.sleep(interval)
+
+
+def _write_block(dest: BinaryIO, digest: Any, block: bytes) -> None:
+    digest.update(block)
+    dest.write(block)
+
+
+upload_store = ChunkedUploadStore.from_settings()
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Iterable, Optional
+
+import numpy as np
+from sqlalchemy import literal_column, select, update
+from sqlalchemy.orm import Session
+
+from ..models import Task as TaskModel
+
+OPEN_STATUSES = ("pending", "in_progress")
+# Literales en línea (no parámetros): con un plan genérico de asyncpg, Postgres solo usa
+# idx_tasks_user_urgency si ve el mismo predicado que el índice parcial
+OPEN_STATUS_FILTER = TaskModel.status.in_([literal_column(f"'{status}'") for status in OPEN_STATUSES])
+
+PRIORITY_WEIGHT = {"urgent": 1.0, "high": 0.75, "medium": 0.5, "low": 0.25}
+DEFAULT_PRIORITY_WEIGHT = PRIORITY_WEIGHT["medium"]
+DEFAULT_DIFFICULTY = 3.0
+DEFAULT_DURATION_HOURS = 2.0
+
+# Peso de cada factor en la puntuación (0-100)
+DEADLINE_WEIGHT = 0.55
+PRIORITY_WEIGHT_FACTOR = 0.30
+DIFFICULTY_WEIGHT = 0.15
+# Una tarea sin fecha límite no aporta presión de plazo
+NO_DEADLINE_PRESSURE = 0.0
+# Con 48 h de margen la presión cae a ~0.37, con una semana a ~0.03
+PRESSURE_SCALE_HOURS = 48.0
+
+BATCH_SIZE = 5000
+# Cambios menores no se escriben
+MIN_SCORE_CHANGE = 0.01
+
+
+def urgency_scores(
+    hours_left: np.ndarray,
+    priority_weight: np.ndarray,
+    difficulty: np.ndarray,
+    duration_hours: np.ndarray,
+) -> np.ndarray:
+    """
+    Puntuación de urgencia (0-100) para arrays de tareas; hours_left es NaN si no hay fecha.
+    El margen es el tiempo restante menos el esfuerzo estimado (duración corregida por dificultad).
+    """
+    effort = np.maximum(duration_hours, 0.0) * (1.0 + (difficulty - DEFAULT_DIFFICULTY) * 0.25)
+    slack = np.maximum(hours_left - effort, 0.0)
+    with np.errstate(invalid="ignore"):
+        pressure = np.where(np.isnan(hours_left), NO_DEADLINE_PRESSURE, np.exp(-slack / PRESSURE_SCALE_HOURS))
+    return 100.0 * (
+        DEADLINE_WEIGHT * pressure
+        + PRIORITY_WEIGHT_FACTOR * priority_weight
+        + DIFFICULTY_WEIGHT * (difficulty - 1.0) / 4.0
+    )
+
+
+def _difficulty(value: Any) -> float:
+    try:
+        return min(max(float(value), 1.0), 5.0)
+    except (TypeError, ValueError):
+        return DEFAULT_DIFFICULTY
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # timestamptz llega con zona horaria desde Postgres; la aritmética es en UTC sin zona
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _hours(duration: Any) -> float:
+    # Solo timedelta (columna INTERVAL); cualquier otro valor cuenta como la duración por defecto
+    if isinstance(duration, timedelta) and duration > timedelta(0):
+        return duration.total_seconds() / 3600.0
+    return DEFAULT_DURATION_HOURS
+
+
+def _score_rows(rows: Iterable[tuple], now: datetime) -> np.ndarray:
+    """rows: (priority, due_date, estimated_duration, difficulty_level)"""
+    rows = list(rows)
+    count = len(rows)
+    hours_left = np.fromiter(
+        ((_naive_utc(due) - now).total_seconds() / 3600.0 if due else np.nan for _, due, _, _ in rows),
+        float,
+        count
+    )
+    priority = np.fromiter(
+        (PRIORITY_WEIGHT.get(p, DEFAULT_PRIORITY_WEIGHT) for p, _, _, _ in rows), float, count
+    )
+    difficulty = np.fromiter((_difficulty(d) for _, _, _, d in rows), float, count)
+    duration = np.fromiter((_hours(d) for _, _, d, _ in rows), float, count)
+    return urgency_scores(hours_left, priority, difficulty, duration)
+
+
+def task_urgency(task: TaskModel, now: Optional[datetime] = None) -> float:
+    """Puntuación de una sola tarea, con la misma fórmula que el recálculo por lotes"""
+    analysis = task.ai_analysis if isinstance(task.ai_analysis, dict) else {}
+    row = (task.priority, task.due_date, task.estimated_duration, analysis.get("difficulty_level"))
+    return round(float(_score_rows([row], now or datetime.utcnow())[0]), 4)
+
+
+def refresh_urgency_scores(db: Session, now: Optional[datetime] = None, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Recalcula la urgencia de todas las tareas abiertas por lotes (keyset sobre id),
+    con commit por lote. Devuelve cuántas filas cambiaron.
+    """
+    now = now or datetime.utcnow()
+    updated = 0
+    last_id = None
+    while True:
+        query = (
+            select(
+                TaskModel.id,
+                TaskModel.priority,
+                TaskModel.due_date,
+                TaskModel.estimated_duration,
+                TaskModel.ai_analysis["difficulty_level"].as_string(),
+                TaskModel.urgency_score,
+            )
+            .where(OPEN_STATUS_FILTER)
+            .order_by(TaskModel.id)
+            .limit(batch_size)
+        )
+        if last_id is not None:
+            query = query.where(TaskModel.id > last_id)
+        rows = db.execute(query).all()
+        if not rows:
+            break
+
+        scores = np.round(_score_rows((row[1:5] for row in rows), now), 4)
+        previous = np.array([np.nan if row[5] is None else row[5] for row in rows], dtype=float)
+        changed = np.isnan(previous) | (np.abs(scores - previous) >= MIN_SCORE_CHANGE)
+        params = [
+            {"id": rows[i][0], "urgency_score": float(scores[i])}
+            for i in np.flatnonzero(changed)
+        ]
+        if params:
+            # UPDATE masivo por clave primaria (executemany)
+            db.execute(update(TaskModel), params)
+            db.commit()
+            updated += len(params)
+
+        last_id = rows[-1][0]
+        if len(rows) < batch_size:
+            break
+
+    return updated
@@ -1,3 +1,4 @@
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -13,13 +14,169 @@ class Settings(BaseSettings):
     supabase_anon_key: str | None = None
     supabase_service_role_key: str = ""
     supabase_jwks_url: str = ""
+    # Cliente admin de Supabase compartido por proceso (keep-alive HTTP/2).
+    supabase_storage_timeout_seconds: float = 20.0
+    supabase_postgrest_timeout_seconds: float = 30.0
+
+    # Verificación de JWT: claves JWKS en memoria y caché de tokens ya verificados.
+    auth_jwks_ttl_seconds: float = 600.0
+    auth_jwks_min_refresh_seconds: float = 30.0
+    auth_jwks_timeout_seconds: float = 10.0
+    auth_claims_cache_max_entries: int = 10000
 
     groq_api_key: str = ""
     groq_model: str = "llama-3.1-70b-versatile"
 
+    # Async LLM client: one keep-alive pool per process, bounded in-flight completions.
+    llm_max_concurrency: int = 64
+    llm_timeout_seconds: float = 60.0
+    llm_connect_timeout_seconds: float = 5.0
+    llm_max_connections: int = 100
+    llm_max_keepalive_connections: int = 20
+    llm_keepalive_expiry_seconds: float = 30.0
+    llm_max_retries: int = 2
+    # Router LLM: modelos de respaldo en Groq (separados por comas) y servidor local compatible
+    # con la API de OpenAI (Ollama, vLLM, llama.cpp), que se prueban en ese orden.
+    llm_fallback_models: str = ""
+    llm_local_base_url: str = ""
+    llm_local_model: str = ""
+    llm_local_api_key: str = ""
+    # Salud por backend: EWMA de latencia/errores, umbrales de degradado y circuit breaker.
+    llm_ewma_alpha: float = 0.2
+    llm_latency_window: int = 200
+    llm_degraded_error_rate: float = 0.5
+    llm_degraded_latency_seconds: float = 20.0
+    llm_circuit_failure_threshold: int = 5
+    llm_circuit_cooldown_seconds: float = 30.0
+    # Hedging: segunda petición si no hay respuesta en el p95; presupuesto = hedges por petición.
+    llm_hedge_enabled: bool = True
+    llm_hedge_quantile: float = 0.95
+    llm_hedge_min_samples: int = 20
+    llm_hedge_min_delay_seconds: float = 1.0
+    llm_hedge_budget: float = 0.1
+    # Salida estructurada: response_format json_object y re-prompts de reparación por respuesta.
+    llm_json_mode: bool = True
+    llm_repair_attempts: int = 1
+
+    # Caché de respuestas de IA (análisis, flashcards, quizzes).
+    ai_cache_enabled: bool = True
+    ai_cache_max_entries: int = 1024
+    ai_cache_ttl_seconds: int = 60 * 60 * 24
+    ai_cache_redis_enabled: bool = False
+
+    # Almacenamiento de archivos: "supabase" o "local" (disco, para desarrollo y benchmarks).
+    storage_backend: str = "supabase"
+    local_storage_root: str = "./storage"
+
+    # URLs firmadas por lotes y subidas reanudables por partes (preparadas en disco local).
+    signed_upload_batch_max: int = 50
+    signed_upload_concurrency: int = 8
+    upload_staging_dir: str = "./storage/.uploads"
+    upload_part_size_bytes: int = 8 * 1024 * 1024
+    upload_min_part_size_bytes: int = 256 * 1024
+    upload_max_bytes: int = 512 * 1024 * 1024
+    upload_session_ttl_seconds: float = 60 * 60 * 24
+    # Purga de sesiones abandonadas desde la propia API (el staging es disco local).
+    upload_purge_interval_seconds: float = 60 * 60
+
+    # Ingesta de documentos.
+    ingest_chunk_size: int = 1500
+    ingest_chunk_overlap: int = 200
+    # 1 = extracción secuencial: la concurrencia del worker de Celery ya reparte los archivos
+    # entre procesos. >1 = un pool compartido por proceso (worker con --concurrency=1).
+    ingest_workers: int = 1
+    ingest_parallel_min_pages: int = 16
+
+    # Cuánto texto de los documentos se envía al LLM.
+    ai_document_char_budget: int = 24000
+    chat_document_char_budget: int = 6000
+
+    # Índice de recuperación (RAG) por usuario.
+    retrieval_index_dir: str = "./retrieval_index"
+    retrieval_top_k: int = 5
+    retrieval_dense_enabled: bool = True
+    retrieval_dense_dim: int = 128
+    retrieval_dense_weight: float = 0.5
+    retrieval_task_boost: float = 1.5
+    retrieval_context_char_budget: int = 6000
+    # Índices de usuario abiertos (mmap) a la vez en cada proceso de la API
+    retrieval_index_cache_size: int = 256
+    # Reconstrucción tras editar tareas: espera para agrupar ediciones; TTL de la marca de pendiente
+    retrieval_rebuild_delay_seconds: int = 30
+    retrieval_rebuild_pending_ttl_seconds: int = 600
+
+    # Quizzes: lotes en paralelo por tipo/subtema y descarte de preguntas casi repetidas.
+    quiz_batch_size: int = 5
+    quiz_tokens_per_question: int = 300
+    quiz_duplicate_threshold: float = 0.6
+    quiz_overgenerate_ratio: float = 0.2
+    quiz_top_up_rounds: int = 1
+    # Banco de preguntas compartido: candidatas leídas por pregunta pedida, umbral de casi duplicado
+    # (Jaccard estimado con MinHash) y ventana del volcado periódico de quizzes.questions.
+    question_bank_candidate_factor: int = 3
+    question_bank_duplicate_threshold: float = 0.6
+    question_bank_backfill_interval_seconds: int = 60 * 60
+    question_bank_backfill_lookback_hours: int = 3
+
+    # Flashcards de documentos completos (job por chunks).
+    flashcard_cards_per_chunk: int = 3
+    flashcard_generation_concurrency: int = 8
+    flashcard_generation_max_chunks: int = 300
+    flashcard_duplicate_threshold: float = 0.6
+
+    # Historial de chat enviado al LLM: ventana por presupuesto de tokens + resumen acumulado.
+    chat_history_token_budget: int = 2000
+    chat_history_max_messages: int = 50
+    chat_summary_max_tokens: int = 400
+    # Un solo resumen encolado por chat; pasado este tiempo se puede volver a encolar.
+    chat_summary_pending_ttl_seconds: int = 300
+
+    # Repaso espaciado: tamaño de página de la cola de pendientes y máximo de notas por lote.
+    review_queue_page_size: int = 100
+    review_batch_max: int = 500
+    review_forecast_max_days: int = 180
+    # Tarjetas x días x simulaciones por previsión: acota la simulación por debajo de ~100 ms
+    review_forecast_max_card_days: int = 4_000_000
+
     redis_url: str = "redis://localhost:6379/0"
+
+    # Jobs en segundo plano (Celery) expuestos por SSE.
+    job_poll_interval_seconds: float = 0.5
+    job_events_timeout_seconds: float = 300.0
+    # Reconciliación periódica de los contadores de estadísticas (Celery beat).
+    stats_reconcile_interval_seconds: float = 600.0
+    # Recálculo por lotes de la urgencia de las tareas abiertas (Celery beat).
+    urgency_refresh_interval_seconds: float = 900.0
     database_url: str = ""
 
+    # Pool de conexiones (motores síncrono y asíncrono).
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout_seconds: float = 30.0
+    db_pool_recycle_seconds: int = 1800
+    # Tiempo máximo por sentencia en Postgres (0 = sin límite).
+    db_statement_timeout_ms: int = 30000
+
+    # Pool de solo lectura para endpoints de lectura intensiva. Con Postgres puede
+    # apuntar a una réplica (DATABASE_READ_URL); si está vacío usa DATABASE_URL.
+    db_read_pool_enabled: bool = False
+    database_read_url: str = ""
+    db_read_pool_size: int = 10
+
+    # SQLite (desarrollo local): pragmas aplicados a cada conexión.
+    sqlite_path: str = "./uni_ai.db"
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_cache_size_kib: int = 64000
+    sqlite_mmap_size_bytes: int = 268435456
+
+    @model_validator(mode="after")
+    def _check_chunking(self) -> "Settings":
+        if self.ingest_chunk_size < 2:
+            raise ValueError("INGEST_CHUNK_SIZE must be at least 2")
+        if not 0 <= self.ingest_chunk_overlap < self.ingest_chunk_size:
+            raise ValueError("INGEST_CHUNK_OVERLAP must be between 0 and INGEST_CHUNK_SIZE - 1")
+        return self
+
 
 settings = Settings()
 
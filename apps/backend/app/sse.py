@@ -0,0 +1,15 @@
+import json
+from typing import Any
+
+
+# Evita que proxies (nginx) acumulen la respuesta antes de enviarla.
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Serializa un evento Server-Sent Events."""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
@@ -1,5 +1,25 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Coroutine, Optional
+
 from celery import Celery
+from celery.result import AsyncResult
+from redis import Redis
+from sqlalchemy import select, update
 
+from .database import SessionLocal
+from .models import Chat as ChatModel, Document as DocumentModel, Subject as SubjectModel, Task as TaskModel, TaskCounter
+from .schemas import TaskAnalysisResponse
+from .clients import clients
+from .services.chat_context import load_window, messages_to_summarize
+from .services.flashcard_generation import deduplicate_cards, document_chunks, generate_chunk_cards, insert_cards
+from .services.ingestion import ingest_document, task_document_text
+from .services.question_bank import bank_quiz_questions
+from .services.retrieval import build_user_index
+from .services.stats import reconcile_user_counters
+from .services.task_analysis import apply_task_analysis
+from .services.urgency import refresh_urgency_scores as refresh_urgency
 from .settings import settings
 
 
@@ -9,12 +29,329 @@ celery = Celery(
     backend=settings.redis_url,
 )
 
+celery.conf.update(
+    task_track_started=True,
+    result_expires=60 * 60,
+    beat_schedule={
+        "reconcile-task-counters": {
+            "task": "reconcile_task_counters",
+            "schedule": settings.stats_reconcile_interval_seconds,
+        },
+        "refresh-urgency-scores": {
+            "task": "refresh_urgency_scores",
+            "schedule": settings.urgency_refresh_interval_seconds,
+        },
+        "backfill-question-bank": {
+            "task": "backfill_question_bank",
+            "schedule": settings.question_bank_backfill_interval_seconds,
+        },
+    },
+)
+
+
+_loop: asyncio.AbstractEventLoop | None = None
+
+
+def run_async(coro: Coroutine[Any, Any, Any]) -> Any:
+    """
+    Ejecuta una corrutina en un event loop persistente del proceso worker,
+    así el pool HTTP del cliente LLM se reutiliza entre tareas.
+    """
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop.run_until_complete(coro)
+
+
+_redis: Redis | None = None
+
+# Marca de "resumen ya encolado" por chat (SET NX); el TTL la libera si la tarea se pierde
+SUMMARY_PENDING_KEY = "uniai:chat-summary-pending:"
+
+
+def _redis_client() -> Redis:
+    global _redis
+    if _redis is None:
+        _redis = Redis.from_url(settings.redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+    return _redis
+
+
+def schedule_chat_summary(chat_id: str) -> bool:
+    """Encola refresh_chat_summary salvo que ya haya uno pendiente para el chat"""
+    key = SUMMARY_PENDING_KEY + chat_id
+    if not _redis_client().set(key, "1", nx=True, ex=settings.chat_summary_pending_ttl_seconds):
+        return False
+    try:
+        refresh_chat_summary.delay(chat_id)
+    except Exception:
+        _redis_client().delete(key)
+        raise
+    return True
+
+
+# Dueño de cada job, guardado al encolar: /jobs solo muestra los jobs del usuario, sea cual
+# sea su estado (el meta de un FAILURE o STARTED no lleva user_id). Dura más que el resultado
+JOB_OWNER_KEY = "uniai:job-owner:"
+JOB_OWNER_TTL_SECONDS = 24 * 60 * 60
+
+
+def enqueue_job(task: Any, user_id: str, *args: Any) -> AsyncResult:
+    """Publica el job después de registrar su dueño (bloqueante: llamar desde un hilo)"""
+    job_id = str(uuid.uuid4())
+    _redis_client().set(JOB_OWNER_KEY + job_id, str(user_id), ex=JOB_OWNER_TTL_SECONDS)
+    return task.apply_async(args, task_id=job_id)
+
+
+def job_owner(job_id: str) -> Optional[str]:
+    owner = _redis_client().get(JOB_OWNER_KEY + job_id)
+    return owner.decode("utf-8") if owner is not None else None
+
+
+# Marca de "reconstrucción del índice ya encolada" por usuario: una ráfaga de ediciones
+# produce una sola reconstrucción, retrasada retrieval_rebuild_delay_seconds
+INDEX_PENDING_KEY = "uniai:retrieval-index-pending:"
+
+
+def schedule_index_rebuild(user_id: str) -> bool:
+    """Encola rebuild_retrieval_index salvo que ya haya una pendiente para el usuario"""
+    key = INDEX_PENDING_KEY + user_id
+    if not _redis_client().set(key, "1", nx=True, ex=settings.retrieval_rebuild_pending_ttl_seconds):
+        return False
+    try:
+        rebuild_retrieval_index.apply_async((user_id,), countdown=settings.retrieval_rebuild_delay_seconds)
+    except Exception:
+        _redis_client().delete(key)
+        raise
+    return True
+
+
+@celery.task(name="ingest_file", bind=True)
+def ingest_file(self, file_id: str) -> dict:
+    """Descarga un documento, extrae su texto por páginas y guarda los chunks."""
+    with SessionLocal() as db:
+        document = db.query(DocumentModel).filter(DocumentModel.id == file_id).first()
+        if document is None:
+            raise ValueError("Document not found")
+
+        meta = {"user_id": str(document.user_id), "file_id": file_id}
+        document.status = "processing"
+        db.commit()
+
+        def progress(pages: int, chunks: int) -> None:
+            self.update_state(state="PROGRESS", meta={**meta, "stage": "extracting", "pages": pages, "chunks": chunks})
+
+        try:
+            ingest_document(db, document, progress=progress)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            document.status = "failed"
+            document.error = str(e)
+            db.commit()
+            raise
 
-@celery.task(name="ingest_file")
-def ingest_file(file_id: str) -> dict:
+        rebuild_retrieval_index.delay(meta["user_id"])
+
+        return {
+            **meta,
+            "stage": "done",
+            "result": {
+                "status": document.status,
+                "page_count": document.page_count,
+                "chunk_count": document.chunk_count,
+            },
+        }
+
+
+@celery.task(name="rebuild_retrieval_index")
+def rebuild_retrieval_index(user_id: str) -> dict:
+    """Reconstruye el índice BM25/vectorial del usuario (documentos, tareas y flashcards)."""
+    # Las escrituras que lleguen desde ahora pueden encolar otra reconstrucción
+    try:
+        _redis_client().delete(INDEX_PENDING_KEY + user_id)
+    except Exception as e:
+        print(f"Could not clear retrieval index mark: {str(e)}")
+    with SessionLocal() as db:
+        entries = build_user_index(db, user_id)
+    return {"user_id": user_id, "entries": entries}
+
+
+@celery.task(name="analyze_task", bind=True)
+def analyze_task(
+    self,
+    task_id: str,
+    user_id: str,
+    file_url: Optional[str] = None,
+    content_text: Optional[str] = None,
+) -> dict:
+    """Análisis de una tarea con IA fuera del ciclo de la petición HTTP."""
+    meta = {"user_id": user_id, "task_id": task_id}
+    ai_service = clients.ai_service()
+
+    with SessionLocal() as db:
+        task = db.query(TaskModel).filter(TaskModel.id == task_id, TaskModel.user_id == user_id).first()
+        if task is None:
+            raise ValueError("Task not found")
+
+        if not content_text:
+            content_text = task_document_text(db, task.id, settings.ai_document_char_budget) or None
+
+        self.update_state(state="PROGRESS", meta={**meta, "stage": "analyzing"})
+        analysis_result = run_async(
+            ai_service.analyze_task_content(task.title, task.description or "", file_url, content_text)
+        )
+        response = TaskAnalysisResponse(**analysis_result)
+
+        self.update_state(state="PROGRESS", meta={**meta, "stage": "saving"})
+        apply_task_analysis(task, analysis_result, ai_service)
+        db.commit()
+
+    return {**meta, "stage": "done", "result": response.model_dump()}
+
+
+@celery.task(name="generate_document_flashcards", bind=True)
+def generate_document_flashcards(
+    self,
+    document_id: str,
+    user_id: str,
+    subject_id: str,
+    cards_per_chunk: Optional[int] = None,
+) -> dict:
+    """Flashcards de todos los chunks de un documento ingerido, sin repetir las que ya tiene el usuario."""
+    meta = {"user_id": user_id, "document_id": document_id}
+    ai_service = clients.ai_service()
+
+    with SessionLocal() as db:
+        document = db.query(DocumentModel).filter(
+            DocumentModel.id == document_id, DocumentModel.user_id == user_id
+        ).first()
+        if document is None:
+            raise ValueError("Document not found")
+        subject_name = db.scalar(select(SubjectModel.name).where(SubjectModel.id == subject_id)) or ""
+        chunks = document_chunks(db, document, settings.flashcard_generation_max_chunks)
+        # Sin transacción abierta mientras se espera al LLM
+        db.commit()
+
+        def progress(done: int, cards: int) -> None:
+            self.update_state(state="PROGRESS", meta={
+                **meta, "stage": "generating",
+                "progress": {"chunks_done": done, "chunks_total": len(chunks), "cards": cards}
+            })
+
+        progress(0, 0)
+        cards = run_async(generate_chunk_cards(
+            ai_service, chunks, subject_name,
+            cards_per_chunk or settings.flashcard_cards_per_chunk,
+            settings.flashcard_generation_concurrency,
+            progress
+        ))
+
+        self.update_state(state="PROGRESS", meta={**meta, "stage": "saving"})
+        kept = deduplicate_cards(db, user_id, cards)
+        # Todas las tarjetas del documento en una transacción
+        created = insert_cards(db, user_id, subject_id, document, kept)
+        db.commit()
+
+    if created:
+        rebuild_retrieval_index.delay(user_id)
+
+    return {
+        **meta,
+        "stage": "done",
+        "result": {
+            "chunks": len(chunks),
+            "generated": len(cards),
+            "duplicates": len(cards) - len(kept),
+            "created": created,
+        },
+    }
+
+
+@celery.task(name="refresh_chat_summary")
+def refresh_chat_summary(chat_id: str) -> dict:
     """
-    MVP placeholder.
-    Later: download from Supabase Storage, extract text/OCR, chunk, embed, store in pgvector.
+    Integra en el resumen del chat los mensajes que ya no caben en la ventana de historial.
+    Cada lote se escribe con compare-and-set sobre summary_through_id: si otra ejecución
+    avanzó el resumen mientras tanto, esta se detiene sin pisarlo.
     """
-    return {"file_id": file_id, "status": "todo"}
+    # Los mensajes que lleguen desde ahora pueden encolar otra ejecución
+    try:
+        _redis_client().delete(SUMMARY_PENDING_KEY + chat_id)
+    except Exception as e:
+        print(f"Could not clear chat summary mark: {str(e)}")
+    ai_service = clients.ai_service()
+    folded = 0
+
+    with SessionLocal() as db:
+        chat = db.query(ChatModel).filter(ChatModel.id == chat_id).first()
+        if chat is None:
+            raise ValueError("Chat not found")
+
+        window = load_window(db, chat)
+        # Por lotes acotados: cada llamada al LLM recibe el resumen previo y solo los mensajes nuevos
+        while True:
+            pending = messages_to_summarize(db, chat, window, settings.chat_history_token_budget)
+            if not pending:
+                break
+            summary = run_async(ai_service.summarize_conversation(
+                chat.summary,
+                [{"role": m.role, "content": m.content} for m in pending],
+            ))
+            written = db.execute(
+                update(ChatModel)
+                .where(
+                    ChatModel.id == chat.id,
+                    ChatModel.summary_through_id.is_not_distinct_from(chat.summary_through_id),
+                )
+                .values(summary=summary, summary_through_at=pending[-1].created_at, summary_through_id=pending[-1].id)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            # El commit expira `chat`: el siguiente lote parte del resumen guardado
+            db.commit()
+            if not written:
+                break
+            folded += len(pending)
+
+    return {"chat_id": chat_id, "folded": folded}
+
+
+@celery.task(name="reconcile_task_counters")
+def reconcile_task_counters(user_id: Optional[str] = None) -> dict:
+    """Recalcula los contadores de estadísticas (de un usuario o de todos) para corregir derivas"""
+    if user_id:
+        user_ids = [user_id]
+    else:
+        with SessionLocal() as db:
+            user_ids = db.scalars(select(TaskModel.user_id).union(select(TaskCounter.user_id))).all()
+
+    failed = 0
+    for uid in user_ids:
+        # Una transacción corta por usuario
+        with SessionLocal() as db:
+            try:
+                reconcile_user_counters(db, uid)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                failed += 1
+                print(f"Counter reconciliation failed for {uid}: {str(e)}")
+
+    return {"users": len(user_ids), "failed": failed}
+
+
+@celery.task(name="refresh_urgency_scores")
+def refresh_urgency_scores() -> dict:
+    """Recalcula la urgencia de las tareas abiertas a medida que se acercan las fechas límite"""
+    with SessionLocal() as db:
+        updated = refresh_urgency(db)
+    return {"updated": updated}
+
 
+@celery.task(name="backfill_question_bank")
+def backfill_question_bank(full: bool = False) -> dict:
+    """Añade al banco compartido las preguntas de los quizzes recientes (o de todos con full=True)"""
+    since = None if full else datetime.utcnow() - timedelta(hours=settings.question_bank_backfill_lookback_hours)
+    with SessionLocal() as db:
+        added = bank_quiz_questions(db, since=since)
+    return {"added": added}
@@ -0,0 +1,37 @@
+import asyncio
+import json
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.compiler import compiles
+
+from app.models import Base
+
+
+# Las columnas JSONB/ARRAY de Postgres se crean como JSON en SQLite
+@compiles(JSONB, "sqlite")
+@compiles(ARRAY, "sqlite")
+def _json_on_sqlite(type_, compiler, **kw):
+    return "JSON"
+
+
+# Los valores por defecto de las columnas ARRAY son listas de Python
+sqlite3.register_adapter(list, json.dumps)
+
+# SQLite no tiene esquemas: public.* y auth.* van a la base principal
+NO_SCHEMAS = {"schema_translate_map": {"public": None, "auth": None}}
+
+
+@pytest.fixture
+def sqlite_engines(tmp_path):
+    """Motores síncrono y asíncrono sobre el mismo archivo SQLite con todas las tablas"""
+    path = tmp_path / "app.db"
+    sync_engine = create_engine(f"sqlite:///{path}", execution_options=NO_SCHEMAS)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}", execution_options=NO_SCHEMAS)
+    Base.metadata.create_all(sync_engine)
+    yield sync_engine, async_engine
+    asyncio.run(async_engine.dispose())
+    sync_engine.dispose()
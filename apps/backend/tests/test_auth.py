@@ -0,0 +1,193 @@
+import asyncio
+import time
+from functools import partial
+
+import httpx
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+from jose import jwk, jwt
+from starlette.requests import Request
+
+from app import auth
+from app.auth import AuthUser, ClaimsCache, JWKSCache
+
+JWKS_URL = "https://example.supabase.co/auth/v1/.well-known/jwks.json"
+
+
+def _rsa_key(kid):
+    private = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    public = jwk.construct(pem, "RS256").public_key().to_dict()
+    return pem, {**public, "kid": kid, "alg": "RS256"}
+
+
+KEY_A = _rsa_key("a")
+KEY_B = _rsa_key("b")
+
+
+class JWKSServer:
+    """Endpoint JWKS en memoria que cuenta las descargas"""
+
+    def __init__(self, *keys):
+        self.keys = list(keys)
+        self.fetches = 0
+
+    async def handler(self, request):
+        self.fetches += 1
+        # Deja tiempo a que lleguen las peticiones concurrentes
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"keys": [public for _, public in self.keys]})
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = JWKSServer(KEY_A)
+    transport = httpx.MockTransport(server.handler)
+    monkeypatch.setattr(httpx, "AsyncClient", partial(httpx.AsyncClient, transport=transport))
+    return server
+
+
+def _cache(ttl_seconds=600.0, min_refresh_seconds=30.0):
+    return JWKSCache(JWKS_URL, ttl_seconds, min_refresh_seconds, timeout=5.0)
+
+
+def _token(key, sub="user-1", expires_in=3600):
+    pem, public = key
+    claims = {"sub": sub, "email": f"{sub}@example.com", "exp": int(time.time()) + expires_in}
+    return jwt.encode(claims, pem, algorithm="RS256", headers={"kid": public["kid"]})
+
+
+def _request(token):
+    return Request({"type": "http", "headers": [(b"authorization", f"Bearer {token}".encode())]})
+
+
+def test_concurrent_misses_share_one_download(server):
+    cache = _cache()
+
+    async def run():
+        keys = await asyncio.gather(*(cache.get_key("a") for _ in range(20)))
+        await cache.aclose()
+        return keys
+
+    keys = asyncio.run(run())
+    assert all(key is not None for key in keys)
+    assert server.fetches == 1
+
+
+def test_unknown_kid_refreshes_at_most_once_per_interval(server):
+    cache = _cache(min_refresh_seconds=30.0)
+
+    async def run():
+        await cache.get_key("a")
+        # `kid` inventados dentro del intervalo mínimo: sin nuevas descargas
+        unknown = [await cache.get_key(f"fake-{n}") for n in range(5)]
+        await cache.aclose()
+        return unknown
+
+    assert asyncio.run(run()) == [None] * 5
+    assert server.fetches == 1
+
+
+def test_rotated_kid_is_picked_up(server):
+    cache = _cache(min_refresh_seconds=0.0)
+
+    async def run():
+        await cache.get_key("a")
+        server.keys.append(KEY_B)
+        key = await cache.get_key("b")
+        await cache.aclose()
+        return key
+
+    assert asyncio.run(run()) is not None
+    assert server.fetches == 2
+
+
+def test_expired_keys_are_served_while_refreshing_in_background(server):
+    cache = _cache(ttl_seconds=0.0, min_refresh_seconds=0.0)
+
+    async def run():
+        await cache.get_key("a")
+        server.keys = [KEY_B]
+        # Caducadas: se devuelve la clave actual sin esperar la descarga
+        stale = await cache.get_key("a")
+        fetching = server.fetches
+        await cache.refresh()
+        fresh = await cache.get_key("b")
+        await cache.aclose()
+        return stale, fetching, fresh
+
+    stale, fetching, fresh = asyncio.run(run())
+    assert stale is not None and fresh is not None
+    assert fetching == 1
+    assert server.fetches >= 2
+
+
+@pytest.fixture
+def verifier(server, monkeypatch):
+    monkeypatch.setattr(auth, "jwks_cache", _cache())
+    monkeypatch.setattr(auth, "claims_cache", ClaimsCache(max_entries=100))
+    verified = []
+    verify = auth._verify
+
+    async def counting_verify(token):
+        verified.append(token)
+        return await verify(token)
+
+    monkeypatch.setattr(auth, "_verify", counting_verify)
+    return verified
+
+
+def test_repeated_token_is_verified_once(verifier):
+    token = _token(KEY_A)
+
+    async def run():
+        users = [await auth.get_current_user(_request(token)) for _ in range(3)]
+        await auth.jwks_cache.aclose()
+        return users
+
+    users = asyncio.run(run())
+    assert [user.id for user in users] == ["user-1"] * 3
+    assert users[0].email == "user-1@example.com"
+    assert verifier == [token]
+
+
+def test_token_signed_with_another_key_is_rejected(verifier):
+    pem_b, _ = KEY_B
+    _, public_a = KEY_A
+    forged = jwt.encode(
+        {"sub": "intruso", "exp": int(time.time()) + 3600}, pem_b, algorithm="RS256", headers={"kid": public_a["kid"]}
+    )
+
+    async def run():
+        try:
+            await auth.get_current_user(_request(forged))
+        finally:
+            await auth.jwks_cache.aclose()
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(run())
+    assert error.value.status_code == 401
+    assert len(auth.claims_cache._entries) == 0
+
+
+def test_claims_cache_expires_with_the_token_and_is_bounded():
+    cache = ClaimsCache(max_entries=2)
+    expired = AuthUser(id="old", email=None, raw={"exp": time.time() - 1})
+    cache.set("old", expired)
+    assert cache.get("old") is None
+
+    # Sin `exp` no se cachea
+    cache.set("no-exp", AuthUser(id="x", email=None, raw={}))
+    assert cache.get("no-exp") is None
+
+    users = [AuthUser(id=str(n), email=None, raw={"exp": time.time() + 60}) for n in range(3)]
+    cache.set("0", users[0])
+    cache.set("1", users[1])
+    cache.get("0")  # "1" pasa a ser la menos reciente
+    cache.set("2", users[2])
+    assert cache.get("1") is None
+    assert cache.get("0") is users[0] and cache.get("2") is users[2]
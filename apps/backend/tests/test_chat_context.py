@@ -0,0 +1,113 @@
+import asyncio
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.auth import AuthUser, get_current_user
+from app.database import get_read_db
+from app.main import app
+from app.models import Chat as ChatModel, ChatMessage as ChatMessageModel, Profile, auth_users
+from app.pagination import NEXT_CURSOR_HEADER
+from app.services.chat_context import PREVIEW_CHARS, last_message_update
+
+START = datetime(2026, 3, 2, 9, 0)
+
+
+def _seed(sync_engine, chats=1):
+    user_id = uuid4()
+    chat_ids = [uuid4() for _ in range(chats)]
+    with Session(sync_engine) as db:
+        db.execute(auth_users.insert().values(id=user_id))
+        db.add(Profile(id=user_id, email="ana@example.com"))
+        db.add_all([
+            ChatModel(id=chat_id, user_id=user_id, title=f"Chat {n}", created_at=START, updated_at=START)
+            for n, chat_id in enumerate(chat_ids)
+        ])
+        db.commit()
+    return user_id, chat_ids
+
+
+def _write(async_engine, user_id, chat_id, content, created_at):
+    """Guarda un mensaje y actualiza la proyección como lo hacen las rutas de chat"""
+    async def run():
+        async with AsyncSession(async_engine) as db:
+            message_id = uuid4()
+            message = ChatMessageModel(
+                id=message_id, chat_id=chat_id, user_id=user_id, role="user", content=content, created_at=created_at
+            )
+            db.add(message)
+            await db.flush()
+            await db.execute(last_message_update(message))
+            await db.commit()
+            return message_id
+
+    return asyncio.run(run())
+
+
+def _chat(sync_engine, chat_id):
+    with Session(sync_engine) as db:
+        return db.get(ChatModel, chat_id)
+
+
+def test_projection_follows_the_newest_message(sqlite_engines):
+    sync_engine, async_engine = sqlite_engines
+    user_id, (chat_id,) = _seed(sync_engine)
+
+    first = _write(async_engine, user_id, chat_id, "Hola", START + timedelta(minutes=1))
+    chat = _chat(sync_engine, chat_id)
+    assert (chat.last_message_id, chat.last_message_preview) == (first, "Hola")
+    assert chat.last_message_at == chat.updated_at == START + timedelta(minutes=1)
+
+    long_answer = "x" * (PREVIEW_CHARS + 20)
+    second = _write(async_engine, user_id, chat_id, long_answer, START + timedelta(minutes=2))
+    chat = _chat(sync_engine, chat_id)
+    assert chat.last_message_id == second
+    assert chat.last_message_preview == "x" * PREVIEW_CHARS + "..."
+    assert chat.updated_at == START + timedelta(minutes=2)
+
+
+def test_late_older_message_does_not_move_the_projection_back(sqlite_engines):
+    sync_engine, async_engine = sqlite_engines
+    user_id, (chat_id,) = _seed(sync_engine)
+
+    newest = _write(async_engine, user_id, chat_id, "Respuesta", START + timedelta(minutes=5))
+    _write(async_engine, user_id, chat_id, "Pregunta", START + timedelta(minutes=4))
+
+    chat = _chat(sync_engine, chat_id)
+    assert (chat.last_message_id, chat.last_message_preview) == (newest, "Respuesta")
+    assert chat.last_message_at == chat.updated_at == START + timedelta(minutes=5)
+
+
+@pytest.fixture
+def client(sqlite_engines):
+    _, async_engine = sqlite_engines
+
+    async def read_db():
+        async with AsyncSession(async_engine) as db:
+            yield db
+
+    app.dependency_overrides[get_read_db] = read_db
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def test_chat_list_pages_by_latest_activity(sqlite_engines, client):
+    sync_engine, async_engine = sqlite_engines
+    user_id, chat_ids = _seed(sync_engine, chats=3)
+    # El id va como UUID: el tipo UUID de SQLite no enlaza cadenas (Postgres sí)
+    app.dependency_overrides[get_current_user] = lambda: AuthUser(id=user_id, email=None, raw={})
+    for minutes, chat_id in zip((3, 1, 2), chat_ids):
+        _write(async_engine, user_id, chat_id, f"Mensaje {minutes}", START + timedelta(minutes=minutes))
+
+    first_page = client.get("/chats/", params={"limit": 2})
+    assert first_page.status_code == 200
+    assert [chat["last_message"] for chat in first_page.json()] == ["Mensaje 3", "Mensaje 2"]
+    assert first_page.json()[0]["id"] == str(chat_ids[0])
+
+    second_page = client.get("/chats/", params={"limit": 2, "cursor": first_page.headers[NEXT_CURSOR_HEADER]})
+    assert [chat["id"] for chat in second_page.json()] == [str(chat_ids[1])]
+    assert NEXT_CURSOR_HEADER not in second_page.headers
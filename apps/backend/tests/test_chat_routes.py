@@ -0,0 +1,64 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.auth import AuthUser, get_current_user
+from app.main import app
+from app.services import llm_client as llm_client_module
+from app.services.llm_router import LLMBackend, LLMResult, StreamChunk
+
+
+class StubBackend(LLMBackend):
+    """Backend local que responde siempre lo mismo y guarda los mensajes recibidos"""
+
+    name = model = "stub"
+
+    def __init__(self):
+        self.messages = []
+
+    async def complete(self, messages, temperature, timeout, params):
+        self.messages.append(messages)
+        return LLMResult(content="  Prueba con x = 2.  ", tokens_used=9, model=self.model, finish_reason="stop")
+
+    async def stream(self, params, timeout):
+        self.messages.append(params["messages"])
+        for delta in ("Prueba ", "con x = 2."):
+            yield StreamChunk(delta)
+        yield StreamChunk(None, finish_reason="stop", tokens_used=9)
+
+
+@pytest.fixture
+def backend(monkeypatch, tmp_path):
+    stub = StubBackend()
+    # El cliente real del proceso (get_llm_client) con el router apuntando al stub
+    monkeypatch.setattr(llm_client_module.settings, "groq_api_key", "test")
+    monkeypatch.setattr(llm_client_module.settings, "retrieval_index_dir", str(tmp_path))
+    monkeypatch.setattr(llm_client_module, "backends_from_settings", lambda http: [stub])
+    monkeypatch.setattr(llm_client_module, "_client", None)
+    monkeypatch.setattr(llm_client_module, "_client_loop", None)
+    app.dependency_overrides[get_current_user] = lambda: AuthUser(id="user-1", email=None, raw={})
+    yield stub
+    app.dependency_overrides.clear()
+
+
+def test_chat_answers_through_the_llm_client(backend):
+    response = TestClient(app).post("/chat", json={"message": "¿Cómo resuelvo 2x = 4?", "mode": "review"})
+
+    assert response.status_code == 200, response.text
+    assert response.json()["answer"] == "Prueba con x = 2."
+    system, user = backend.messages[0]
+    assert "MODO REPASO" in system["content"]
+    assert "¿Cómo resuelvo 2x = 4?" in user["content"]
+
+
+def test_chat_stream_sends_tokens_then_done(backend):
+    response = TestClient(app).post("/chat/stream", json={"message": "Hola"})
+
+    assert response.status_code == 200, response.text
+    events = [
+        (block.split("\n")[0][len("event: "):], json.loads(block.split("\n")[1][len("data: "):]))
+        for block in response.text.strip().split("\n\n")
+    ]
+    assert [name for name, _ in events] == ["token", "token", "done"]
+    assert events[-1][1] == {"answer": "Prueba con x = 2.", "tokens_used": 9}
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app import clients as clients_module
+from app.clients import ClientRegistry
+from app.services import llm_client as llm_client_module
+
+
+class FakeSession:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    created = []
+
+    def create_client(url, key, options=None):
+        # Ventana para que los hilos concurrentes coincidan en la creación
+        time.sleep(0.01)
+        client = SimpleNamespace(url=url, _storage=SimpleNamespace(session=FakeSession()), _postgrest=None)
+        created.append(client)
+        return client
+
+    monkeypatch.setattr(clients_module, "create_client", create_client)
+    monkeypatch.setattr(clients_module.settings, "supabase_url", "https://example.supabase.co")
+    monkeypatch.setattr(clients_module.settings, "supabase_service_role_key", "service-role")
+    monkeypatch.setattr(llm_client_module.settings, "groq_api_key", "test")
+    monkeypatch.setattr(llm_client_module, "_client", None)
+    monkeypatch.setattr(llm_client_module, "_client_loop", None)
+    registry = ClientRegistry()
+    monkeypatch.setattr(clients_module, "clients", registry)
+    registry.created = created
+    return registry
+
+
+def test_supabase_client_is_created_once_across_threads(registry):
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(registry.supabase())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(registry.created) == 1
+    assert all(client is registry.created[0] for client in seen)
+
+
+def test_missing_supabase_config_is_a_500(registry, monkeypatch):
+    monkeypatch.setattr(clients_module.settings, "supabase_service_role_key", "")
+
+    with pytest.raises(HTTPException) as error:
+        clients_module.get_supabase()
+    assert error.value.status_code == 500
+    assert registry.created == []
+
+
+def test_lifespan_shares_clients_and_closes_them(registry):
+    async def run():
+        await registry.startup()
+        llm = await clients_module.get_llm()
+        shared = (llm is registry.llm(), registry.ai_service() is clients_module.get_ai_service())
+        await registry.shutdown()
+        return llm, shared
+
+    llm, shared = asyncio.run(run())
+    assert shared == (True, True)
+    assert llm.http.is_closed
+    assert registry.created[0]._storage.session.closed
+    assert llm_client_module._client is None
+
+
+def test_overrides_replace_clients_until_cleared(registry, monkeypatch):
+    monkeypatch.setattr(clients_module.settings, "groq_api_key", "")
+    monkeypatch.setattr(clients_module.settings, "llm_local_base_url", "")
+    fake_llm, fake_supabase = object(), object()
+    registry.override(llm=fake_llm, supabase=fake_supabase)
+
+    assert asyncio.run(clients_module.get_llm()) is fake_llm
+    assert clients_module.get_supabase() is fake_supabase
+    assert registry.created == []
+
+    registry.clear_overrides()
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(clients_module.get_llm())
+    assert error.value.status_code == 500
@@ -0,0 +1,73 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.models import Document as DocumentModel
+from app.services import flashcard_generation as generation_module
+from app.services.flashcard_generation import (
+    ChunkText,
+    GeneratedCard,
+    deduplicate_cards,
+    generate_chunk_cards,
+    source_material,
+)
+
+
+class FakeAIService:
+    """Devuelve dos tarjetas por chunk (una inválida) y registra cuántas llamadas van a la vez"""
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+
+    async def generate_flashcards(self, text, subject_name, count):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.01 if text.endswith("0") else 0)
+        self.running -= 1
+        return [{"front": f" Pregunta {text} ", "back": "Respuesta"}, {"front": "", "back": "sin enunciado"}]
+
+
+def _chunks(n):
+    return [ChunkText(i, i + 1, i + 1, f"chunk{i}") for i in range(n)]
+
+
+def test_cards_keep_document_order_and_bound_concurrency():
+    ai = FakeAIService()
+    progress = []
+    cards = asyncio.run(generate_chunk_cards(ai, _chunks(7), "Física", 3, concurrency=2,
+                                             progress=lambda done, found: progress.append((done, found))))
+
+    assert [card.front for card in cards] == [f"Pregunta chunk{i}" for i in range(7)]
+    assert [card.chunk.chunk_index for card in cards] == list(range(7))
+    assert ai.peak == 2
+    assert progress == [(i, i) for i in range(1, 8)]
+
+
+def test_source_material_cites_pages():
+    document = DocumentModel(filename="apuntes.pdf", path="u/apuntes.pdf")
+    assert source_material(document, ChunkText(0, 3, 3, "")) == "apuntes.pdf (p. 3)"
+    assert source_material(document, ChunkText(0, 3, 5, "")) == "apuntes.pdf (pp. 3-5)"
+    assert source_material(document, ChunkText(0, None, None, "")) == "apuntes.pdf"
+    assert source_material(DocumentModel(path="u/notas.txt"), ChunkText(0, 1, None, "")) == "u/notas.txt (p. 1)"
+
+
+def test_deduplicate_against_batch_and_existing_cards(monkeypatch):
+    monkeypatch.setattr(generation_module.settings, "flashcard_duplicate_threshold", 0.6)
+    existing = ["¿Cuál es la segunda ley de Newton?"]
+    # Sesión falsa con el camino de SQLite: devuelve todas las tarjetas del usuario
+    db = SimpleNamespace(
+        get_bind=lambda: SimpleNamespace(dialect=SimpleNamespace(name="sqlite")),
+        execute=lambda query: SimpleNamespace(scalars=lambda: SimpleNamespace(all=lambda: existing)),
+    )
+    chunk = _chunks(1)[0]
+    cards = [GeneratedCard(chunk, front, "x") for front in (
+        "¿Qué enuncia la primera ley de Newton sobre la inercia?",
+        "¿Qué enuncia la primera ley de Newton sobre la inercia de un cuerpo?",
+        "¿cual es la segunda ley de newton",
+        "Define el momento lineal de una partícula",
+    )]
+
+    kept = deduplicate_cards(db, "user", cards)
+    assert [card.front for card in kept] == [cards[0].front, cards[3].front]
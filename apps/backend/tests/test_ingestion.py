@@ -0,0 +1,103 @@
+import hashlib
+import io
+import uuid
+
+from app.models import Document as DocumentModel, Task as TaskModel
+from app.services import ingestion
+from app.services.ingestion import (
+    _HashingWriter,
+    add_task_attachment,
+    attachment_document_ids,
+    chunk_pages,
+    extract_pages,
+)
+
+
+def _pages(words: int = 400):
+    text = " ".join(f"palabra{i}" for i in range(words))
+    half = len(text) // 2
+    return [(1, text[:half]), (2, text[half:])]
+
+
+def test_chunks_cover_text_and_pages():
+    chunks = list(chunk_pages(_pages(), chunk_size=500, overlap=100))
+    assert len(chunks) > 1
+    assert [c.index for c in chunks] == list(range(len(chunks)))
+    assert all(len(c.content) <= 500 for c in chunks)
+    assert chunks[0].page_start == 1 and chunks[-1].page_end == 2
+    # Sin el solapamiento, los chunks reconstruyen el texto
+    rebuilt = chunks[0].content + "".join(" " + c.content[c.overlap_chars:].lstrip() for c in chunks[1:])
+    assert rebuilt.split() == " ".join(text for _, text in _pages()).split()
+
+
+def test_overlap_not_smaller_than_chunk_size_terminates():
+    for overlap in (250, 500, 5000):
+        chunks = list(chunk_pages(_pages(), chunk_size=500, overlap=overlap))
+        assert 1 < len(chunks) < 100
+
+
+def test_empty_pages_yield_nothing():
+    assert list(chunk_pages([(1, "   "), (2, "")], chunk_size=500, overlap=100)) == []
+
+
+def test_hashing_writer_hashes_what_it_writes():
+    dest = io.BytesIO()
+    writer = _HashingWriter(dest)
+    for block in (b"abc", b"", b"def"):
+        writer.write(block)
+    assert dest.getvalue() == b"abcdef"
+    assert writer.hexdigest() == hashlib.sha256(b"abcdef").hexdigest()
+
+
+def test_attachment_document_ids_skips_legacy_entries():
+    ident = uuid.uuid4()
+    attachments = [{"document_id": str(ident)}, "https://old/url.pdf", {"url": "x"}, {"document_id": "nope"}]
+    assert attachment_document_ids(attachments) == [ident]
+    assert attachment_document_ids(None) == []
+
+
+def test_add_task_attachment_once_per_document():
+    document = DocumentModel(id=uuid.uuid4(), bucket="docs", path="u/a.pdf", filename="a.pdf", content_sha256="f" * 64)
+    task = TaskModel(attachments=["https://old/url.pdf"])
+    original = task.attachments
+
+    assert add_task_attachment(task, document) is True
+    assert add_task_attachment(task, document) is False
+    # Lista nueva (JSONB no detecta cambios en el sitio); las URLs antiguas no se conservan como refs
+    assert task.attachments is not original
+    assert attachment_document_ids(task.attachments) == [document.id]
+    assert task.attachments[0]["sha256"] == "f" * 64
+
+
+def _blank_pdf(path, pages):
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=200)
+    with open(path, "wb") as fh:
+        writer.write(fh)
+    return str(path)
+
+
+def test_pdf_extraction_is_sequential_by_default(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion, "_pdf_pool", None)
+    pdf = _blank_pdf(tmp_path / "a.pdf", 40)
+
+    assert [number for number, _ in extract_pages(pdf, "pdf")] == list(range(1, 41))
+    assert ingestion._pdf_pool is None
+
+
+def test_parallel_pdf_extraction_reuses_one_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion, "_pdf_pool", None)
+    monkeypatch.setattr(ingestion.settings, "ingest_parallel_min_pages", 4)
+    pdf = _blank_pdf(tmp_path / "a.pdf", 20)
+
+    try:
+        assert [number for number, _ in extract_pages(pdf, "pdf", workers=2)] == list(range(1, 21))
+        pool = ingestion._pdf_pool
+        assert [number for number, _ in extract_pages(pdf, "pdf", workers=2)] == list(range(1, 21))
+        assert pool is not None and ingestion._pdf_pool is pool
+    finally:
+        if ingestion._pdf_pool is not None:
+            ingestion._pdf_pool.shutdown()
@@ -0,0 +1,83 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app import worker
+from app.auth import AuthUser, get_current_user
+from app.main import app
+from app.routes import jobs
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        self.values[key] = value.encode("utf-8")
+        return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+
+class FakeTask:
+    def __init__(self, redis):
+        self.redis = redis
+        self.published = []
+
+    def apply_async(self, args, task_id):
+        # El dueño ya está registrado cuando el job llega al broker
+        assert self.redis.get(worker.JOB_OWNER_KEY + task_id) == b"u1"
+        self.published.append((args, task_id))
+        return worker.AsyncResult(task_id, app=worker.celery)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(worker, "_redis_client", lambda: fake)
+    return fake
+
+
+@pytest.fixture
+def client(monkeypatch):
+    states = {}
+    monkeypatch.setattr(jobs, "_snapshot", lambda job_id: states[job_id])
+    app.dependency_overrides[get_current_user] = lambda: AuthUser(id="u1", email=None, raw={})
+    yield TestClient(app), states
+    app.dependency_overrides.clear()
+
+
+def test_enqueue_records_the_owner_first(redis):
+    task = FakeTask(redis)
+    job = worker.enqueue_job(task, "u1", "task-id", "u1", None)
+    assert task.published == [(("task-id", "u1", None), job.id)]
+    assert worker.job_owner(job.id) == "u1"
+    assert worker.job_owner("otro") is None
+
+
+@pytest.mark.parametrize("state, info", [
+    ("FAILURE", ValueError("Task not found")),
+    ("STARTED", {"pid": 1, "hostname": "worker"}),
+    ("PROGRESS", {"user_id": "u1", "stage": "extracting"}),
+    ("PENDING", None),
+])
+def test_jobs_of_other_users_are_not_found(redis, client, state, info):
+    http, states = client
+    states["j1"] = (state, info)
+    redis.set(worker.JOB_OWNER_KEY + "j1", "u2")
+
+    assert http.get("/jobs/j1").status_code == 404
+    assert http.get("/jobs/j1/events").status_code == 404
+    # Sin dueño registrado (id inventado o caducado) tampoco
+    states["j2"] = (state, info)
+    assert http.get("/jobs/j2").status_code == 404
+
+
+def test_owner_sees_failed_job(redis, client):
+    http, states = client
+    states["j1"] = ("FAILURE", ValueError("Task not found"))
+    redis.set(worker.JOB_OWNER_KEY + "j1", "u1")
+
+    response = http.get("/jobs/j1")
+    assert response.status_code == 200
+    assert response.json()["state"] == "FAILURE" and response.json()["error"] == "Task not found"
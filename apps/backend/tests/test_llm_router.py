@@ -0,0 +1,178 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.services import llm_router as router_module
+from app.services.llm_router import (
+    BackendHealth,
+    LLMBackend,
+    LLMResult,
+    LLMRouter,
+    LLMUnavailableError,
+    OpenAICompatibleBackend,
+    StreamChunk,
+)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FakeBackend(LLMBackend):
+    def __init__(self, name, delay=0.0, error=None):
+        self.name = self.model = name
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def complete(self, messages, temperature, timeout, params):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return LLMResult(content=self.name, tokens_used=1, model=self.name, finish_reason="stop")
+
+    async def stream(self, params, timeout):
+        if self.error:
+            raise self.error
+        for delta in ("ho", "la"):
+            yield StreamChunk(delta)
+
+
+def _router(backends, **options):
+    defaults = dict(
+        ewma_alpha=0.2, latency_window=50, failure_threshold=2, cooldown=60.0, degraded_error_rate=0.5,
+        degraded_latency=0.0, hedge_enabled=False, hedge_quantile=0.95, hedge_min_samples=5,
+        hedge_min_delay=0.01, hedge_budget=1.0,
+    )
+    return LLMRouter(backends, **{**defaults, **options})
+
+
+def _complete(router, **kwargs):
+    return asyncio.run(router.complete([{"role": "user", "content": "hola"}], 0.2, 5, {}, **kwargs))
+
+
+# =====================================================
+# CIRCUIT BREAKER
+# =====================================================
+
+def test_circuit_opens_probes_and_closes(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(router_module.time, "monotonic", lambda: now[0])
+    health = BackendHealth(alpha=0.5, window=10, failure_threshold=2, cooldown=30)
+
+    health.record_failure()
+    assert health.state == "closed"
+    health.record_failure()
+    assert health.state == "open" and not health.available(now[0] + 29)
+
+    now[0] += 30
+    assert health.begin(now[0]) and health.state == "half_open"
+    # Solo una prueba por cooldown
+    assert not health.begin(now[0] + 1)
+    health.record_failure()
+    assert health.state == "open"
+
+    now[0] += 30
+    assert health.begin(now[0])
+    health.record_success(0.4)
+    assert health.state == "closed" and health.consecutive_failures == 0
+    assert health.latency_ewma == 0.4
+
+
+def test_latency_quantile_and_expected_latency():
+    health = BackendHealth(alpha=0.5, window=4, failure_threshold=3, cooldown=1)
+    assert health.quantile(0.95) is None
+    for latency in (1.0, 2.0, 3.0, 4.0, 5.0):
+        health.record_latency(latency)
+    assert list(health.latencies) == [2.0, 3.0, 4.0, 5.0]
+    assert health.quantile(0.5) == 4.0
+    health.record_failure()
+    assert health.expected_latency() == pytest.approx(health.latency_ewma / 0.5)
+
+
+# =====================================================
+# ROUTER
+# =====================================================
+
+def test_falls_back_and_skips_open_circuits():
+    broken, backup = FakeBackend("a", error=StatusError(503)), FakeBackend("b")
+    router = _router([broken, backup])
+
+    assert [_complete(router).model for _ in range(3)] == ["b", "b", "b"]
+    assert broken.calls == 2
+    assert router.health["a"].state == "open"
+    assert [b.name for b in router.ranked()] == ["b"]
+    assert router.stats()["fallbacks"] == 2
+
+
+def test_request_errors_do_not_fall_back_or_open_the_circuit():
+    bad_request, backup = FakeBackend("a", error=StatusError(400)), FakeBackend("b")
+    router = _router([bad_request, backup], failure_threshold=1)
+
+    with pytest.raises(StatusError):
+        _complete(router)
+    assert backup.calls == 0
+    assert router.health["a"].state == "closed"
+
+
+def test_all_circuits_open_is_unavailable():
+    router = _router([FakeBackend("a", error=StatusError(500))], failure_threshold=1)
+    with pytest.raises(StatusError):
+        _complete(router)
+    with pytest.raises(LLMUnavailableError):
+        _complete(router)
+    with pytest.raises(LLMUnavailableError):
+        _complete(router, model="otro")
+
+
+def test_hedge_wins_and_lost_attempt_is_not_recorded():
+    slow, fast = FakeBackend("slow", delay=0.5), FakeBackend("fast")
+    router = _router([slow, fast], hedge_enabled=True)
+    for _ in range(5):
+        router.health["slow"].record_latency(0.01)
+
+    assert _complete(router).model == "fast"
+    stats = router.stats()
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+    # El intento cancelado no cuenta como latencia ni como fallo del backend lento
+    assert len(router.health["slow"].latencies) == 5
+    assert router.health["slow"].consecutive_failures == 0
+
+
+def test_stream_falls_back_before_the_first_chunk():
+    router = _router([FakeBackend("a", error=StatusError(429)), FakeBackend("b")])
+
+    async def run():
+        backend, chunks = await router.open_stream({}, 5)
+        return backend.name, [chunk.delta async for chunk in chunks]
+
+    assert asyncio.run(run()) == ("b", ["ho", "la"])
+    assert router.health["a"].consecutive_failures == 1
+
+
+def test_local_backend_requests_stream_usage():
+    bodies = []
+
+    def handler(request):
+        bodies.append(json.loads(request.content))
+        return httpx.Response(200, text=(
+            'data: {"choices":[{"delta":{"content":"ho"}}]}\n\n'
+            'data: {"choices":[{"delta":{"content":"la"},"finish_reason":"stop"}]}\n\n'
+            'data: {"choices":[],"usage":{"total_tokens":7}}\n\n'
+            "data: [DONE]\n\n"
+        ))
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            backend = OpenAICompatibleBackend(http, "http://localhost:11434/v1/", "qwen")
+            return [chunk async for chunk in backend.stream({"messages": []}, 5)]
+
+    chunks = asyncio.run(run())
+    assert bodies[0]["stream_options"] == {"include_usage": True}
+    assert "".join(c.delta or "" for c in chunks) == "hola"
+    assert chunks[-1].tokens_used == 7
@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime
+from uuid import UUID, uuid4
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import Column, Integer, MetaData, String, Table, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.pagination import KeyColumn, decode_cursor, encode_cursor, paginate
+
+
+def test_cursor_round_trip():
+    moment = datetime(2026, 3, 1, 12, 30)
+    ident = uuid4()
+    cursor = encode_cursor("n", moment, ident, None)
+    assert "=" not in cursor
+    assert decode_cursor(cursor, [str, datetime.fromisoformat, UUID, int]) == ["n", moment, ident, None]
+
+
+@pytest.mark.parametrize("cursor", [
+    "no-es-base64!",
+    encode_cursor("n"),       # faltan valores
+    encode_cursor("n", "x"),  # el valor no convierte al tipo
+    "e30",                    # JSON que no es una lista
+])
+def test_invalid_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, [str, int])
+    assert error.value.status_code == 400
+
+
+# Tabla mínima para recorrer páginas en ambos sentidos con NULLs al final
+metadata = MetaData()
+rows = Table(
+    "rows", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("due", String, nullable=True),
+)
+KEYS = [KeyColumn(rows.c.due, nullable=True), KeyColumn(rows.c.id)]
+
+
+def _walk():
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(metadata.create_all)
+            await conn.execute(insert(rows), [
+                {"id": i, "due": None if i % 3 == 0 else f"2026-01-{10 - i % 4:02d}"} for i in range(1, 11)
+            ])
+        forward, backward = [], []
+        async with AsyncSession(engine) as db:
+            query = select(rows.c.id)
+            cursor, last = None, None
+            while True:
+                page = await paginate(db, query, KEYS, lambda id_: key_of[id_], cursor, 3)
+                forward.append(list(page.items))
+                last = page
+                if not page.next_cursor:
+                    break
+                cursor = page.next_cursor
+            cursor = last.prev_cursor
+            while cursor:
+                page = await paginate(db, query, KEYS, lambda id_: key_of[id_], cursor, 3)
+                backward.append(list(page.items))
+                cursor = page.prev_cursor
+        await engine.dispose()
+        return forward, backward
+
+    key_of = {i: (None if i % 3 == 0 else f"2026-01-{10 - i % 4:02d}", i) for i in range(1, 11)}
+    expected = sorted(key_of, key=lambda i: (key_of[i][0] is None, key_of[i][0] or "", i))
+    return asyncio.run(run()), expected
+
+
+def test_paginate_walks_forward_and_back_without_gaps():
+    (forward, backward), expected = _walk()
+    assert [i for page in forward for i in page] == expected
+    assert [page for page in reversed(backward)] == forward[:-1]
@@ -0,0 +1,77 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import ai_service as ai_module
+from app.services.ai_service import QUIZ_FOCUS, AIService
+from app.services.similarity import NearDuplicateFilter, jaccard, normalize_text, shingle_hashes
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(ai_module.settings, "quiz_batch_size", 5)
+    monkeypatch.setattr(ai_module.settings, "ai_cache_enabled", False)
+    return AIService(llm=lambda: SimpleNamespace(model="fake"))
+
+
+def test_small_quiz_is_a_single_mixed_batch(service):
+    assert service._plan_quiz_batches(4, None, None) == [(4, None, None)]
+
+
+@pytest.mark.parametrize("num_questions", [6, 12, 23, 40])
+def test_batches_add_up_and_respect_batch_size(service, num_questions):
+    batches = service._plan_quiz_batches(num_questions, None, None)
+    assert sum(count for count, _, _ in batches) == num_questions
+    assert all(1 <= count <= 5 for count, _, _ in batches)
+    by_type = {}
+    for count, types, _ in batches:
+        by_type[types[0]] = by_type.get(types[0], 0) + count
+    # Reparto 60/20/20 con restos mayores
+    assert by_type["multiple_choice"] == pytest.approx(num_questions * 0.6, abs=1)
+
+
+def test_batches_are_balanced_and_rotate_focus(service):
+    batches = service._plan_quiz_batches(6, None, ["short_answer"], offset=2)
+    assert batches == [(3, ["short_answer"], QUIZ_FOCUS[2]), (3, ["short_answer"], QUIZ_FOCUS[3])]
+
+    batches = service._plan_quiz_batches(10, ["límites", "derivadas"], ["true_false"])
+    assert [focus for _, _, focus in batches] == ["límites", "derivadas"]
+
+
+def test_near_duplicate_filter():
+    assert normalize_text("¿Qué es la Derivada?") == "que es la derivada"
+    unique = NearDuplicateFilter(threshold=0.6)
+    assert unique.add("¿Qué es la derivada de una función en un punto?")
+    assert not unique.add("¿Qué es la derivada de una función en un punto dado?")
+    assert not unique.add("que es la DERIVADA de una funcion en un punto")
+    assert unique.add("¿Cuál es la integral de una constante?")
+    assert not unique.add("   ?!  ")
+
+
+def test_short_texts_and_empty_sets():
+    assert len(shingle_hashes("hola mundo")) == 1
+    assert shingle_hashes("") == frozenset()
+    assert jaccard(frozenset(), frozenset([1])) == 0.0
+
+
+def test_generate_quiz_drops_repeats_and_tops_up(service, monkeypatch):
+    calls = []
+
+    async def fake_batch(subject, topic, difficulty, count, types, focus, avoid=None):
+        calls.append((count, list(avoid)))
+        # El primer lote repite la misma pregunta
+        if len(calls) == 1:
+            return [{"question": "¿Qué es un vector propio de una matriz?"}] * count
+        return [{"question": text} for text in ["¿Cómo se calcula el polinomio característico?",
+                                                "Enuncia el teorema espectral para matrices simétricas"][:count]]
+
+    monkeypatch.setattr(service, "_generate_quiz_batch", fake_batch)
+    questions = asyncio.run(service.generate_quiz_questions("Álgebra", "autovalores", num_questions=3))
+
+    assert len(questions) == 3
+    assert len({q["question"] for q in questions}) == 3
+    # La segunda ronda solo pide lo que faltó y evita lo ya aceptado
+    assert calls[0][0] == 3
+    assert sum(count for count, _ in calls[1:]) == 2
+    assert "¿Qué es un vector propio de una matriz?" in calls[1][1]
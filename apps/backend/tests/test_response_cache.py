@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from app.services import response_cache as cache_module
+from app.services.response_cache import ResponseCache
+
+
+@pytest.fixture(autouse=True)
+def cache_enabled(monkeypatch):
+    monkeypatch.setattr(cache_module.settings, "ai_cache_enabled", True)
+
+
+def test_make_key_ignores_whitespace_changes():
+    a = ResponseCache.make_key("quiz", "m", {"topic": "Álgebra  lineal\n"}, {"temperature": 0.7})
+    b = ResponseCache.make_key("quiz", "m", {"topic": "Álgebra lineal"}, {"temperature": 0.7})
+    assert a == b
+
+
+def test_make_key_depends_on_model_params_and_kind():
+    base = ResponseCache.make_key("quiz", "m", {"topic": "x"}, {"temperature": 0.7})
+    assert base != ResponseCache.make_key("quiz", "other", {"topic": "x"}, {"temperature": 0.7})
+    assert base != ResponseCache.make_key("quiz", "m", {"topic": "x"}, {"temperature": 0.2})
+    assert base != ResponseCache.make_key("flashcards", "m", {"topic": "x"}, {"temperature": 0.7})
+
+
+def test_get_returns_a_copy():
+    cache = ResponseCache(max_entries=10, ttl_seconds=60)
+
+    async def run():
+        await cache.set("k", {"items": [1]})
+        first = await cache.get("k")
+        first["items"].append(2)
+        return await cache.get("k")
+
+    assert asyncio.run(run()) == {"items": [1]}
+
+
+def test_lru_eviction_and_stats():
+    cache = ResponseCache(max_entries=2, ttl_seconds=60)
+
+    async def run():
+        await cache.set("a", 1)
+        await cache.set("b", 2)
+        await cache.get("a")  # "a" pasa a ser la más reciente
+        await cache.set("c", 3)
+        return [await cache.get(k) for k in ("a", "b", "c")]
+
+    assert asyncio.run(run()) == [1, None, 3]
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["size"] == 2 and stats["misses"] == 1
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    cache = ResponseCache(max_entries=10, ttl_seconds=10)
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+
+    async def run():
+        await cache.set("k", "v")
+        now[0] += 11
+        return await cache.get("k")
+
+    assert asyncio.run(run()) is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_disabled_cache_stores_nothing(monkeypatch):
+    monkeypatch.setattr(cache_module.settings, "ai_cache_enabled", False)
+    cache = ResponseCache(max_entries=10, ttl_seconds=60)
+
+    async def run():
+        await cache.set("k", "v")
+        return await cache.get("k")
+
+    assert asyncio.run(run()) is None
@@ -0,0 +1,95 @@
+import gc
+import itertools
+import weakref
+
+import pytest
+
+from app.services import retrieval
+from app.services.retrieval import _term_hash, build_user_index, load_user_index, search, tokenize
+
+ENTRIES = [
+    ("La matriz inversa existe si el determinante no es cero.",
+     {"source": "document", "source_id": "d1", "title": "algebra.pdf", "task_id": None, "page_start": 3, "page_end": 3}),
+    ("Derivadas parciales y gradiente de una función de varias variables.",
+     {"source": "document", "source_id": "d2", "title": "calculo.pdf", "task_id": None, "page_start": 1, "page_end": 2}),
+    ("Entregar ejercicios de matriz y determinante. Repasar la regla de Cramer.",
+     {"source": "task", "source_id": "t1", "title": "Tarea: Álgebra", "task_id": "t1"}),
+    ("¿Qué es el gradiente?\nEl vector de derivadas parciales.",
+     {"source": "flashcard", "source_id": "f1", "title": "Flashcard", "task_id": None}),
+]
+
+
+@pytest.fixture
+def index_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(retrieval.settings, "retrieval_index_dir", str(tmp_path))
+    monkeypatch.setattr(retrieval.settings, "retrieval_dense_enabled", False)
+    monkeypatch.setattr(retrieval, "_iter_entries", lambda db, user_id: iter(ENTRIES))
+    retrieval._indexes.clear()
+    yield tmp_path
+    retrieval._indexes.clear()
+
+
+def _ids(passages):
+    return [p.source_id for p in passages]
+
+
+def test_bm25_ranks_matching_entries(index_dir):
+    assert build_user_index(None, "u1") == len(ENTRIES)
+    assert _ids(search("u1", "matriz determinante")) == ["d1", "t1"]
+    assert _ids(search("u1", "gradiente derivadas parciales"))[:2] in (["f1", "d2"], ["d2", "f1"])
+    assert search("u1", "fotosíntesis") == []
+    assert search("otro", "matriz") == []
+
+
+def test_unknown_terms_do_not_hide_known_ones(index_dir):
+    build_user_index(None, "u1")
+    index = load_user_index("u1")
+    # Términos con hash mayor que todo el vocabulario (searchsorted devuelve len)
+    top = int(index.term_hashes.max())
+    unknown = list(itertools.islice((f"zz{i}" for i in itertools.count() if _term_hash(f"zz{i}") > top), 10))
+
+    scores = index.bm25(unknown + ["matriz"])
+    assert scores[0] > 0 and scores[2] > 0
+    assert list(scores) == list(index.bm25(["matriz"]))
+
+
+def test_task_boost_and_passage_fields(index_dir, monkeypatch):
+    monkeypatch.setattr(retrieval.settings, "retrieval_task_boost", 10.0)
+    build_user_index(None, "u1")
+
+    passages = search("u1", "matriz determinante", task_id="t1")
+    assert _ids(passages) == ["t1", "d1"]
+    assert passages[1].citation() == "algebra.pdf, pág. 3"
+    assert passages[1].text == ENTRIES[0][0]
+
+
+def test_rebuild_publishes_a_new_version(index_dir, monkeypatch):
+    build_user_index(None, "u1")
+    assert _ids(search("u1", "cramer")) == ["t1"]
+
+    monkeypatch.setattr(retrieval, "_iter_entries", lambda db, user_id: iter(ENTRIES[:2]))
+    build_user_index(None, "u1")
+    assert search("u1", "cramer") == []
+
+
+def test_tokenize_folds_accents_and_drops_stopwords():
+    assert tokenize("La Función de Álgebra y el 2") == ["funcion", "algebra"]
+
+
+def test_open_indexes_are_bounded(index_dir, monkeypatch):
+    monkeypatch.setattr(retrieval.settings, "retrieval_index_cache_size", 2)
+    for user in ("u1", "u2", "u3"):
+        build_user_index(None, user)
+
+    first = weakref.ref(load_user_index("u1"))
+    load_user_index("u2")
+    assert load_user_index("u1") is first()  # sigue en caché y pasa a ser el más reciente
+    load_user_index("u3")
+
+    assert list(retrieval._indexes) == ["u1", "u3"]
+    evicted = weakref.ref(retrieval._indexes["u1"][1])
+    load_user_index("u2")
+    gc.collect()
+    # El índice expulsado (y sus mmaps) ya no queda referenciado
+    assert evicted() is None
+    assert _ids(search("u1", "matriz")) == ["d1", "t1"]
@@ -0,0 +1,53 @@
+import numpy as np
+
+from app.services.question_bank import bank_key, question_hash
+from app.services.similarity import (
+    MINHASH_PERMUTATIONS,
+    jaccard,
+    minhash_signature,
+    minhash_similarity,
+    shingle_hashes,
+)
+
+BASE = "explica la diferencia entre memoria cache memoria principal y almacenamiento secundario en un computador moderno"
+
+
+def test_minhash_is_stable_and_fixed_length():
+    signature = minhash_signature(BASE)
+    assert signature.shape == (MINHASH_PERMUTATIONS,)
+    assert signature.dtype == np.uint64
+    # Las firmas se guardan en la base de datos: deben ser iguales entre procesos y con otra forma del texto
+    assert np.array_equal(signature, minhash_signature("Explica la diferencia entre memoria caché, memoria principal "
+                                                       "y almacenamiento secundario en un computador moderno."))
+
+
+def test_minhash_similarity_estimates_jaccard():
+    variants = [
+        BASE,
+        BASE.replace("moderno", "actual"),
+        BASE.replace("cache", "registro").replace("secundario", "terciario"),
+        "cual es la capital de francia y cuando se fundo la ciudad",
+    ]
+    signatures = np.vstack([minhash_signature(text) for text in variants])
+    estimated = minhash_similarity(minhash_signature(BASE), signatures)
+    exact = [jaccard(shingle_hashes(BASE), shingle_hashes(text)) for text in variants]
+
+    assert estimated[0] == 1.0
+    assert np.allclose(estimated, exact, atol=0.2)
+    assert estimated[1] > estimated[2] > estimated[3]
+
+
+def test_minhash_similarity_with_no_signatures():
+    assert minhash_similarity(minhash_signature(BASE), np.empty((0, MINHASH_PERMUTATIONS), dtype=np.uint64)).shape == (0,)
+
+
+def test_empty_text_matches_nothing_real():
+    empty = minhash_signature("  ¿? ")
+    assert minhash_similarity(empty, minhash_signature(BASE)[None, :])[0] == 0.0
+
+
+def test_bank_key_and_question_hash_ignore_formatting():
+    assert bank_key("Cálculo I", "Límites  laterales", 3) == bank_key("calculo i", "limites laterales!", 3.0)
+    assert bank_key("Cálculo I", "Límites", 3) != bank_key("Cálculo I", "Límites", 4)
+    assert question_hash("¿Qué es un límite?") == question_hash("que es un LIMITE")
+    assert question_hash("¿Qué es un límite?") != question_hash("¿Qué es una derivada?")
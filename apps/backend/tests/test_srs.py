@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from app.services.srs import SRSState, _occurrence_rounds, recall_probability, simulate_review_load, sm2_step
+
+
+def _sm2_reference(easiness, interval, repetitions, grade):
+    """SM-2 clásico, tarjeta a tarjeta"""
+    if grade < 3:
+        return easiness, 1, 0
+    easiness = max(1.3, easiness + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    repetitions += 1
+    if repetitions == 1:
+        interval = 1
+    elif repetitions == 2:
+        interval = 6
+    else:
+        interval = int(round(max(interval, 1) * easiness))
+    return easiness, interval, repetitions
+
+
+def test_sm2_step_matches_the_scalar_algorithm():
+    rng = np.random.default_rng(7)
+    n = 500
+    state = SRSState(
+        easiness=rng.uniform(1.3, 3.0, n),
+        interval=rng.integers(1, 60, n),
+        repetitions=rng.integers(0, 6, n),
+    )
+    grades = rng.integers(0, 6, n)
+    step = sm2_step(state, grades)
+
+    for i in range(n):
+        easiness, interval, repetitions = _sm2_reference(
+            state.easiness[i], int(state.interval[i]), int(state.repetitions[i]), int(grades[i])
+        )
+        assert step.easiness[i] == pytest.approx(easiness)
+        assert step.interval[i] == interval
+        assert step.repetitions[i] == repetitions
+
+
+def test_sm2_step_sequence_for_one_card():
+    state = SRSState(np.array([2.5]), np.array([1]), np.array([0]))
+    intervals = []
+    for grade in (5, 5, 5, 2, 4):
+        state = sm2_step(state, np.array([grade]))
+        intervals.append(int(state.interval[0]))
+    assert intervals == [1, 6, 17, 1, 1]
+    assert state.repetitions[0] == 1
+    assert state.easiness[0] == pytest.approx(2.8)
+
+
+def test_easiness_never_drops_below_minimum():
+    state = SRSState(np.array([1.3]), np.array([10]), np.array([4]))
+    step = sm2_step(state, np.array([3]))
+    assert step.easiness[0] == pytest.approx(1.3)
+    assert step.interval[0] == 13
+
+
+def test_occurrence_rounds_orders_repeated_cards():
+    assert _occurrence_rounds(np.array([2, 0, 2, 1, 2, 0])).tolist() == [0, 0, 1, 0, 2, 1]
+    assert _occurrence_rounds(np.array([], dtype=np.int64)).tolist() == []
+
+
+# =====================================================
+# PREVISIÓN DE CARGA
+# =====================================================
+
+def _deck(n):
+    return SRSState(easiness=np.full(n, 2.5), interval=np.ones(n, dtype=np.int64), repetitions=np.zeros(n, dtype=np.int64))
+
+
+def test_recall_probability_is_smoothed_and_clipped():
+    p = recall_probability(np.array([0, 10, 0, 1000]), np.array([0, 0, 10, 0]))
+    # Una tarjeta nueva toma el promedio del usuario
+    assert p[0] == pytest.approx((1010 + 1) / (1020 + 2))
+    assert p[2] < p[0] < p[1]
+    assert p[3] == pytest.approx(0.99)
+    assert np.all((p >= 0.05) & (p <= 0.99))
+
+
+def test_simulation_shape_and_seeded_determinism():
+    state = _deck(20)
+    due = np.arange(20) - 5
+    recall = np.full(20, 0.8)
+    a = simulate_review_load(state, due, recall, days=30, simulations=50, rng=np.random.default_rng(1))
+    b = simulate_review_load(state, due, recall, days=30, simulations=50, rng=np.random.default_rng(1))
+    assert a.shape == (50, 30)
+    assert np.array_equal(a, b)
+
+
+def test_first_reviews_land_on_their_due_day():
+    # Con acierto seguro: repaso el día due, luego +1 y luego +6 (atrasadas cuentan hoy)
+    state = _deck(3)
+    counts = simulate_review_load(
+        state, np.array([-3, 0, 4]), np.full(3, 1.0), days=10, simulations=4, rng=np.random.default_rng(0)
+    )
+    expected = np.zeros(10, dtype=np.int64)
+    for due in (0, 0, 4):
+        for day in (due, due + 1, due + 7):
+            if day < 10:
+                expected[day] += 1
+    assert (counts == expected).all()
+
+
+def test_failed_cards_come_back_every_day():
+    counts = simulate_review_load(
+        _deck(5), np.zeros(5, dtype=np.int64), np.full(5, 1e-12), days=7, simulations=3, rng=np.random.default_rng(0)
+    )
+    assert (counts == 5).all()
+
+
+def test_empty_deck_or_horizon():
+    assert simulate_review_load(_deck(0), np.array([], dtype=np.int64), np.array([]), 5, 2).shape == (2, 5)
+    assert simulate_review_load(_deck(2), np.zeros(2, dtype=np.int64), np.ones(2), 0, 2).shape == (2, 0)
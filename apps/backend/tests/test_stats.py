@@ -0,0 +1,250 @@
+import asyncio
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models import Profile, Subject as SubjectModel, Task as TaskModel, TaskCounter, auth_users
+from app.services import stats
+from app.services.stats import NO_SUBJECT, TaskState, apply_task_change, reconcile_user_counters
+
+COUNTER_FIELDS = ("total_tasks", "completed_tasks", "pending_tasks", "overdue_tasks")
+
+
+@pytest.fixture
+def databases(sqlite_engines, monkeypatch):
+    # Sin broker: la lectura sin inicializar no debe intentar encolar la reconciliación
+    monkeypatch.setattr(stats, "_schedule_reconcile", lambda user_id: None)
+    return sqlite_engines
+
+
+def _seed(sync_engine):
+    user_id, math, physics = uuid4(), uuid4(), uuid4()
+    with Session(sync_engine) as db:
+        db.execute(auth_users.insert().values(id=user_id))
+        db.add(Profile(id=user_id, email=f"{user_id}@example.com"))
+        db.add_all([
+            SubjectModel(id=math, user_id=user_id, name="Matemáticas"),
+            SubjectModel(id=physics, user_id=user_id, name="Física"),
+        ])
+        db.commit()
+    return user_id, math, physics
+
+
+def _task(user_id, **fields):
+    return TaskModel(id=uuid4(), user_id=user_id, title="Tarea", **fields)
+
+
+def _reconcile(sync_engine, user_id):
+    with Session(sync_engine) as db:
+        reconcile_user_counters(db, user_id)
+        db.commit()
+
+
+def _counters(sync_engine, user_id):
+    with Session(sync_engine) as db:
+        rows = db.execute(select(TaskCounter).where(TaskCounter.user_id == user_id)).scalars()
+        # Las filas que los deltas dejan a cero equivalen a no tener fila
+        return {
+            row.subject_key: tuple(getattr(row, field) for field in COUNTER_FIELDS)
+            for row in rows
+            if row.total_tasks or row.subject_key == NO_SUBJECT
+        }
+
+
+async def _direct_overview(db, user_id):
+    now = datetime.utcnow()
+    row = (await db.execute(select(*stats._aggregates(now)).where(TaskModel.user_id == user_id))).one()
+    return stats._as_stats(row)
+
+
+async def _direct_subjects(db, user_id):
+    now = datetime.utcnow()
+    rows = (await db.execute(
+        select(SubjectModel.id, SubjectModel.name, *stats._aggregates(now))
+        .outerjoin(TaskModel, TaskModel.subject_id == SubjectModel.id)
+        .where(SubjectModel.user_id == user_id)
+        .group_by(SubjectModel.id, SubjectModel.name)
+        .order_by(SubjectModel.name)
+    )).all()
+    return [{"subject_id": str(row.id), "subject_name": row.name, **stats._as_stats(row)} for row in rows]
+
+
+async def _create(db, user_id, **fields):
+    task = _task(user_id, **fields)
+    db.add(task)
+    await db.flush()
+    await apply_task_change(db, user_id, None, TaskState.of(task))
+    await db.commit()
+    return task
+
+
+async def _update(db, user_id, task, **changes):
+    previous_state = TaskState.of(task)
+    for field, value in changes.items():
+        setattr(task, field, value)
+    await apply_task_change(db, user_id, previous_state, TaskState.of(task))
+    await db.commit()
+
+
+async def _delete(db, user_id, task):
+    await apply_task_change(db, user_id, TaskState.of(task), None)
+    await db.delete(task)
+    await db.commit()
+
+
+def test_deltas_match_reconciliation_and_direct_aggregate(databases):
+    sync_engine, async_engine = databases
+    user_id, math, physics = _seed(sync_engine)
+    now = datetime.utcnow()
+    past, future = now - timedelta(days=3), now + timedelta(days=3)
+
+    # Tareas previas a la primera reconciliación
+    with Session(sync_engine) as db:
+        db.add_all([
+            _task(user_id, subject_id=math, status="pending", due_date=past),
+            _task(user_id, subject_id=math, status="completed", due_date=past),
+            _task(user_id, status="in_progress", due_date=future),
+        ])
+        db.commit()
+    _reconcile(sync_engine, user_id)
+
+    async def changes():
+        async with AsyncSession(async_engine, expire_on_commit=False) as db:
+            homework = await _create(db, user_id, subject_id=math, status="pending", due_date=future)
+            lab = await _create(db, user_id, subject_id=physics, status="pending", due_date=past)
+            essay = await _create(db, user_id, status="pending")
+            await _update(db, user_id, homework, status="completed")
+            await _update(db, user_id, homework, status="in_progress", due_date=past)
+            await _update(db, user_id, lab, subject_id=math)
+            await _update(db, user_id, lab, subject_id=None, due_date=future)
+            await _update(db, user_id, essay, subject_id=physics, status="cancelled")
+            await _update(db, user_id, essay, title="Sin efecto en los contadores")
+            await _delete(db, user_id, homework)
+            await _create(db, user_id, subject_id=physics, status="in_progress", due_date=past)
+            return await stats.task_overview(db, user_id), await stats.subject_stats(db, user_id)
+
+    overview, by_subject = asyncio.run(changes())
+    incremental = _counters(sync_engine, user_id)
+
+    _reconcile(sync_engine, user_id)
+    assert incremental == _counters(sync_engine, user_id)
+
+    async def direct():
+        async with AsyncSession(async_engine) as db:
+            return await _direct_overview(db, user_id), await _direct_subjects(db, user_id)
+
+    direct_overview, direct_by_subject = asyncio.run(direct())
+    assert overview == direct_overview
+    assert by_subject == direct_by_subject
+    assert overview["total_tasks"] == 6
+    assert overview["overdue_tasks"] == 2
+
+
+def test_tasks_falling_due_after_reconcile_count_as_overdue(databases):
+    sync_engine, async_engine = databases
+    user_id, math, _ = _seed(sync_engine)
+    now = datetime.utcnow()
+    reconciled_at = now - timedelta(hours=2)
+
+    with Session(sync_engine) as db:
+        db.add(_task(user_id, subject_id=math, status="pending", due_date=now - timedelta(hours=1)))
+        db.commit()
+    _reconcile(sync_engine, user_id)
+    # Simula una reconciliación hecha antes de que la tarea venciera
+    with Session(sync_engine) as db:
+        db.execute(update(TaskCounter).values(overdue_as_of=reconciled_at, overdue_tasks=0))
+        db.commit()
+
+    async def run():
+        async with AsyncSession(async_engine, expire_on_commit=False) as db:
+            before = await stats.task_overview(db, user_id)
+            task = (await db.execute(select(TaskModel).where(TaskModel.user_id == user_id))).scalar_one()
+            # Completarla no debe restar una vencida que el contador nunca sumó
+            await _update(db, user_id, task, status="completed")
+            return before, await stats.task_overview(db, user_id), await _direct_overview(db, user_id)
+
+    before, after, direct = asyncio.run(run())
+    assert before["overdue_tasks"] == 1
+    assert after == direct
+    assert after["overdue_tasks"] == 0
+    assert _counters(sync_engine, user_id)[math][3] == 0
+
+
+def test_uninitialized_user_reads_the_direct_aggregate(databases, monkeypatch):
+    sync_engine, async_engine = databases
+    user_id, math, _ = _seed(sync_engine)
+    scheduled = []
+    monkeypatch.setattr(stats, "_schedule_reconcile", scheduled.append)
+
+    async def run():
+        async with AsyncSession(async_engine, expire_on_commit=False) as db:
+            # Deltas sin reconciliación previa: no hay fila NO_SUBJECT reconciliada
+            await _create(db, user_id, subject_id=math, status="completed")
+            await _create(db, user_id, subject_id=math, status="pending", due_date=datetime.utcnow() - timedelta(days=1))
+            return await stats.task_overview(db, user_id), await _direct_overview(db, user_id)
+
+    overview, direct = asyncio.run(run())
+    assert overview == direct
+    assert overview["completion_rate"] == 50
+    assert scheduled == [user_id]
+
+
+def _expected(tasks, now):
+    """Los mismos contadores calculados tarea a tarea"""
+    total = len(tasks)
+    completed = sum(1 for task in tasks if task["status"] == "completed")
+    open_tasks = [task for task in tasks if task["status"] in stats.OPEN_STATUSES]
+    return {
+        "total_tasks": total,
+        "completed_tasks": completed,
+        "pending_tasks": len(open_tasks),
+        "overdue_tasks": sum(1 for task in open_tasks if task.get("due_date") and task["due_date"] < now),
+        "completion_rate": (completed / total * 100) if total > 0 else 0,
+    }
+
+
+def test_single_pass_aggregate_matches_counting_task_by_task(databases):
+    sync_engine, async_engine = databases
+    user_id, math, physics = _seed(sync_engine)
+    other_user, other_subject, _ = _seed(sync_engine)
+    now = datetime.utcnow()
+    past, future = now - timedelta(days=1), now + timedelta(days=1)
+
+    math_tasks = [
+        {"status": "pending", "due_date": past},
+        {"status": "in_progress", "due_date": future},
+        {"status": "in_progress", "due_date": past},
+        {"status": "completed", "due_date": past},
+        {"status": "cancelled", "due_date": past},
+        {"status": "pending"},
+    ]
+    loose_tasks = [{"status": "completed"}, {"status": "pending", "due_date": past}]
+    with Session(sync_engine) as db:
+        db.add_all([_task(user_id, subject_id=math, **fields) for fields in math_tasks])
+        db.add_all([_task(user_id, **fields) for fields in loose_tasks])
+        # Las tareas de otro usuario no cuentan
+        db.add_all([_task(other_user, subject_id=other_subject, status="pending", due_date=past)])
+        db.commit()
+
+    async def run():
+        async with AsyncSession(async_engine) as db:
+            return (
+                await stats.task_overview(db, user_id),
+                await stats.subject_stats(db, user_id),
+                await stats.subject_stats(db, user_id, math),
+                await stats.subject_stats(db, user_id, other_subject),
+            )
+
+    # Usuario sin contadores: todas las lecturas salen de la agregación directa
+    overview, by_subject, only_math, foreign = asyncio.run(run())
+    assert overview == _expected(math_tasks + loose_tasks, now)
+    assert by_subject == [
+        {"subject_id": str(physics), "subject_name": "Física", **_expected([], now)},
+        {"subject_id": str(math), "subject_name": "Matemáticas", **_expected(math_tasks, now)},
+    ]
+    assert only_math == by_subject[1:]
+    assert foreign == []
@@ -0,0 +1,142 @@
+import asyncio
+import json
+from typing import List
+
+import pytest
+from pydantic import BaseModel
+
+from app.services import structured_output as structured_module
+from app.services.llm_router import LLMResult
+from app.services.structured_output import (
+    complete_json,
+    complete_list,
+    complete_object,
+    missing_fields,
+    parse_partial_json,
+)
+
+
+class Card(BaseModel):
+    front: str
+    back: str
+
+
+class Analysis(BaseModel):
+    summary: str
+    steps: List[str]
+    difficulty: int
+
+
+class FakeLLM:
+    """Devuelve las respuestas en orden y guarda los mensajes de cada llamada"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    async def complete(self, messages, temperature, max_tokens, **params):
+        self.calls.append((messages, params))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        content, finish_reason = response if isinstance(response, tuple) else (response, "stop")
+        return LLMResult(content=content, tokens_used=None, model="fake", finish_reason=finish_reason)
+
+
+@pytest.fixture(autouse=True)
+def repair_settings(monkeypatch):
+    monkeypatch.setattr(structured_module.settings, "llm_json_mode", True)
+    monkeypatch.setattr(structured_module.settings, "llm_repair_attempts", 1)
+
+
+# =====================================================
+# PARSER INCREMENTAL
+# =====================================================
+
+def test_complete_json_inside_prose_and_fences():
+    text = 'Claro [nota]: aquí tienes\n```json\n{"cards": [{"front": "a", "back": "b"}]}\n```'
+    assert parse_partial_json(text) == ({"cards": [{"front": "a", "back": "b"}]}, True)
+
+
+def test_truncated_array_keeps_complete_items():
+    value, complete = parse_partial_json('[{"front": "a", "back": "b"}, {"front": "c", "ba')
+    assert (value, complete) == ([{"front": "a", "back": "b"}], False)
+
+
+def test_truncated_object_keeps_complete_keys_and_partial_lists():
+    value, complete = parse_partial_json('{"summary": "ok", "steps": ["uno", "dos", "tr')
+    assert (value, complete) == ({"summary": "ok", "steps": ["uno", "dos"]}, False)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": 1, "b": 12', {"a": 1}),       # el número final puede estar cortado
+    ('{"a": 1, "b": -', {"a": 1}),
+    ('{"a": 1, "b": 1.', {"a": 1}),
+    ('{"a": 1, "b": "caf\\u00', {"a": 1}),
+    ('{"a": 1, "b": tr', {"a": 1}),
+    ('{"a": 1, "b"', {"a": 1}),
+    ('{"a": "línea\nsin escapar"}', {"a": "línea\nsin escapar"}),
+])
+def test_cut_values_are_dropped(text, expected):
+    assert parse_partial_json(text)[0] == expected
+
+
+def test_bracketed_prose_is_not_a_truncated_value():
+    assert parse_partial_json('Ver [nota] y [1, abc] antes: {"a": [1, 2]}') == ({"a": [1, 2]}, True)
+
+
+def test_no_json_raises():
+    with pytest.raises(ValueError):
+        parse_partial_json("lo siento, no puedo ayudar con eso")
+
+
+def test_missing_fields_lists_top_level_keys():
+    assert missing_fields({"summary": "x", "steps": "no-lista"}, Analysis) == ["steps", "difficulty"]
+    assert missing_fields({"summary": "x", "steps": [], "difficulty": 2}, Analysis) == []
+
+
+# =====================================================
+# COMPLETIONS CON REPARACIÓN
+# =====================================================
+
+def test_length_cut_marks_result_incomplete():
+    llm = FakeLLM(('{"cards": []}', "length"))
+    assert asyncio.run(complete_json(llm, [], 0.2, 100)) == ({"cards": []}, False)
+    assert llm.calls[0][1] == {"response_format": {"type": "json_object"}}
+
+
+def test_failed_generation_from_provider_is_recovered():
+    error = Exception("json_validate_failed")
+    error.body = {"error": {"failed_generation": '{"cards": [{"front": "a", "back": "b"}, {"fr'}}
+    value, complete = asyncio.run(complete_json(FakeLLM(error), [], 0.2, 100))
+    assert value == {"cards": [{"front": "a", "back": "b"}]} and not complete
+
+
+def test_complete_list_asks_only_for_missing_items():
+    llm = FakeLLM(
+        ('{"cards": [{"front": "a", "back": "b"}, {"front": "sin respuesta"}, {"front": "c", "ba', "length"),
+        '{"cards": [{"front": "d", "back": "e"}, {"front": "f", "back": "g"}]}',
+    )
+    items = asyncio.run(complete_list(llm, [{"role": "user", "content": "3 tarjetas"}], Card, "cards", 3, 0.2, 100))
+
+    assert items == [{"front": "a", "back": "b"}, {"front": "d", "back": "e"}, {"front": "f", "back": "g"}]
+    repair = llm.calls[1][0]
+    assert json.loads(repair[-2]["content"]) == {"cards": [{"front": "a", "back": "b"}]}
+    assert "Faltan 2" in repair[-1]["content"]
+
+
+def test_complete_object_repairs_only_missing_fields():
+    llm = FakeLLM(
+        ('{"summary": "Repasar", "steps": ["leer", "resumir"], "difficu', "length"),
+        '{"difficulty": 3, "summary": "ignorado"}',
+    )
+    value = asyncio.run(complete_object(llm, [], Analysis, 0.2, 100))
+
+    assert value == {"summary": "Repasar", "steps": ["leer", "resumir"], "difficulty": 3}
+    assert "difficulty" in llm.calls[1][0][-1]["content"]
+
+
+def test_complete_object_gives_up_after_repair_attempts():
+    llm = FakeLLM('{"summary": "x"}', '{"steps": []}')
+    assert asyncio.run(complete_object(llm, [], Analysis, 0.2, 100)) is None
+    assert len(llm.calls) == 2
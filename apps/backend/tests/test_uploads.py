@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import os
+import time
+
+import pytest
+
+from app.services.storage_backends import LocalStorageBackend
+from app.services.uploads import ChunkedUploadStore, UploadError, UploadNotFound
+
+PART = 256 * 1024
+
+
+def _body(data: bytes, block: int = 64 * 1024):
+    async def chunks():
+        for start in range(0, len(data), block):
+            yield data[start:start + block]
+    return chunks()
+
+
+def _write(store, session, index, data, sha256=None):
+    return asyncio.run(store.write_part(session, index, _body(data), sha256))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChunkedUploadStore(str(tmp_path / "staging"), part_size=PART, max_bytes=4 * PART, ttl_seconds=60)
+
+
+def test_parts_in_any_order_assemble_and_store(store, tmp_path):
+    data = os.urandom(2 * PART + 1000)
+    session = store.create("u1", "docs", "u1/file.pdf", len(data), sha256=hashlib.sha256(data).hexdigest())
+    assert session.part_count == 3 and session.part_length(2) == 1000
+
+    for index in (2, 0, 1):
+        digest = _write(store, session, index, data[index * PART:(index + 1) * PART])
+        assert digest == hashlib.sha256(data[index * PART:(index + 1) * PART]).hexdigest()
+    assert store.received_parts(store.get(session.upload_id, "u1")) == [0, 1, 2]
+
+    completed = store.assemble(session)
+    assert completed.size_bytes == len(data)
+    assert completed.sha256 == hashlib.sha256(data).hexdigest()
+
+    storage = LocalStorageBackend(str(tmp_path / "storage"))
+    store.store(session, completed, storage)
+    assert (tmp_path / "storage" / "docs" / "u1" / "file.pdf").read_bytes() == data
+    with pytest.raises(UploadNotFound):
+        store.get(session.upload_id, "u1")
+
+
+def test_wrong_part_size_or_checksum_is_rejected(store):
+    session = store.create("u1", "docs", "a.bin", PART + 10)
+    with pytest.raises(UploadError):
+        _write(store, session, 0, b"x" * (PART + 1))
+    with pytest.raises(UploadError):
+        _write(store, session, 1, b"x" * 9)
+    with pytest.raises(UploadError):
+        _write(store, session, 1, b"x" * 10, sha256="0" * 64)
+    with pytest.raises(UploadError):
+        _write(store, session, 2, b"x")
+    # Ninguna parte rechazada queda en disco (ni sus temporales)
+    assert store.received_parts(session) == []
+    assert sorted(p.name for p in (store.root / session.upload_id).iterdir()) == ["manifest.json"]
+
+
+def test_assemble_reports_missing_parts_and_checksum(store):
+    data = b"y" * (PART + 5)
+    session = store.create("u1", "docs", "a.bin", len(data), sha256="0" * 64)
+    _write(store, session, 0, data[:PART])
+    with pytest.raises(UploadError, match="missing parts"):
+        store.assemble(session)
+    _write(store, session, 1, data[PART:])
+    with pytest.raises(UploadError, match="checksum"):
+        store.assemble(session)
+    assert not any(p.name.startswith("assembled-") for p in (store.root / session.upload_id).iterdir())
+
+
+def test_sessions_are_private_and_validated(store):
+    session = store.create("u1", "docs", "a.bin", 10)
+    with pytest.raises(UploadNotFound):
+        store.get(session.upload_id, "u2")
+    with pytest.raises(UploadNotFound):
+        store.get("../etc", "u1")
+    with pytest.raises(UploadError):
+        store.create("u1", "docs", "a.bin", 5 * PART)
+    with pytest.raises(UploadError):
+        store.create("u1", "docs", "a.bin", 10, part_size=1024)
+
+
+def test_purge_expired_removes_only_stale_sessions(store):
+    stale = store.create("u1", "docs", "old.bin", 10)
+    fresh = store.create("u1", "docs", "new.bin", 10)
+    old = time.time() - 120
+    os.utime(store.root / stale.upload_id, (old, old))
+
+    assert store.purge_expired() == 1
+    assert not (store.root / stale.upload_id).exists()
+    assert (store.root / fresh.upload_id).exists()
+
+
+def test_local_storage_rejects_paths_outside_the_root(tmp_path):
+    storage = LocalStorageBackend(str(tmp_path / "storage"))
+    source = tmp_path / "src.bin"
+    source.write_bytes(b"data")
+    with pytest.raises(ValueError):
+        storage.upload_from("docs", "../../escape.bin", str(source))
+    assert not (tmp_path / "escape.bin").exists()
+
+
+def test_abort_route_removes_parts_off_the_event_loop(store, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from app.auth import AuthUser, get_current_user
+    from app.main import app
+    from app.routes import storage as storage_routes
+
+    session = store.create("u1", "docs", "a.bin", PART + 10)
+    _write(store, session, 0, b"x" * PART)
+    on_loop = []
+    abort = store.abort
+
+    def tracked_abort(session):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        abort(session)
+
+    monkeypatch.setattr(store, "abort", tracked_abort)
+    monkeypatch.setattr(storage_routes, "upload_store", store)
+    app.dependency_overrides[get_current_user] = lambda: AuthUser(id="u1", email=None, raw={})
+    try:
+        http = TestClient(app)
+        assert http.delete(f"/files/uploads/{session.upload_id}").status_code == 200
+        assert http.delete(f"/files/uploads/{session.upload_id}").status_code == 404
+    finally:
+        app.dependency_overrides.clear()
+
+    assert not (store.root / session.upload_id).exists()
+    assert on_loop == [False]
@@ -0,0 +1,82 @@
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import asyncpg
+
+from app.models import Task as TaskModel
+from app.schemas import TaskCreate, TaskUpdate
+from app.services.urgency import DEFAULT_DURATION_HOURS, OPEN_STATUS_FILTER, _hours, task_urgency, urgency_scores
+
+NOW = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def _task(**fields) -> TaskModel:
+    # Igual que create_task: el modelo se construye con el dump del esquema
+    return TaskModel(user_id=uuid.uuid4(), **TaskCreate(title="a", **fields).model_dump())
+
+
+@pytest.mark.parametrize("text, hours", [
+    ("2 hours", 2.0),
+    ("90 minutes", 1.5),
+    ("1h 30m", 1.5),
+    ("2 horas", 2.0),
+    ("1 day 02:00:00", 26.0),
+    ("02:30:00", 2.5),
+    ("PT2H", 2.0),
+])
+def test_estimated_duration_is_parsed_to_timedelta(text, hours):
+    task = _task(estimated_duration=text)
+    assert task.estimated_duration == timedelta(hours=hours)
+
+
+def test_invalid_estimated_duration_is_rejected():
+    with pytest.raises(ValidationError):
+        TaskCreate(title="a", estimated_duration="un rato")
+
+
+def test_task_update_parses_estimated_duration():
+    update = TaskUpdate(estimated_duration="3 hours").model_dump(exclude_unset=True)
+    assert update == {"estimated_duration": timedelta(hours=3)}
+
+
+def test_task_urgency_with_estimated_duration():
+    due = NOW + timedelta(hours=30)
+    short = task_urgency(_task(due_date=due, estimated_duration="1 hour"), now=NOW)
+    long = task_urgency(_task(due_date=due, estimated_duration="24 hours"), now=NOW)
+    assert 0 <= short < long <= 100
+
+
+def test_task_urgency_without_estimate_or_due_date():
+    score = task_urgency(_task(priority="urgent"), now=NOW)
+    # Sin fecha límite solo cuentan prioridad y dificultad
+    assert score == pytest.approx(100 * (0.30 * 1.0 + 0.15 * 0.5))
+
+
+def test_hours_accepts_only_timedelta():
+    assert _hours(timedelta(minutes=30)) == 0.5
+    for value in (None, "2 hours", 7200, timedelta(0)):
+        assert _hours(value) == DEFAULT_DURATION_HOURS
+
+
+def test_urgency_scores_grow_as_deadline_approaches():
+    hours_left = np.array([np.nan, 240.0, 48.0, 2.0, -5.0])
+    ones = np.ones(len(hours_left))
+    scores = urgency_scores(hours_left, ones * 0.5, ones * 3.0, ones * 2.0)
+    assert np.all(np.diff(scores) >= 0)
+    assert scores[-1] == scores[-2]
+
+
+def test_task_update_parses_actual_duration():
+    update = TaskUpdate(actual_duration="45 min").model_dump(exclude_unset=True)
+    assert update == {"actual_duration": timedelta(minutes=45)}
+
+
+def test_open_status_filter_matches_the_partial_index_predicate():
+    compiled = select(TaskModel.id).where(TaskModel.user_id == "u1", OPEN_STATUS_FILTER).compile(dialect=asyncpg.dialect())
+    # Mismo predicado que idx_tasks_user_urgency, sin parámetros para el estado
+    assert "status IN ('pending', 'in_progress')" in str(compiled)
+    assert list(compiled.params) == ["user_id_1"]
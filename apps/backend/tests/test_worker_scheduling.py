@@ -0,0 +1,91 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app import worker
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class _NullSession:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(worker, "_redis_client", lambda: fake)
+    return fake
+
+
+def test_index_rebuilds_are_coalesced_per_user(redis, monkeypatch):
+    queued = []
+    monkeypatch.setattr(worker.rebuild_retrieval_index, "apply_async",
+                        lambda args, countdown: queued.append((args, countdown)))
+
+    assert worker.schedule_index_rebuild("u1") is True
+    assert worker.schedule_index_rebuild("u1") is False
+    assert worker.schedule_index_rebuild("u2") is True
+    assert queued == [(("u1",), worker.settings.retrieval_rebuild_delay_seconds),
+                      (("u2",), worker.settings.retrieval_rebuild_delay_seconds)]
+
+    # La reconstrucción libera la marca al empezar: las ediciones posteriores vuelven a encolar
+    monkeypatch.setattr(worker, "build_user_index", lambda db, user_id: 3)
+    monkeypatch.setattr(worker, "SessionLocal", lambda: _NullSession())
+    assert worker.rebuild_retrieval_index("u1") == {"user_id": "u1", "entries": 3}
+    assert worker.schedule_index_rebuild("u1") is True
+
+
+def test_failed_enqueue_releases_the_mark(redis, monkeypatch):
+    def broken(*args, **kwargs):
+        raise ConnectionError("broker down")
+
+    monkeypatch.setattr(worker.rebuild_retrieval_index, "apply_async", broken)
+    with pytest.raises(ConnectionError):
+        worker.schedule_index_rebuild("u1")
+    assert redis.values == {}
+
+
+def test_chat_summary_is_enqueued_once_per_chat(redis, monkeypatch):
+    queued = []
+    monkeypatch.setattr(worker.refresh_chat_summary, "delay", queued.append)
+
+    assert worker.schedule_chat_summary("c1") is True
+    assert worker.schedule_chat_summary("c1") is False
+    assert queued == ["c1"]
+
+
+def test_history_window_schedules_off_the_event_loop(monkeypatch):
+    from app.routes import chats
+
+    threads = []
+    monkeypatch.setattr(chats, "schedule_chat_summary", lambda chat_id: threads.append(threading.current_thread()))
+
+    class Db:
+        async def run_sync(self, fn, *args):
+            return SimpleNamespace(overflow=True)
+
+    async def run():
+        await chats._history_window(Db(), SimpleNamespace(id="c1"))
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(run())
+    assert len(threads) == 1 and threads[0] is not loop_thread
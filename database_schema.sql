@@ -82,6 +82,9 @@ CREATE TABLE public.tasks (
     progress_percentage INTEGER CHECK (progress_percentage >= 0 AND progress_percentage <= 100) DEFAULT 0,
     notes TEXT, -- Notas personales del estudiante
 
+    -- Urgencia (0-100) calculada por la API y refrescada por lotes en el worker
+    urgency_score DOUBLE PRECISION,
+
     created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL
 );
@@ -483,6 +486,19 @@ CREATE POLICY "Users can update own daily stats" ON public.daily_stats
 -- Índices para búsquedas comunes
 CREATE INDEX idx_tasks_user_due_date ON public.tasks(user_id, due_date) WHERE status != 'completed';
 CREATE INDEX idx_tasks_user_status ON public.tasks(user_id, status);
+-- Paginación keyset: mismo orden que los listados de la API
+CREATE INDEX idx_tasks_user_priority_due ON public.tasks(
+    user_id,
+    (CASE priority WHEN 'urgent' THEN 0 WHEN 'high' THEN 1 WHEN 'medium' THEN 2 WHEN 'low' THEN 3 ELSE 4 END),
+    due_date NULLS LAST,
+    id
+);
+CREATE INDEX idx_subjects_user_created ON public.subjects(user_id, created_at, id);
+-- "Qué hago ahora": tareas abiertas por urgencia
+CREATE INDEX idx_tasks_user_urgency ON public.tasks(user_id, urgency_score DESC NULLS LAST, id)
+    WHERE status IN ('pending', 'in_progress');
+-- Estadísticas por materia (subjects LEFT JOIN tasks)
+CREATE INDEX idx_tasks_subject_status ON public.tasks(subject_id, status, due_date);
 CREATE INDEX idx_flashcards_user_next_review ON public.flashcards(user_id, next_review_date);
 CREATE INDEX idx_study_sessions_user_date ON public.study_sessions(user_id, start_time);
 CREATE INDEX idx_calendar_events_user_date ON public.calendar_events(user_id, start_date);
@@ -524,6 +540,16 @@ CREATE TABLE public.chats (
     chat_type TEXT CHECK (chat_type IN ('general', 'task')) DEFAULT 'general',
     is_active BOOLEAN DEFAULT true,
 
+    -- Resumen acumulado de los mensajes fuera de la ventana de historial
+    summary TEXT,
+    summary_through_at TIMESTAMP WITH TIME ZONE, -- created_at del último mensaje resumido
+    summary_through_id UUID,
+
+    -- Proyección del último mensaje para listar chats sin consultar chat_messages
+    last_message_id UUID,
+    last_message_preview TEXT,
+    last_message_at TIMESTAMP WITH TIME ZONE,
+
     created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL
 );
@@ -620,7 +646,142 @@ CREATE POLICY "Users can insert messages in own chats" ON public.chat_messages
 -- Índices para chats
 CREATE INDEX idx_chats_user_type ON public.chats(user_id, chat_type);
 CREATE INDEX idx_chats_task ON public.chats(task_id) WHERE task_id IS NOT NULL;
-CREATE INDEX idx_chat_messages_chat_created ON public.chat_messages(chat_id, created_at);
+CREATE INDEX idx_chats_user_updated ON public.chats(user_id, updated_at DESC, id DESC);
+CREATE INDEX idx_chat_messages_chat_created ON public.chat_messages(chat_id, created_at, id);
+
+-- =====================================================
+-- 9. DOCUMENTOS E INGESTA DE ARCHIVOS
+-- =====================================================
+
+-- Archivos subidos a Storage y su estado de ingesta
+CREATE TABLE public.documents (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    user_id UUID REFERENCES public.profiles(id) ON DELETE CASCADE NOT NULL,
+    task_id UUID REFERENCES public.tasks(id) ON DELETE SET NULL,
+
+    bucket TEXT NOT NULL DEFAULT 'files',
+    path TEXT NOT NULL,
+    filename TEXT,
+    mime_type TEXT,
+
+    status TEXT CHECK (status IN ('pending', 'processing', 'ready', 'failed')) DEFAULT 'pending',
+    error TEXT,
+    size_bytes BIGINT,
+    page_count INTEGER,
+    chunk_count INTEGER,
+    content_sha256 TEXT, -- sha256 del archivo: los duplicados reutilizan los chunks
+
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL
+);
+
+-- Fragmentos de texto extraídos (con solapamiento) de cada documento
+CREATE TABLE public.document_chunks (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    document_id UUID REFERENCES public.documents(id) ON DELETE CASCADE NOT NULL,
+    user_id UUID REFERENCES public.profiles(id) ON DELETE CASCADE NOT NULL,
+
+    chunk_index INTEGER NOT NULL,
+    page_start INTEGER,
+    page_end INTEGER,
+    content TEXT NOT NULL,
+    content_hash TEXT NOT NULL, -- sha256 del contenido
+    overlap_chars INTEGER DEFAULT 0, -- Caracteres repetidos del chunk anterior
+
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL,
+    UNIQUE(document_id, chunk_index)
+);
+
+CREATE TRIGGER handle_updated_at_documents
+    BEFORE UPDATE ON public.documents
+    FOR EACH ROW EXECUTE PROCEDURE public.handle_updated_at();
+
+ALTER TABLE public.documents ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.document_chunks ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view own documents" ON public.documents
+    FOR SELECT USING (auth.uid() = user_id);
+
+CREATE POLICY "Users can insert own documents" ON public.documents
+    FOR INSERT WITH CHECK (auth.uid() = user_id);
+
+CREATE POLICY "Users can delete own documents" ON public.documents
+    FOR DELETE USING (auth.uid() = user_id);
+
+CREATE POLICY "Users can view own document chunks" ON public.document_chunks
+    FOR SELECT USING (auth.uid() = user_id);
+
+CREATE INDEX idx_documents_user_task ON public.documents(user_id, task_id);
+CREATE INDEX idx_document_chunks_user ON public.document_chunks(user_id);
+CREATE INDEX idx_document_chunks_hash ON public.document_chunks(content_hash);
+-- Búsqueda de un archivo ya ingerido por su hash (del usuario o de cualquiera)
+CREATE INDEX idx_documents_content_hash ON public.documents(content_sha256, user_id) WHERE status = 'ready';
+
+-- =====================================================
+-- 10. CONTADORES DE ESTADÍSTICAS
+-- =====================================================
+
+-- Contadores por usuario y materia; la API los actualiza por deltas al escribir tareas
+-- y el worker los reconcilia periódicamente (reconcile_task_counters)
+CREATE TABLE public.task_counters (
+    user_id UUID REFERENCES public.profiles(id) ON DELETE CASCADE NOT NULL,
+    subject_key UUID NOT NULL, -- 00000000-0000-0000-0000-000000000000 para tareas sin materia
+
+    total_tasks INTEGER NOT NULL DEFAULT 0,
+    completed_tasks INTEGER NOT NULL DEFAULT 0,
+    pending_tasks INTEGER NOT NULL DEFAULT 0,
+    overdue_tasks INTEGER NOT NULL DEFAULT 0, -- abiertas con due_date < overdue_as_of
+    overdue_as_of TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL,
+    reconciled_at TIMESTAMP WITH TIME ZONE,
+
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL,
+    PRIMARY KEY (user_id, subject_key)
+);
+
+ALTER TABLE public.task_counters ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view own task counters" ON public.task_counters
+    FOR SELECT USING (auth.uid() = user_id);
+
+-- =====================================================
+-- 11. BANCO DE PREGUNTAS COMPARTIDO
+-- =====================================================
+
+-- Preguntas generadas reutilizables por todos los estudiantes de una misma materia/tema
+CREATE TABLE public.question_bank (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    bank_key TEXT NOT NULL, -- materia|tema|dificultad normalizados
+    subject_name TEXT,
+    topic TEXT,
+    difficulty INTEGER,
+    question_type TEXT,
+
+    question JSONB NOT NULL,
+    question_hash TEXT NOT NULL, -- sha256 del enunciado normalizado
+    minhash BIGINT[] NOT NULL, -- Firma MinHash del enunciado (casi duplicados)
+    source TEXT CHECK (source IN ('generated', 'quiz')) DEFAULT 'generated',
+    times_served INTEGER DEFAULT 0,
+
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL,
+    UNIQUE(bank_key, question_hash)
+);
+
+-- Qué preguntas del banco ya vio cada usuario
+CREATE TABLE public.question_bank_seen (
+    user_id UUID REFERENCES public.profiles(id) ON DELETE CASCADE NOT NULL,
+    question_id UUID REFERENCES public.question_bank(id) ON DELETE CASCADE NOT NULL,
+    seen_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL,
+    PRIMARY KEY (user_id, question_id)
+);
+
+-- El banco no contiene datos de usuarios; solo lo lee y escribe la API (service role)
+ALTER TABLE public.question_bank ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.question_bank_seen ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view own seen questions" ON public.question_bank_seen
+    FOR SELECT USING (auth.uid() = user_id);
+
+CREATE INDEX idx_question_bank_key ON public.question_bank(bank_key, times_served, id);
 
 -- =====================================================
 -- FIN DEL SCHEMA ACTUALIZADO
@@ -632,4 +793,9 @@ CREATE INDEX idx_chat_messages_chat_created ON public.chat_messages(chat_id, cre
 -- 3. Verifica que las políticas RLS estén funcionando correctamente
 -- 4. Considera configurar backups automáticos para la base de datos
 -- 5. Los chats se crean automáticamente para cada tarea nueva
--- 6. Hay un chat general por usuario que se crea automáticamente
\ No newline at end of file
+-- 6. Hay un chat general por usuario que se crea automáticamente
+-- 7. chats.last_message_* lo mantiene la API al guardar mensajes (listado de chats en una sola consulta)
+-- 8. Un archivo repetido (mismo documents.content_sha256) no se vuelve a extraer: se copian sus chunks
+--    y en tasks.attachments se guarda la referencia {document_id, bucket, path, filename, sha256}
+-- 9. El banco de preguntas (question_bank) es compartido entre usuarios: solo guarda preguntas generadas
+--    a partir de materia/tema, nunca contenido de documentos; question_bank_seen evita repetirlas a un usuario